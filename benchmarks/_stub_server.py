@@ -0,0 +1,114 @@
+"""Local stub of the OpenAI embeddings endpoint, for benchmarks."""
+
+__all__ = ['StubServer']
+
+import base64
+import datetime
+import http
+import http.server
+import ssl
+import threading
+import time
+
+import numpy as np
+import orjson
+
+import embed
+
+_EMBEDDING = np.full(embed.DIMENSION, embed.DIMENSION**-0.5, dtype=np.float32)
+"""Normalized vector the stub server returns as the embedding of every text."""
+
+_EMBEDDING_BASE64 = base64.b64encode(_EMBEDDING.tobytes()).decode('ascii')
+"""``_EMBEDDING``, as sent if ``encoding_format='base64'`` is requested."""
+
+
+class _Handler(http.server.BaseHTTPRequestHandler):
+    """Handler that responds to every POST with fake embeddings."""
+
+    protocol_version = 'HTTP/1.1'  # Support keep-alive.
+
+    disable_nagle_algorithm = True  # Avoid delayed-ACK stalls on keep-alive.
+
+    def do_POST(self):  # pylint: disable=invalid-name  # Name set by base.
+        """Respond to an embeddings request after the simulated latency."""
+        length = int(self.headers['Content-Length'])
+        request = orjson.loads(self.rfile.read(length))
+        time.sleep(self.server.latency.total_seconds())
+
+        texts = request['input']
+        if isinstance(texts, str):
+            texts = [texts]
+
+        if request.get('encoding_format') == 'base64':
+            embedding = _EMBEDDING_BASE64
+        else:
+            embedding = _EMBEDDING
+
+        data = [
+            {'object': 'embedding', 'index': index, 'embedding': embedding}
+            for index in range(len(texts))
+        ]
+        body = orjson.dumps({
+            'object': 'list',
+            'data': data,
+            'model': 'text-embedding-ada-002',
+        }, option=orjson.OPT_SERIALIZE_NUMPY)
+
+        self.send_response(http.HTTPStatus.OK)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):  # pylint: disable=redefined-builtin
+        """Don't log each request."""
+
+
+class _Server(http.server.ThreadingHTTPServer):
+    """Threaded HTTP server that can queue many simultaneous connections."""
+
+    daemon_threads = True
+    request_queue_size = 256
+
+
+class StubServer:
+    """
+    Threaded HTTP server on localhost that imitates the embeddings endpoint.
+
+    Use it in a ``with`` statement. On entry, it starts serving in a background
+    thread. Every request is answered after ``latency``, to simulate network
+    round trips to the real API. If ``certfile``, a PEM file with a certificate
+    and its private key, is given, it serves HTTPS instead of HTTP.
+    """
+
+    def __init__(self, latency=datetime.timedelta(milliseconds=50), *,
+                 certfile=None):
+        """Create a server (that is not yet serving) with the given latency."""
+        self._server = _Server(('127.0.0.1', 0), _Handler)
+        self._server.latency = latency
+        self._scheme = 'http'
+        if certfile is not None:
+            context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+            context.load_cert_chain(certfile)
+            self._server.socket = context.wrap_socket(
+                self._server.socket, server_side=True,
+                do_handshake_on_connect=False)  # Handshake in handler thread.
+            self._scheme = 'https'
+        self._thread = threading.Thread(target=self._server.serve_forever)
+
+    def __enter__(self):
+        """Start serving."""
+        self._thread.start()
+        return self
+
+    def __exit__(self, *_):
+        """Stop serving."""
+        self._server.shutdown()
+        self._thread.join()
+        self._server.server_close()
+
+    @property
+    def url(self):
+        """URL of the fake embeddings endpoint."""
+        host, port = self._server.server_address
+        return f'{self._scheme}://{host}:{port}/v1/embeddings'
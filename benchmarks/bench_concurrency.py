@@ -0,0 +1,64 @@
+#!/usr/bin/env python
+
+"""
+Benchmark of concurrent chunk dispatch in ``embed_many_req``.
+
+This embeds the same texts in chunks against a local stub server, with
+increasing ``max_workers``, and reports throughput. Since the stub answers each
+request after a fixed latency, throughput should scale with the worker count
+until some other cost dominates.
+
+Run it from the top-level directory of the repository:
+
+    python -m benchmarks.bench_concurrency
+"""
+
+import argparse
+import datetime
+import time
+from unittest.mock import patch
+
+from benchmarks._stub_server import StubServer
+import embed
+
+
+def _parse_args():
+    """Parse command-line arguments."""
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[1])
+    parser.add_argument('--texts', type=int, default=512,
+                        help='number of texts to embed per run')
+    parser.add_argument('--chunk', type=int, default=16,
+                        help='maximum number of texts per request')
+    parser.add_argument('--latency-ms', type=float, default=50.0,
+                        help='simulated per-request latency')
+    parser.add_argument('--workers', type=int, nargs='+',
+                        default=[1, 2, 4, 8, 16, 32],
+                        help='worker counts to try')
+    return parser.parse_args()
+
+
+def main():
+    """Run the benchmark and print a table of results."""
+    args = _parse_args()
+    texts = [f'Benchmark text {index}.' for index in range(args.texts)]
+    latency = datetime.timedelta(milliseconds=args.latency_ms)
+
+    with StubServer(latency) as server:
+        with patch.object(embed, '_EMBEDDINGS_URL', server.url):
+            print('workers  seconds  texts/s  speedup')
+            baseline = None
+            for workers in args.workers:
+                start = time.perf_counter()
+                embed.embed_many_req(
+                    texts, max_items=args.chunk, max_workers=workers)
+                elapsed = time.perf_counter() - start
+                if baseline is None:
+                    baseline = elapsed
+                throughput = len(texts) / elapsed
+                speedup = baseline / elapsed
+                print(f'{workers:7d}  {elapsed:7.3f}  {throughput:7.1f}  '
+                      f'{speedup:6.2f}x')
+
+
+if __name__ == '__main__':
+    main()
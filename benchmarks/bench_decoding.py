@@ -0,0 +1,84 @@
+#!/usr/bin/env python
+
+"""
+Benchmark of decoding embeddings API responses.
+
+This builds a response body for a batch of embeddings and times turning it into
+a float32 matrix: with the standard library parser and ``np.array`` (as
+``embed_many_req`` used to), with ``embed._parse_embeddings`` on the same
+body, and with ``embed._parse_embeddings`` on a base64-encoded body.
+
+Run it from the top-level directory of the repository:
+
+    python -m benchmarks.bench_decoding
+"""
+
+import argparse
+import base64
+import json
+import timeit
+
+import numpy as np
+import orjson
+
+import embed
+
+
+def _parse_args():
+    """Parse command-line arguments."""
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[1])
+    parser.add_argument('--rows', type=int, default=1000,
+                        help='number of embeddings in the response')
+    parser.add_argument('--repeat', type=int, default=5,
+                        help='number of times to time each decoder')
+    return parser.parse_args()
+
+
+def _make_body(embeddings, encode):
+    """Make a response body holding the embeddings, encoded by ``encode``."""
+    return orjson.dumps({
+        'data': [
+            {'index': index, 'embedding': encode(embedding)}
+            for index, embedding in enumerate(embeddings)
+        ],
+    })
+
+
+def _decode_stdlib(content):
+    """Decode a response the way ``embed_many_req`` originally did."""
+    data = json.loads(content)['data']
+    return np.array([datum['embedding'] for datum in data], dtype=np.float32)
+
+
+def main():
+    """Run the benchmark and print a table of results."""
+    args = _parse_args()
+    rng = np.random.default_rng(0)
+    embeddings = rng.standard_normal((args.rows, embed.DIMENSION))
+    embeddings = embeddings.astype(np.float32)
+
+    float_body = _make_body(embeddings, np.ndarray.tolist)
+    base64_body = _make_body(
+        embeddings, lambda row: base64.b64encode(row.tobytes()).decode())
+
+    # pylint: disable=protected-access  # Benchmarking the private parser.
+    decoders = [
+        ('stdlib json, float', _decode_stdlib, float_body),
+        ('orjson, float', embed._parse_embeddings, float_body),
+        ('orjson, base64', embed._parse_embeddings, base64_body),
+    ]
+
+    print(f'{"decoder":20}  {"body MB":>7}  {"ms":>8}  {"rows/s":>9}')
+    for name, decode, body in decoders:
+        np.testing.assert_array_equal(decode(body), embeddings)
+        seconds = min(timeit.repeat(
+            lambda: decode(body),  # pylint: disable=cell-var-from-loop
+            number=1,
+            repeat=args.repeat,
+        ))
+        print(f'{name:20}  {len(body) / 2**20:7.2f}  {seconds * 1000:8.2f}  '
+              f'{args.rows / seconds:9.0f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,130 @@
+#!/usr/bin/env python
+
+"""
+Benchmark of recall and speed of ``IVFIndex``, against ``ExactIndex``.
+
+This trains an ``IVFIndex`` on a sample of the rows, adds all the rows, and for
+each of several values of ``n_probe`` reports the queries per second and the
+recall@k: the fraction of the true ``k`` nearest neighbors, found by
+``ExactIndex``, that are found.
+
+By default, the rows are random vectors near random centers, since a random
+unit vector has no nearby neighbors to find. To use real embeddings instead,
+pass a cache directory, such as ``tests_data``, with ``--source``, and its
+safetensors entries are used (as many times over as needed, with noise added
+to make the copies differ). Queries are rows with noise added.
+
+Run it from the top-level directory of the repository:
+
+    python -m benchmarks.bench_ivf
+"""
+
+import argparse
+from pathlib import Path
+import time
+
+import numpy as np
+import safetensors.numpy
+
+import embed
+from embed import search
+
+_N_PROBES = [1, 2, 4, 8, 16, 32, 64]
+"""Numbers of inverted lists searched per query."""
+
+_NOISE = 0.02
+"""Standard deviation of noise added to each element of copies and queries."""
+
+
+def _parse_args():
+    """Parse command-line arguments."""
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[1])
+    parser.add_argument('--count', type=int, default=200_000,
+                        help='number of rows searched')
+    parser.add_argument('--queries', type=int, default=1000,
+                        help='number of queries searched for')
+    parser.add_argument('-k', type=int, default=10,
+                        help='number of results per query')
+    parser.add_argument('--lists', type=int,
+                        help='number of inverted lists (default: sqrt(count))')
+    parser.add_argument('--source', type=Path,
+                        help='cache directory of real embeddings to use')
+    return parser.parse_args()
+
+
+def _clustered_embeddings(count, rng):
+    """Make random vectors near random centers, as fake embeddings."""
+    centers = rng.standard_normal((max(1, count // 1000), embed.DIMENSION),
+                                  np.float32)
+    rows = centers[rng.integers(len(centers), size=count)]
+    rows += rng.standard_normal(rows.shape, np.float32)
+    return rows
+
+
+def _source_embeddings(count, source, rng):
+    """Get real embeddings from safetensors entries, repeating with noise."""
+    rows = [safetensors.numpy.load_file(path)['embeddings'].reshape(
+                -1, embed.DIMENSION)
+            for path in sorted(source.glob('*.safetensors'))]
+    if not rows:
+        raise ValueError(f'no safetensors entries in {source}')
+    embeddings = np.resize(np.concatenate(rows), (count, embed.DIMENSION))
+    return embeddings + _NOISE * rng.standard_normal(embeddings.shape,
+                                                     np.float32)
+
+
+def _recall(indices, expected_indices):
+    """Get the fraction of expected results that were found."""
+    found = sum(len(set(row) & set(expected_row))
+                for row, expected_row in zip(indices, expected_indices))
+    return found / expected_indices.size
+
+
+def _timed_search(index, queries, k, **kwargs):
+    """Search, and also return the number of seconds it took."""
+    start = time.perf_counter()
+    results = index.search(queries, k, **kwargs)
+    return results, time.perf_counter() - start
+
+
+def main():
+    """Run the benchmark and print a table of results."""
+    args = _parse_args()
+    rng = np.random.default_rng(0)
+    if args.source is None:
+        embeddings = _clustered_embeddings(args.count, rng)
+    else:
+        embeddings = _source_embeddings(args.count, args.source, rng)
+    queries = embeddings[rng.integers(args.count, size=args.queries)]
+    queries = queries + _NOISE * rng.standard_normal(queries.shape,
+                                                     np.float32)
+    n_lists = args.lists or max(1, round(args.count**0.5))
+
+    exact = search.ExactIndex(embeddings)
+    expected, seconds = _timed_search(exact, queries, args.k)
+
+    start = time.perf_counter()
+    sample = embeddings[rng.choice(args.count, min(args.count, 50 * n_lists),
+                                   replace=False)]
+    index = search.IVFIndex.train(sample, n_lists=n_lists)
+    index.add(embeddings)
+    index.search(queries[:1], 1)  # Merge the added rows into their lists.
+    print(f'Built IVF index of {n_lists} lists'
+          f' in {time.perf_counter() - start:.1f} s.')
+
+    print(f'{"index":12}  {"n_probe":>7}  {f"recall@{args.k}":>9}'
+          f'  {"QPS":>9}')
+    print(f'{"exact":12}  {"":7}  {1.0:9.3f}'
+          f'  {args.queries / seconds:9.0f}')
+    for n_probe in _N_PROBES:
+        if n_probe > n_lists:
+            break
+        results, seconds = _timed_search(index, queries, args.k,
+                                         n_probe=n_probe)
+        print(f'{"ivf":12}  {n_probe:7}'
+              f'  {_recall(results.indices, expected.indices):9.3f}'
+              f'  {args.queries / seconds:9.0f}')
+
+
+if __name__ == '__main__':
+    main()
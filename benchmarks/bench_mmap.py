@@ -0,0 +1,143 @@
+#!/usr/bin/env python
+
+"""
+Benchmark of loading cached safetensors batches, with and without mmap.
+
+This caches a large fake batch of embeddings with ``embed.cached.embed_many``,
+then times loading it again with each ``mmap_mode``: ``None`` (read into
+memory, the default), ``'r'`` (read-only mapping), and ``'c'`` (copy-on-write
+mapping). It also reports how much each mode grows the peak resident set size
+(RSS) of a fresh process that holds several loaded copies of the batch and
+reads one row of each. RSS is not reported on Windows.
+
+Run it from the top-level directory of the repository:
+
+    python -m benchmarks.bench_mmap
+"""
+
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+import timeit
+from unittest.mock import patch
+
+import numpy as np
+
+import embed
+from embed import cached
+
+try:
+    import resource
+except ImportError:  # Windows.
+    resource = None
+
+_MODES = {'none': None, 'r': 'r', 'c': 'c'}
+"""Names (usable on the command line) of the values of ``mmap_mode``."""
+
+
+def _parse_args():
+    """Parse command-line arguments."""
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[1])
+    parser.add_argument('--rows', type=int, default=10_000,
+                        help='number of embeddings in the cached batch')
+    parser.add_argument('--repeat', type=int, default=5,
+                        help='number of times to time each mode')
+    parser.add_argument('--hold', type=int, default=4,
+                        help='number of loaded copies held when measuring RSS')
+    parser.add_argument('--child', choices=_MODES, help=argparse.SUPPRESS)
+    parser.add_argument('--data-dir', help=argparse.SUPPRESS)
+    return parser.parse_args()
+
+
+def _make_texts(count):
+    """Make the texts whose fake embeddings are cached."""
+    return [f'Benchmark text {index}.' for index in range(count)]
+
+
+def _fake_embed_many(texts):
+    """Make random float32 "embeddings" quickly, without calling the API."""
+    rng = np.random.default_rng(0)
+    return rng.standard_normal((len(texts), embed.DIMENSION), np.float32)
+
+
+def _peak_rss_mb():
+    """Get this process's peak RSS in MiB, or ``None`` if not supported."""
+    try:
+        # On Linux, ru_maxrss can include the peak of the parent process.
+        with open('/proc/self/status', encoding='utf-8') as file:
+            for line in file:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) / 2**10  # From KiB.
+    except FileNotFoundError:
+        pass
+
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    scale = 1 if sys.platform == 'darwin' else 2**10  # Bytes or KiB.
+    return peak * scale / 2**20
+
+
+def _run_child(args):
+    """Load and hold copies of the batch. Print the peak RSS growth in MiB."""
+    texts = _make_texts(args.rows)
+    mmap_mode = _MODES[args.child]
+    before = _peak_rss_mb()
+    held = [
+        cached.embed_many(texts, data_dir=args.data_dir, mmap_mode=mmap_mode)
+        for _ in range(args.hold)
+    ]
+    total = sum(float(embeddings[-1].sum()) for embeddings in held)
+    after = _peak_rss_mb()
+    print(f'{after - before} {total}')
+
+
+def _measure_rss(args, data_dir, mode_name):
+    """Run a child process to measure RSS growth. Return it, or ``None``."""
+    if resource is None:
+        return None
+    output = subprocess.run(
+        [sys.executable, '-m', 'benchmarks.bench_mmap',
+         '--rows', str(args.rows), '--hold', str(args.hold),
+         '--child', mode_name, '--data-dir', data_dir],
+        check=True,
+        capture_output=True,
+        text=True,
+    ).stdout
+    return float(output.split()[0])
+
+
+def main():
+    """Run the benchmark and print a table of results."""
+    args = _parse_args()
+    if args.child is not None:
+        _run_child(args)
+        return
+
+    texts = _make_texts(args.rows)
+    with tempfile.TemporaryDirectory() as data_dir:
+        with patch.object(embed, 'embed_many', _fake_embed_many):
+            expected = cached.embed_many(texts, data_dir=data_dir)
+
+        size = sum(entry.stat().st_size for entry in os.scandir(data_dir)
+                   if entry.is_file())
+        print(f'cached batch: {args.rows} rows, {size / 2**20:.1f} MiB')
+        print(f'{"mmap_mode":9}  {"load ms":>8}  '
+              f'{f"RSS MiB x{args.hold}":>12}')
+
+        for mode_name, mmap_mode in _MODES.items():
+            def load(mmap_mode=mmap_mode):
+                return cached.embed_many(
+                    texts, data_dir=data_dir, mmap_mode=mmap_mode)
+
+            np.testing.assert_array_equal(load(), expected)
+            seconds = min(timeit.repeat(load, number=1, repeat=args.repeat))
+            rss = _measure_rss(args, data_dir, mode_name)
+            rss_column = 'n/a' if rss is None else f'{rss:.1f}'
+            print(f'{mode_name:9}  {seconds * 1000:8.2f}  {rss_column:>12}')
+
+
+if __name__ == '__main__':
+    main()
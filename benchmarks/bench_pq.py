@@ -0,0 +1,142 @@
+#!/usr/bin/env python
+
+"""
+Benchmark of memory use, recall, and speed of ``PQIndex``, against exact.
+
+This trains a ``PQIndex`` on a sample of the rows and adds all the rows. It
+reports the memory each index takes per embedding and in total, and, with and
+without re-ranking different numbers of candidates by their exact similarities,
+the queries per second and the recall@k: the fraction of the true ``k`` nearest
+neighbors, found by ``ExactIndex``, that are found.
+
+By default, the rows are random combinations of a few random directions, plus
+noise, since real embeddings vary in far fewer directions than they have
+dimensions, and a random unit vector has no nearby neighbors to find. To use
+real embeddings instead, pass a cache directory, such as ``tests_data``, with
+``--source``, and its safetensors entries are used (as many times over as
+needed, with noise added to make the copies differ). Queries are rows with
+noise added.
+
+Run it from the top-level directory of the repository:
+
+    python -m benchmarks.bench_pq
+"""
+
+import argparse
+from pathlib import Path
+import time
+
+import numpy as np
+import safetensors.numpy
+
+import embed
+from embed import search
+
+_RERANKS = [0, 50, 100, 200, 500]
+"""Numbers of candidates re-ranked per query (0 for none)."""
+
+_DIRECTIONS = 64
+"""Number of random directions fake embeddings are combinations of."""
+
+_NOISE = 0.02
+"""Standard deviation of noise added to each element of copies and queries."""
+
+
+def _parse_args():
+    """Parse command-line arguments."""
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[1])
+    parser.add_argument('--count', type=int, default=200_000,
+                        help='number of rows searched')
+    parser.add_argument('--queries', type=int, default=1000,
+                        help='number of queries searched for')
+    parser.add_argument('-k', type=int, default=10,
+                        help='number of results per query')
+    parser.add_argument('--subvectors', type=int,
+                        default=search.DEFAULT_N_SUBVECTORS,
+                        help='number of one-byte codes per embedding')
+    parser.add_argument('--train', type=int, default=10_000,
+                        help='number of rows to train the index on')
+    parser.add_argument('--source', type=Path,
+                        help='cache directory of real embeddings to use')
+    return parser.parse_args()
+
+
+def _structured_embeddings(count, rng):
+    """Make random combinations of a few directions, as fake embeddings."""
+    directions = rng.standard_normal((_DIRECTIONS, embed.DIMENSION),
+                                     np.float32)
+    rows = rng.standard_normal((count, _DIRECTIONS), np.float32) @ directions
+    rows += rng.standard_normal(rows.shape, np.float32)
+    return rows
+
+
+def _source_embeddings(count, source, rng):
+    """Get real embeddings from safetensors entries, repeating with noise."""
+    rows = [safetensors.numpy.load_file(path)['embeddings'].reshape(
+                -1, embed.DIMENSION)
+            for path in sorted(source.glob('*.safetensors'))]
+    if not rows:
+        raise ValueError(f'no safetensors entries in {source}')
+    embeddings = np.resize(np.concatenate(rows), (count, embed.DIMENSION))
+    return embeddings + _NOISE * rng.standard_normal(embeddings.shape,
+                                                     np.float32)
+
+
+def _recall(indices, expected_indices):
+    """Get the fraction of expected results that were found."""
+    found = sum(len(set(row) & set(expected_row))
+                for row, expected_row in zip(indices, expected_indices))
+    return found / expected_indices.size
+
+
+def _timed_search(index, queries, k, **kwargs):
+    """Search, and also return the number of seconds it took."""
+    start = time.perf_counter()
+    results = index.search(queries, k, **kwargs)
+    return results, time.perf_counter() - start
+
+
+def main():
+    """Run the benchmark and print a table of results."""
+    args = _parse_args()
+    rng = np.random.default_rng(0)
+    if args.source is None:
+        embeddings = _structured_embeddings(args.count, rng)
+    else:
+        embeddings = _source_embeddings(args.count, args.source, rng)
+    queries = embeddings[rng.integers(args.count, size=args.queries)]
+    queries = queries + _NOISE * rng.standard_normal(queries.shape,
+                                                     np.float32)
+
+    exact = search.ExactIndex(embeddings)
+    expected, seconds = _timed_search(exact, queries, args.k)
+
+    start = time.perf_counter()
+    sample = embeddings[rng.choice(args.count, min(args.count, args.train),
+                                   replace=False)]
+    index = search.PQIndex.train(sample, n_subvectors=args.subvectors)
+    index.add(embeddings)
+    index.search(queries[:1], 1)  # Merge the added rows' codes.
+    print(f'Built PQ index of {args.subvectors} subvectors'
+          f' in {time.perf_counter() - start:.1f} s.')
+
+    exact_bytes = exact.embeddings.nbytes
+    # pylint: disable-next=protected-access  # Just to measure them.
+    pq_bytes = index._codes.nbytes + index._ids.nbytes
+    print(f'{"index":12}  {"rerank":>6}  {"B/row":>6}  {"MiB":>8}'
+          f'  {f"recall@{args.k}":>9}  {"QPS":>9}')
+    print(f'{"exact":12}  {"":6}  {exact_bytes / args.count:6.0f}'
+          f'  {exact_bytes / 2**20:8.1f}  {1.0:9.3f}'
+          f'  {args.queries / seconds:9.0f}')
+    for rerank in _RERANKS:
+        results, seconds = _timed_search(
+            index, queries, args.k, rerank=rerank,
+            fetch=lambda ids: embeddings[ids])
+        print(f'{"pq":12}  {rerank:6}  {pq_bytes / args.count:6.0f}'
+              f'  {pq_bytes / 2**20:8.1f}'
+              f'  {_recall(results.indices, expected.indices):9.3f}'
+              f'  {args.queries / seconds:9.0f}')
+
+
+if __name__ == '__main__':
+    main()
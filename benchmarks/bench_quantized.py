@@ -0,0 +1,134 @@
+#!/usr/bin/env python
+
+"""
+Benchmark of reduced-precision file types, against float32 safetensors files.
+
+This caches an entry per text, with ``embed.cached.embed_many`` and
+``per_text=True``, in each of the ``'safetensors'``, ``'float16'``, ``'int8'``,
+and ``'json'`` file types. For each, it reports the disk space used, how fast a
+batch of entries is loaded, and how much the cosine similarities between loaded
+entries differ from those between the original embeddings.
+
+By default, the embeddings are random unit vectors. Real embeddings can differ:
+those of ``text-embedding-ada-002`` have a few elements of much larger
+magnitude than the rest, which makes ``'int8'`` less precise. To measure that,
+pass a cache directory, such as ``tests_data``, with ``--source``, and its
+safetensors entries are used (as many times over as needed).
+
+Run it from the top-level directory of the repository:
+
+    python -m benchmarks.bench_quantized
+"""
+
+import argparse
+import os
+from pathlib import Path
+import tempfile
+import timeit
+from unittest.mock import patch
+
+import numpy as np
+import safetensors.numpy
+
+import embed
+from embed import cached
+
+_FILE_TYPES = ['safetensors', 'float16', 'int8', 'json']
+"""File types compared."""
+
+
+def _parse_args():
+    """Parse command-line arguments."""
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[1])
+    parser.add_argument('--count', type=int, default=10_000,
+                        help='number of entries cached')
+    parser.add_argument('--batch', type=int, default=1000,
+                        help='number of entries loaded by each embed_many')
+    parser.add_argument('--repeat', type=int, default=5,
+                        help='number of times to time loading')
+    parser.add_argument('--source', type=Path,
+                        help='cache directory of real embeddings to use')
+    return parser.parse_args()
+
+
+def _make_texts(count):
+    """Make the texts whose embeddings are cached."""
+    return [f'Benchmark text {index}.' for index in range(count)]
+
+
+def _random_embeddings(count):
+    """Make random unit vectors, as fake embeddings."""
+    rng = np.random.default_rng(0)
+    embeddings = rng.standard_normal((count, embed.DIMENSION), np.float32)
+    return embeddings / np.linalg.norm(embeddings, axis=1, keepdims=True)
+
+
+def _source_embeddings(count, source):
+    """Get real embeddings from safetensors entries, repeating as needed."""
+    rows = [safetensors.numpy.load_file(path)['embeddings'].reshape(
+                -1, embed.DIMENSION)
+            for path in sorted(source.glob('*.safetensors'))]
+    if not rows:
+        raise ValueError(f'no safetensors entries in {source}')
+    embeddings = np.concatenate(rows)
+    return np.resize(embeddings, (count, embed.DIMENSION))
+
+
+def _disk_usage_mb(data_dir):
+    """Get the total size in MiB of the files in a directory."""
+    size = sum(entry.stat().st_size for entry in os.scandir(data_dir)
+               if entry.is_file())
+    return size / 2**20
+
+
+def _cosines(embeddings):
+    """Get the cosine similarities of the rows of a matrix to each other."""
+    unit = embeddings / np.linalg.norm(embeddings, axis=1, keepdims=True)
+    return unit @ unit.T
+
+
+def _not_cached(*args, **kwargs):
+    """Stand in for the API. Fail, since every lookup should be a hit."""
+    raise AssertionError(f'lookup missed the cache: {args!r} {kwargs!r}')
+
+
+def main():
+    """Run the benchmark and print a table of results."""
+    args = _parse_args()
+    texts = _make_texts(args.count)
+    if args.source is None:
+        embeddings = _random_embeddings(args.count)
+    else:
+        embeddings = _source_embeddings(args.count, args.source)
+    rows = dict(zip(texts, embeddings))
+    batch = texts[:args.batch]
+    expected_cosines = _cosines(embeddings[:args.batch])
+
+    def compute(texts):
+        return np.stack([rows[text] for text in texts])
+
+    print(f'{"file type":11}  {"MiB":>8}  {f"load {args.batch} ms":>13}  '
+          f'{"rows/s":>9}  {"cos err max":>11}  {"cos err mean":>12}')
+
+    for file_type in _FILE_TYPES:
+        with tempfile.TemporaryDirectory() as data_dir:
+            with patch.object(embed, 'embed_many', compute):
+                cached.embed_many(texts, data_dir=data_dir,
+                                  file_type=file_type, per_text=True)
+
+            def load(file_type=file_type, data_dir=data_dir):
+                return cached.embed_many(batch, data_dir=data_dir,
+                                         file_type=file_type, per_text=True)
+
+            with patch.object(embed, 'embed_many', _not_cached):
+                errors = np.abs(_cosines(load()) - expected_cosines)
+                seconds = min(timeit.repeat(load, number=1,
+                                            repeat=args.repeat))
+
+            print(f'{file_type:11}  {_disk_usage_mb(data_dir):8.1f}  '
+                  f'{seconds * 1000:13.2f}  {len(batch) / seconds:9.0f}  '
+                  f'{errors.max():11.2e}  {errors.mean():12.2e}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,106 @@
+#!/usr/bin/env python
+
+"""
+Benchmark of cold and warm connection latency for ``embed_one_req``.
+
+This times sequential ``embed_one_req`` calls against a local stub server,
+once with a session that closes each connection after one request (cold), and
+once with the default pooled keep-alive session (warm). By default, the stub
+serves plain HTTP, so this measures only the saved TCP setup. With ``--tls``,
+it serves HTTPS with a temporary self-signed certificate, made with the
+``openssl`` command, so each cold request also pays for a TLS handshake, as
+requests to the real API do. (Over a real network, each handshake also takes
+extra round trips, which ``--latency-ms`` does not simulate.)
+
+Run it from the top-level directory of the repository:
+
+    python -m benchmarks.bench_session --tls
+"""
+
+import argparse
+import contextlib
+import datetime
+from pathlib import Path
+import statistics
+import subprocess
+import tempfile
+import time
+from unittest.mock import patch
+
+from benchmarks._stub_server import StubServer
+import embed
+
+
+def _parse_args():
+    """Parse command-line arguments."""
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[1])
+    parser.add_argument('--calls', type=int, default=200,
+                        help='number of sequential calls per configuration')
+    parser.add_argument('--latency-ms', type=float, default=0.0,
+                        help='simulated server-side latency per request')
+    parser.add_argument('--tls', action='store_true',
+                        help='serve HTTPS, with a self-signed certificate')
+    return parser.parse_args()
+
+
+def _make_certificate(directory):
+    """Make a self-signed certificate for 127.0.0.1. Return its PEM file."""
+    certfile = Path(directory, 'stub.pem')
+    subprocess.run(
+        ['openssl', 'req', '-x509', '-newkey', 'ec',
+         '-pkeyopt', 'ec_paramgen_curve:prime256v1', '-nodes', '-days', '1',
+         '-subj', '/CN=127.0.0.1', '-addext', 'subjectAltName=IP:127.0.0.1',
+         '-keyout', certfile, '-out', certfile],
+        check=True, capture_output=True,
+    )
+    return certfile
+
+
+def _time_calls(count):
+    """Call ``embed_one_req`` ``count`` times. Return latencies in ms."""
+    latencies = []
+    for index in range(count):
+        start = time.perf_counter()
+        embed.embed_one_req(f'Benchmark text {index}.')
+        latencies.append((time.perf_counter() - start) * 1000)
+    return latencies
+
+
+def main():
+    """Run the benchmark and print a table of results."""
+    args = _parse_args()
+    latency = datetime.timedelta(milliseconds=args.latency_ms)
+    configurations = [
+        ('cold', lambda: embed.create_session(keep_alive=False)),
+        ('warm', embed.create_session),
+    ]
+
+    with contextlib.ExitStack() as stack:
+        certfile = None
+        if args.tls:
+            certfile = _make_certificate(
+                stack.enter_context(tempfile.TemporaryDirectory()))
+        server = stack.enter_context(StubServer(latency, certfile=certfile))
+        stack.enter_context(patch.object(embed, '_EMBEDDINGS_URL',
+                                         server.url))
+
+        print(f'Serving {server.url.split(":")[0].upper()}.')
+        print('session  mean ms  median ms  p99 ms')
+        for name, make_session in configurations:
+            session = make_session()
+            if certfile is not None:
+                session.trust_env = False  # Else REQUESTS_CA_BUNDLE wins.
+                session.verify = str(certfile)
+            embed.set_session(session)
+            try:
+                _time_calls(5)  # Warm up.
+                latencies = _time_calls(args.calls)
+            finally:
+                embed.close_session()
+            p99 = statistics.quantiles(latencies, n=100)[-1]
+            print(f'{name:7}  {statistics.mean(latencies):7.2f}  '
+                  f'{statistics.median(latencies):9.2f}  {p99:6.2f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,94 @@
+#!/usr/bin/env python
+
+"""
+Benchmark of how exact search scales with threads searching shards of rows.
+
+This searches a matrix of random rows with ``ExactIndex.search``, first without
+``max_workers``, then with it from 1 up to the number of cores (or
+``--max-workers``), and reports the queries per second and the speedup over
+``max_workers=1``. With ``--mapped``, it searches a ``MappedIndex`` in a
+temporary directory instead.
+
+NumPy's BLAS library may use several threads for each matrix multiplication,
+which competes with the shards' threads. To measure scaling by shards alone,
+limit it to one thread, for OpenBLAS (as in NumPy's wheels) like this:
+
+    OPENBLAS_NUM_THREADS=1 python -m benchmarks.bench_shards
+
+Run it from the top-level directory of the repository.
+"""
+
+import argparse
+import os
+import tempfile
+import timeit
+
+import numpy as np
+
+import embed
+from embed import search
+
+
+def _parse_args():
+    """Parse command-line arguments."""
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[1])
+    parser.add_argument('--count', type=int, default=100_000,
+                        help='number of rows searched')
+    parser.add_argument('--queries', type=int, default=100,
+                        help='number of queries searched for together')
+    parser.add_argument('-k', type=int, default=10,
+                        help='number of results per query')
+    parser.add_argument('--max-workers', type=int, default=os.cpu_count(),
+                        help='most threads to try (default: number of cores)')
+    parser.add_argument('--repeat', type=int, default=3,
+                        help='number of times to time each search')
+    parser.add_argument('--mapped', action='store_true',
+                        help='search a MappedIndex instead of an ExactIndex')
+    return parser.parse_args()
+
+
+def _random_embeddings(count, rng):
+    """Make random vectors, as fake embeddings."""
+    return rng.standard_normal((count, embed.DIMENSION), np.float32)
+
+
+def _run(index, queries, args):
+    """Time searches with each number of threads, and print the results."""
+    def seconds(max_workers):
+        return min(timeit.repeat(
+            lambda: index.search(queries, args.k, max_workers=max_workers),
+            number=1, repeat=args.repeat))
+
+    print(f'{"max_workers":>11}  {"seconds":>8}  {"QPS":>9}  {"speedup":>7}')
+    unsharded = seconds(None)
+    print(f'{"None":>11}  {unsharded:8.3f}'
+          f'  {args.queries / unsharded:9.0f}  {"":>7}')
+    baseline = seconds(1)
+    for max_workers in range(1, args.max_workers + 1):
+        elapsed = baseline if max_workers == 1 else seconds(max_workers)
+        print(f'{max_workers:11}  {elapsed:8.3f}'
+              f'  {args.queries / elapsed:9.0f}  {baseline / elapsed:7.2f}')
+
+
+def main():
+    """Run the benchmark and print a table of results."""
+    args = _parse_args()
+    rng = np.random.default_rng(0)
+    embeddings = _random_embeddings(args.count, rng)
+    queries = _random_embeddings(args.queries, rng)
+    texts = [f'Benchmark text {index}.' for index in range(args.count)]
+    print(f'Searching {args.count} rows for {args.queries} queries'
+          f' on up to {args.max_workers} threads.')
+
+    if not args.mapped:
+        _run(search.ExactIndex(embeddings), queries, args)
+        return
+    with tempfile.TemporaryDirectory() as dir_name:
+        index = search.MappedIndex(dir_name)
+        index.add(texts, embeddings)
+        del embeddings  # So rows are read from the file (or page cache).
+        _run(index, queries, args)
+
+
+if __name__ == '__main__':
+    main()
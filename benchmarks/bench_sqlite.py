@@ -0,0 +1,154 @@
+#!/usr/bin/env python
+
+"""
+Benchmark of per-text cache lookups, with safetensors files and with SQLite.
+
+For each cache size, this fills a directory with that many per-text entries of
+fake embeddings in each of the ``'safetensors'`` file type (one file per entry)
+and the ``'sqlite'`` file type (one database with a row per entry). Then it
+times ``embed.cached.embed_many`` with ``per_text=True`` on a batch of texts
+that are all cached, and ``embed.cached.embed_one`` on single texts.
+
+The default sizes need tens of GiB of free disk space (the reported sizes
+include SQLite's write-ahead log), and a long time to fill the largest caches,
+much of it spent creating a million files. Use ``--sizes``
+and ``--dimension`` to run smaller tests:
+
+    python -m benchmarks.bench_sqlite --sizes 1000 10000 --dimension 256
+
+Run it from the top-level directory of the repository:
+
+    python -m benchmarks.bench_sqlite
+"""
+
+import argparse
+import os
+import random
+import tempfile
+import time
+import timeit
+from unittest.mock import patch
+
+import numpy as np
+
+import embed
+from embed import _sqlite, cached
+
+_FILE_TYPES = ['safetensors', 'sqlite']
+"""File types compared."""
+
+_CHUNK_SIZE = 10_000
+"""Number of entries saved to the database in each transaction when filling."""
+
+
+def _parse_args():
+    """Parse command-line arguments."""
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[1])
+    parser.add_argument('--sizes', type=int, nargs='+',
+                        default=[10_000, 100_000, 1_000_000],
+                        help='numbers of entries in the caches')
+    parser.add_argument('--dimension', type=int, default=embed.DIMENSION,
+                        help='length of each fake embedding')
+    parser.add_argument('--batch', type=int, default=1000,
+                        help='number of texts looked up by each embed_many')
+    parser.add_argument('--singles', type=int, default=1000,
+                        help='number of texts looked up with embed_one')
+    parser.add_argument('--repeat', type=int, default=5,
+                        help='number of times to time each lookup')
+    return parser.parse_args()
+
+
+def _make_texts(count):
+    """Make the texts whose fake embeddings are cached."""
+    return [f'Benchmark text {index}.' for index in range(count)]
+
+
+def _fake_rows(count, dimension, rng):
+    """Make random float32 "embeddings" quickly, without calling the API."""
+    return rng.standard_normal((count, dimension), np.float32)
+
+
+def _fill_safetensors(texts, data_dir, dimension, rng):
+    """Save an entry per text, each in its own safetensors file."""
+    # pylint: disable=protected-access  # To fill the cache without the API.
+    for start in range(0, len(texts), _CHUNK_SIZE):
+        chunk = texts[start:start + _CHUNK_SIZE]
+        for text, row in zip(chunk, _fake_rows(len(chunk), dimension, rng)):
+            path = cached._build_path(text, data_dir, 'safetensors')
+            cached._save_safetensors(path, row)
+
+
+def _fill_sqlite(texts, data_dir, dimension, rng):
+    """Save an entry per text in the directory's SQLite database."""
+    # pylint: disable=protected-access  # To fill the cache without the API.
+    store = _sqlite.get_store(data_dir)
+    for start in range(0, len(texts), _CHUNK_SIZE):
+        chunk = texts[start:start + _CHUNK_SIZE]
+        rows = _fake_rows(len(chunk), dimension, rng)
+        store.put_many(
+            [(bytes.fromhex(cached._compute_input_hash(text)), row)
+             for text, row in zip(chunk, rows)])
+
+
+_FILLERS = {'safetensors': _fill_safetensors, 'sqlite': _fill_sqlite}
+"""Functions to fill a cache directory, for each file type."""
+
+
+def _disk_usage_mb(data_dir):
+    """Get the total size in MiB of the files in a directory."""
+    size = sum(entry.stat().st_size for entry in os.scandir(data_dir)
+               if entry.is_file())
+    return size / 2**20
+
+
+def _not_cached(*args, **kwargs):
+    """Stand in for the API. Fail, since every lookup should be a hit."""
+    raise AssertionError(f'lookup missed the cache: {args!r} {kwargs!r}')
+
+
+def _time_lookups(args, texts, data_dir, file_type):
+    """Time batch and single lookups. Return milliseconds per call of each."""
+    sample = random.Random(0).sample(texts, min(args.batch, len(texts)))
+    singles = random.Random(1).sample(texts, min(args.singles, len(texts)))
+
+    def look_up_batch():
+        return cached.embed_many(sample, data_dir=data_dir,
+                                 file_type=file_type, per_text=True)
+
+    def look_up_singles():
+        for text in singles:
+            cached.embed_one(text, data_dir=data_dir, file_type=file_type)
+
+    batch_seconds = min(timeit.repeat(look_up_batch, number=1,
+                                      repeat=args.repeat))
+    singles_seconds = min(timeit.repeat(look_up_singles, number=1,
+                                        repeat=args.repeat))
+    return batch_seconds * 1000, singles_seconds * 1000 / len(singles)
+
+
+def main():
+    """Run the benchmark and print a table of results."""
+    args = _parse_args()
+    print(f'{"entries":>9}  {"file type":11}  {"fill s":>8}  {"MiB":>8}  '
+          f'{f"batch of {args.batch} ms":>17}  {"single ms":>9}')
+
+    for size in args.sizes:
+        texts = _make_texts(size)
+        for file_type in _FILE_TYPES:
+            with tempfile.TemporaryDirectory() as data_dir:
+                start = time.perf_counter()
+                _FILLERS[file_type](texts, data_dir, args.dimension,
+                                    np.random.default_rng(0))
+                fill_seconds = time.perf_counter() - start
+                with patch.object(embed, 'embed_many', _not_cached), \
+                        patch.object(embed, 'embed_one', _not_cached):
+                    batch_ms, single_ms = _time_lookups(
+                        args, texts, data_dir, file_type)
+                print(f'{size:9}  {file_type:11}  {fill_seconds:8.1f}  '
+                      f'{_disk_usage_mb(data_dir):8.1f}  {batch_ms:17.2f}  '
+                      f'{single_ms:9.3f}')
+                _sqlite.close_stores()
+
+
+if __name__ == '__main__':
+    main()
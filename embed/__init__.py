@@ -1,7 +1,12 @@
 """Embed functions for OpenAI API experimentation."""
 
 __all__ = [
+    'aio',
+    'batching',
     'cached',
+    'maintenance',
+    'memory',
+    'search',
     'DIMENSION',
     'embed_one',
     'embed_many',
@@ -9,18 +14,26 @@ __all__ = [
     'embed_many_eu',
     'embed_one_req',
     'embed_many_req',
+    'create_session',
+    'get_session',
+    'set_session',
+    'close_session',
 ]
 
+import base64
+import concurrent.futures
 import datetime
+import functools
 import http
 
 import backoff
 import numpy as np
 import openai
 import openai.embeddings_utils
-import requests
+import orjson
 
-from . import _keys, cached
+from . import _keys, aio, batching, cached, maintenance, memory, search
+from ._session import close_session, create_session, get_session, set_session
 
 # Give this module an api_key property to be accessed from the outside.
 _keys.initialize(__name__)
@@ -28,9 +41,91 @@ _keys.initialize(__name__)
 DIMENSION = 1536
 """Dimension of the vector space text-embedding-ada-002 embeds texts in."""
 
+_EMBEDDINGS_URL = 'https://api.openai.com/v1/embeddings'
+"""API endpoint URL for ``embed_one_req`` and ``embed_many_req``."""
+
 _REQUESTS_TIMEOUT = datetime.timedelta(seconds=60)
 """Connection timeout for ``embed_one_req`` and ``embed_many_req``."""
 
+_BYTES_PER_TOKEN_ESTIMATE = 3
+"""
+Divisor to estimate a text's token count from its UTF-8 length in bytes.
+
+English text averages about four characters per token, so this deliberately
+overestimates, making it unlikely that a chunk will exceed its token budget.
+"""
+
+
+def _estimate_tokens(text):
+    """Estimate, conservatively, the number of tokens a text encodes to."""
+    return len(text.encode('utf-8')) // _BYTES_PER_TOKEN_ESTIMATE + 1
+
+
+def _split_into_chunks(texts, max_items, max_tokens):
+    """
+    Yield ``(start, stop)`` index ranges of consecutive chunks of ``texts``.
+
+    Each chunk has at most ``max_items`` texts and at most ``max_tokens``
+    estimated tokens, except that a single text whose estimate exceeds
+    ``max_tokens`` is still placed in a chunk of its own. ``None`` means no
+    limit.
+    """
+    if max_items is not None and max_items < 1:
+        raise ValueError(f'max_items must be positive, got {max_items!r}')
+    if max_tokens is not None and max_tokens < 1:
+        raise ValueError(f'max_tokens must be positive, got {max_tokens!r}')
+
+    start = 0
+    tokens = 0
+
+    for index, text in enumerate(texts):
+        cost = 0 if max_tokens is None else _estimate_tokens(text)
+        if index != start and (
+            (max_items is not None and index - start == max_items) or
+            (max_tokens is not None and tokens + cost > max_tokens)
+        ):
+            yield start, index
+            start = index
+            tokens = 0
+        tokens += cost
+
+    if start != len(texts):
+        yield start, len(texts)
+
+
+def _embed_in_chunks(embed_chunk, texts, max_items, max_tokens, max_workers):
+    """
+    Embed ``texts`` with one call to ``embed_chunk`` per chunk.
+
+    The result matrix is allocated once, and each chunk's rows are filled in
+    as they are returned. If ``max_workers`` is given, chunks are embedded
+    concurrently on a pool of that many threads. Either way, each call to
+    ``embed_chunk`` does its own backoff, and rows are in input order.
+    """
+    embeddings = np.empty((len(texts), DIMENSION), dtype=np.float32)
+    ranges = _split_into_chunks(texts, max_items, max_tokens)
+
+    if max_workers is None:
+        for start, stop in ranges:
+            embeddings[start:stop] = embed_chunk(texts[start:stop])
+        return embeddings
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers) as executor:
+        futures = {
+            executor.submit(embed_chunk, texts[start:stop]): (start, stop)
+            for start, stop in ranges
+        }
+        try:
+            for future in concurrent.futures.as_completed(futures):
+                start, stop = futures[future]
+                embeddings[start:stop] = future.result()
+        except BaseException:
+            for future in futures:
+                future.cancel()  # Don't start any chunks not yet started.
+            raise
+
+    return embeddings
+
 
 @backoff.on_exception(backoff.expo, openai.error.RateLimitError)
 def _create_embedding(text_or_texts):
@@ -47,11 +142,24 @@ def embed_one(text):
     return np.array(openai_response.data[0].embedding, dtype=np.float32)
 
 
-def embed_many(texts):
-    """Embed multiple pieces of text."""
+def _embed_chunk(texts):
+    """Embed a chunk of texts in one request."""
     openai_response = _create_embedding(texts)
-    embeddings = [datum.embedding for datum in openai_response.data]
-    return np.array(embeddings, dtype=np.float32)
+    return [datum.embedding for datum in openai_response.data]
+
+
+def embed_many(
+        texts, *, max_items=None, max_tokens=None, max_workers=None):
+    """
+    Embed multiple pieces of text.
+
+    If ``max_items`` or ``max_tokens`` is given, ``texts`` is split into
+    chunks of at most that many texts or (estimated) tokens, each sent in its
+    own request. If ``max_workers`` is also given, up to that many chunks are
+    sent concurrently, from a thread pool.
+    """
+    return _embed_in_chunks(
+        _embed_chunk, texts, max_items, max_tokens, max_workers)
 
 
 def embed_one_eu(text):
@@ -63,13 +171,24 @@ def embed_one_eu(text):
     return np.array(embedding, dtype=np.float32)
 
 
-def embed_many_eu(texts):
-    """Embed multiple pieces of text. Uses ``embeddings_utils``."""
-    embeddings = openai.embeddings_utils.get_embeddings(
+def _embed_chunk_eu(texts):
+    """Embed a chunk of texts in one request. Uses ``embeddings_utils``."""
+    return openai.embeddings_utils.get_embeddings(
         list_of_text=texts,
         engine='text-embedding-ada-002',
     )
-    return np.array(embeddings, dtype=np.float32)
+
+
+def embed_many_eu(
+        texts, *, max_items=None, max_tokens=None, max_workers=None):
+    """
+    Embed multiple pieces of text. Uses ``embeddings_utils``.
+
+    Chunking with ``max_items``, ``max_tokens``, and ``max_workers`` is as
+    in ``embed_many``.
+    """
+    return _embed_in_chunks(
+        _embed_chunk_eu, texts, max_items, max_tokens, max_workers)
 
 
 def _needs_backoff(response):
@@ -78,32 +197,69 @@ def _needs_backoff(response):
 
 
 @backoff.on_predicate(backoff.expo, _needs_backoff)
-def _post_request(text_or_texts):
+def _post_request(text_or_texts, encoding_format):
     """Make a POST request to the API endpoint, with backoff."""
-    return requests.post(
-        url='https://api.openai.com/v1/embeddings',
+    return get_session().post(
+        url=_EMBEDDINGS_URL,
         headers={
             'Authorization': f'Bearer {_keys.api_key}',
             'Content-Type': 'application/json',
         },
-        json={
+        data=orjson.dumps({
             'input': text_or_texts,
             'model': 'text-embedding-ada-002',
-        },
+            'encoding_format': encoding_format,
+        }),
         timeout=_REQUESTS_TIMEOUT.total_seconds(),
     )
 
 
-def embed_one_req(text):
-    """Embed a single piece of text. Uses ``requests``."""
-    response = _post_request(text)
+def _parse_embeddings(content):
+    """
+    Parse the embeddings in an API response body into a float32 matrix.
+
+    Each embedding is either a list of floats or, if ``base64`` encoding was
+    requested, a base64 string of little-endian float32 data. The latter is
+    decoded straight into the matrix, without a Python object per element.
+    """
+    data = orjson.loads(content)['data']
+    embeddings = np.empty((len(data), DIMENSION), dtype=np.float32)
+    for datum in data:
+        embedding = datum['embedding']
+        if isinstance(embedding, str):
+            embedding = np.frombuffer(base64.b64decode(embedding), dtype='<f4')
+        embeddings[datum['index']] = embedding
+    return embeddings
+
+
+def embed_one_req(text, *, encoding_format='float'):
+    """
+    Embed a single piece of text. Uses ``requests``.
+
+    ``encoding_format`` may be ``'float'`` or ``'base64'``. It affects only how
+    the API sends the embedding, not the result.
+    """
+    response = _post_request(text, encoding_format)
     response.raise_for_status()
-    return np.array(response.json()['data'][0]['embedding'], dtype=np.float32)
+    return _parse_embeddings(response.content)[0]
 
 
-def embed_many_req(texts):
-    """Embed multiple pieces of text. Uses ``requests``."""
-    response = _post_request(texts)
+def _embed_chunk_req(texts, encoding_format='float'):
+    """Embed a chunk of texts in one request. Uses ``requests``."""
+    response = _post_request(texts, encoding_format)
     response.raise_for_status()
-    embeddings = [datum['embedding'] for datum in response.json()['data']]
-    return np.array(embeddings, dtype=np.float32)
+    return _parse_embeddings(response.content)
+
+
+def embed_many_req(
+        texts, *, max_items=None, max_tokens=None, max_workers=None,
+        encoding_format='float'):
+    """
+    Embed multiple pieces of text. Uses ``requests``.
+
+    Chunking with ``max_items``, ``max_tokens``, and ``max_workers`` is as
+    in ``embed_many``. ``encoding_format`` is as in ``embed_one_req``.
+    """
+    return _embed_in_chunks(
+        functools.partial(_embed_chunk_req, encoding_format=encoding_format),
+        texts, max_items, max_tokens, max_workers)
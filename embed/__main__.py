@@ -0,0 +1,211 @@
+"""
+Command-line tools for maintaining embedding caches.
+
+Run them with ``python -m embed``. For example, to convert a cache directory to
+the sharded layout, where each file is two subdirectories down:
+
+    python -m embed migrate --layout sharded data
+
+Or to clean up a cache directory and evict files until it is at most 10 GiB:
+
+    python -m embed gc --max-bytes 10G data
+
+Or to make lookups of entries in JSON files faster, by saving binary copies:
+
+    python -m embed convert data
+
+Or to copy a cache to another machine, as a single file:
+
+    python -m embed export cache.archive data
+    python -m embed import cache.archive data
+
+Or to add the cached embeddings to a memory-mapped matrix, to search them:
+
+    python -m embed index matrix data
+"""
+
+import argparse
+import logging
+import re
+import sys
+
+from embed import cached, maintenance, search
+
+
+def _migrate(args):
+    """Run the ``migrate`` subcommand."""
+    count = maintenance.migrate(args.layout, data_dir=args.data_dir)
+    print(f'Moved {count} files to the {args.layout} layout.')
+
+
+_SIZE_PATTERN = re.compile(r'(\d+)([KMGT]?)i?B?', re.IGNORECASE)
+"""Regular expression matching a size in bytes, maybe with a unit prefix."""
+
+_SIZE_UNITS = {'': 1, 'K': 2**10, 'M': 2**20, 'G': 2**30, 'T': 2**40}
+"""Multipliers of the unit prefixes allowed in sizes."""
+
+
+def _size(text):
+    """Parse a size in bytes, like ``1000000``, ``512M`` or ``10GiB``."""
+    match = _SIZE_PATTERN.fullmatch(text.strip())
+    if match is None:
+        raise argparse.ArgumentTypeError(f'invalid size: {text!r}')
+    digits, unit = match.groups()
+    return int(digits) * _SIZE_UNITS[unit.upper()]
+
+
+def _gc(args):
+    """Run the ``gc`` subcommand."""
+    result = maintenance.collect_garbage(data_dir=args.data_dir,
+                                         max_bytes=args.max_bytes,
+                                         max_files=args.max_files,
+                                         dry_run=args.dry_run)
+    verb = 'Would remove' if args.dry_run else 'Removed'
+    print(f'{verb} {result.removed_files} files,'
+          f' reclaiming {result.reclaimed_bytes} bytes.')
+    print(f'{result.kept_files} files, totaling {result.kept_bytes} bytes,'
+          f' {"would be" if args.dry_run else "were"} kept.')
+
+
+def _convert(args):
+    """Run the ``convert`` subcommand."""
+    count = maintenance.convert_json(data_dir=args.data_dir)
+    print(f'Converted {count} JSON files.')
+
+
+def _export(args):
+    """Run the ``export`` subcommand."""
+    count = maintenance.export_archive(args.archive, data_dir=args.data_dir,
+                                       file_type=args.file_type)
+    print(f'Exported {count} entries.')
+
+
+def _import(args):
+    """Run the ``import`` subcommand."""
+    archive = sys.stdin.buffer if args.archive == '-' else args.archive
+    count = maintenance.import_archive(archive, data_dir=args.data_dir,
+                                       file_type=args.file_type)
+    print(f'Imported {count} entries.')
+
+
+def _index(args):
+    """Run the ``index`` subcommand."""
+    index = search.MappedIndex(args.index, dtype=args.dtype)
+    count = index.update(data_dir=args.data_dir, file_type=args.file_type)
+    print(f'Added {count} embeddings, for {len(index)} in all.')
+
+
+def _parse_args(argv):
+    """Parse command-line arguments."""
+    parser = argparse.ArgumentParser(
+        prog='python -m embed',
+        description=__doc__.split('\n\n', maxsplit=1)[0].strip(),
+    )
+    subparsers = parser.add_subparsers(required=True, metavar='command')
+
+    migrate = subparsers.add_parser(
+        'migrate',
+        help='move cache files into a layout',
+        description='Move cache files into a layout. This is safe to do'
+                    ' while the cache is in use.',
+    )
+    migrate.add_argument('--layout', choices=['flat', 'sharded'],
+                         default='sharded',
+                         help='layout to move files into (default: sharded)')
+    migrate.add_argument('data_dir', nargs='?',
+                         default=cached.DEFAULT_DATA_DIR,
+                         help='cache directory (default: %(default)s)')
+    migrate.set_defaults(run=_migrate)
+
+    gc = subparsers.add_parser(
+        'gc',
+        help='remove unneeded cache files, and evict to stay within limits',
+        description='Remove quarantined files, abandoned temporary files, and'
+                    ' redundant copies of entries. Then remove the least'
+                    ' recently used files, if needed, to stay within limits.'
+                    ' This is safe to do while the cache is in use.',
+    )
+    gc.add_argument('--max-bytes', type=_size,
+                    help='most bytes of cache files to keep (like 10G)')
+    gc.add_argument('--max-files', type=int,
+                    help='most cache files to keep')
+    gc.add_argument('--dry-run', action='store_true',
+                    help="report what would be removed, but don't remove it")
+    gc.add_argument('data_dir', nargs='?', default=cached.DEFAULT_DATA_DIR,
+                    help='cache directory (default: %(default)s)')
+    gc.set_defaults(run=_gc)
+
+    convert = subparsers.add_parser(
+        'convert',
+        help='save binary copies of JSON cache files, to load faster',
+        description='Save a .safetensors copy of each JSON cache file that'
+                    ' has none. JSON files are kept. This is safe to do while'
+                    ' the cache is in use.',
+    )
+    convert.add_argument('data_dir', nargs='?',
+                         default=cached.DEFAULT_DATA_DIR,
+                         help='cache directory (default: %(default)s)')
+    convert.set_defaults(run=_convert)
+
+    export = subparsers.add_parser(
+        'export',
+        help='pack cached embeddings into an archive file',
+        description='Pack the entries of a file type in a cache directory'
+                    ' into a single archive file.',
+    )
+    export.add_argument('--file-type', default=cached.DEFAULT_FILE_TYPE,
+                        help='file type of entries to export'
+                             ' (default: %(default)s)')
+    export.add_argument('archive', help='archive file to write')
+    export.add_argument('data_dir', nargs='?',
+                        default=cached.DEFAULT_DATA_DIR,
+                        help='cache directory (default: %(default)s)')
+    export.set_defaults(run=_export)
+
+    import_ = subparsers.add_parser(
+        'import',
+        help='unpack cached embeddings from an archive file',
+        description='Save the entries in an archive file, made by export, in'
+                    ' a cache directory.',
+    )
+    import_.add_argument('--file-type', default=cached.DEFAULT_FILE_TYPE,
+                         help='file type to save entries as'
+                              ' (default: %(default)s)')
+    import_.add_argument('archive',
+                         help='archive file to read, or - for standard input')
+    import_.add_argument('data_dir', nargs='?',
+                         default=cached.DEFAULT_DATA_DIR,
+                         help='cache directory (default: %(default)s)')
+    import_.set_defaults(run=_import)
+
+    index = subparsers.add_parser(
+        'index',
+        help='add cached embeddings to a memory-mapped matrix, to search',
+        description='Add the embeddings of entries of a file type in a cache'
+                    ' directory to an embed.search.MappedIndex, creating it'
+                    ' if needed. Entries already added are skipped.',
+    )
+    index.add_argument('--dtype', choices=['float32', 'float16'],
+                       help='data type of rows of a new index'
+                            ' (default: float32)')
+    index.add_argument('--file-type', default=cached.DEFAULT_FILE_TYPE,
+                       help='file type of entries to add'
+                            ' (default: %(default)s)')
+    index.add_argument('index', help='directory of the index')
+    index.add_argument('data_dir', nargs='?',
+                       default=cached.DEFAULT_DATA_DIR,
+                       help='cache directory (default: %(default)s)')
+    index.set_defaults(run=_index)
+
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    """Run a command given on the command line."""
+    logging.basicConfig(level=logging.WARNING)
+    args = _parse_args(argv)
+    args.run(args)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,222 @@
+"""
+Packed archives of cached embeddings, for exporting and importing caches.
+
+An archive is a single safetensors file holding every entry of a cache, so it
+can be copied as fast as the disk and network allow, instead of as many small
+files. It has four tensors, stored in this order:
+
+- ``keys``, uint8, ``(n, 32)``: each entry's key (the 32-byte blake3 digest
+  ``embed.cached`` also uses to name files).
+- ``ndims``, int64, ``(n,)``: each entry's number of dimensions, 1 or 2. This
+  is 0 for an entry that could not be read while exporting, which is skipped.
+- ``offsets``, int64, ``(n + 1,)``: where each entry's rows start in
+  ``embeddings``, followed by the total number of rows.
+- ``embeddings``, float32, ``(rows, columns)``: all the entries' rows, in
+  order.
+
+The index tensors come before the data, so an archive can be read in a single
+pass, even from a pipe. To let it also be written in a single pass, the header
+has a fixed size (padded with spaces), and is written last, after seeking back.
+The whole archive is never held in memory by either side.
+"""
+
+__all__ = ['ArchiveWriter', 'read_archive']
+
+import struct
+
+import numpy as np
+import orjson
+
+_FORMAT = 'embed.cached archive'
+"""Value of the ``format`` metadata item, identifying archives."""
+
+_VERSION = '1'
+"""Value of the ``version`` metadata item."""
+
+_HEADER_SIZE = 504
+"""Size of the padded JSON header, so the tensors start at offset 512."""
+
+_KEY_SIZE = 32
+"""Length of each key, in bytes."""
+
+_INDEX_DTYPE = np.dtype('<i8')
+"""Data type of the ``ndims`` and ``offsets`` tensors."""
+
+_DTYPE = np.dtype('<f4')
+"""Data type of the ``embeddings`` tensor."""
+
+_TENSOR_NAMES = ['keys', 'ndims', 'offsets', 'embeddings']
+"""Names of the tensors, in the order they are stored."""
+
+
+def _index_size(count):
+    """Get the total size of the index tensors, for ``count`` entries."""
+    return count * _KEY_SIZE + (2 * count + 1) * _INDEX_DTYPE.itemsize
+
+
+def _make_header(count, rows, columns):
+    """Make the padded header of an archive."""
+    tensors = {
+        'keys': ('U8', [count, _KEY_SIZE], count * _KEY_SIZE),
+        'ndims': ('I64', [count], count * _INDEX_DTYPE.itemsize),
+        'offsets': ('I64', [count + 1],
+                    (count + 1) * _INDEX_DTYPE.itemsize),
+        'embeddings': ('F32', [rows, columns],
+                       rows * columns * _DTYPE.itemsize),
+    }
+    header = {'__metadata__': {'format': _FORMAT, 'version': _VERSION}}
+    start = 0
+    for name in _TENSOR_NAMES:
+        dtype, shape, size = tensors[name]
+        header[name] = {
+            'dtype': dtype,
+            'shape': shape,
+            'data_offsets': [start, start + size],
+        }
+        start += size
+
+    data = orjson.dumps(header)
+    if len(data) > _HEADER_SIZE:
+        raise ValueError('archive header too big')  # Not for sane sizes.
+    return struct.pack('<Q', _HEADER_SIZE) + data.ljust(_HEADER_SIZE)
+
+
+class ArchiveWriter:
+    """
+    Writer of an archive of a known number of entries to a seekable file.
+
+    Call ``write`` for each entry, or ``skip`` for each one that turns out to
+    be missing, then ``finish``.
+    """
+
+    def __init__(self, file, count, columns):
+        """Start writing ``count`` entries of ``columns`` columns to a file."""
+        self._file = file
+        self._columns = columns
+        self._keys = np.zeros((count, _KEY_SIZE), dtype=np.uint8)
+        self._ndims = np.zeros(count, dtype=_INDEX_DTYPE)
+        self._offsets = np.zeros(count + 1, dtype=_INDEX_DTYPE)
+        self._index = 0
+        self._start = file.tell()
+        file.seek(self._start + 8 + _HEADER_SIZE + _index_size(count))
+
+    def write(self, key, embeddings):
+        """Write an entry's key and array."""
+        embeddings = np.ascontiguousarray(embeddings, dtype=_DTYPE)
+        if embeddings.ndim == 1:
+            rows, columns = 1, embeddings.shape[0]
+        elif embeddings.ndim == 2:
+            rows, columns = embeddings.shape
+        else:
+            raise ValueError(
+                f"can't store {embeddings.ndim}-dimensional array")
+        if columns != self._columns:
+            raise ValueError(
+                f'expected {self._columns} columns, got {columns}')
+
+        self._file.write(embeddings.data)
+        self._record(key, embeddings.ndim, rows)
+
+    def skip(self, key):
+        """Record that an entry is missing, so it is not imported."""
+        self._record(key, 0, 0)
+
+    def finish(self):
+        """Write the header and index. Return how many entries were written."""
+        if self._index != len(self._ndims):
+            raise ValueError(f'expected {len(self._ndims)} entries,'
+                             f' got {self._index}')
+        end = self._file.tell()
+        self._file.seek(self._start)
+        self._file.write(
+            _make_header(len(self._ndims), int(self._offsets[-1]),
+                         self._columns))
+        for index_tensor in self._keys, self._ndims, self._offsets:
+            self._file.write(index_tensor.data)
+        self._file.seek(end)
+        return int(np.count_nonzero(self._ndims))
+
+    def _record(self, key, ndim, rows):
+        """Record an entry in the index."""
+        index = self._index
+        self._keys[index] = np.frombuffer(key, dtype=np.uint8)
+        self._ndims[index] = ndim
+        self._offsets[index + 1] = self._offsets[index] + rows
+        self._index += 1
+
+
+def _read_into(file, buffer):
+    """Fill a buffer from a file. Raise ``ValueError`` if it ends first."""
+    view = memoryview(buffer)
+    if not view.nbytes:
+        return  # Can't cast an empty array's view, nor need to.
+    view = view.cast('B')
+    filled = 0
+    while filled < len(view):
+        count = file.readinto(view[filled:])
+        if not count:
+            raise ValueError('truncated archive')
+        filled += count
+
+
+def _read_array(file, dtype, shape):
+    """Read an array of a given dtype and shape from a file."""
+    array = np.empty(shape, dtype=dtype)
+    _read_into(file, array)
+    return array
+
+
+def _check_header(header):
+    """Check an archive's header. Return its number of entries and columns."""
+    try:
+        if header['__metadata__']['format'] != _FORMAT:
+            raise ValueError('not an embeddings archive')
+        if header['__metadata__']['version'] != _VERSION:
+            raise ValueError('unsupported archive version: '
+                             f"{header['__metadata__']['version']}")
+        count = header['keys']['shape'][0]
+        _, columns = header['embeddings']['shape']
+        expected_begin = 0
+        for name in _TENSOR_NAMES:
+            begin, end = header[name]['data_offsets']
+            if begin != expected_begin:
+                raise ValueError('unexpected order of tensors')
+            expected_begin = end
+    except (KeyError, TypeError, ValueError) as error:
+        raise ValueError(f'unexpected archive header: {error!r}') from None
+    return count, columns
+
+
+def _shape_of(ndim, rows, columns):
+    """Get the shape of an entry's array, from its index fields."""
+    if ndim == 1 and rows == 1:
+        return (columns,)
+    if ndim == 2:
+        return (rows, columns)
+    raise ValueError(f'bad entry in archive: {ndim=}, {rows=}')
+
+
+def read_archive(file):
+    """
+    Read an archive from a file, in a single pass.
+
+    This yields each entry's key and array, in order, skipping entries that
+    were missing when the archive was written. Arrays are writable.
+    """
+    size_data = bytearray(8)
+    _read_into(file, size_data)
+    (header_size,) = struct.unpack('<Q', size_data)
+    header_data = bytearray(header_size)
+    _read_into(file, header_data)
+    count, columns = _check_header(orjson.loads(header_data))
+
+    keys = _read_array(file, np.uint8, (count, _KEY_SIZE))
+    ndims = _read_array(file, _INDEX_DTYPE, count)
+    offsets = _read_array(file, _INDEX_DTYPE, count + 1)
+
+    for key, ndim, start, stop in zip(keys, ndims, offsets, offsets[1:]):
+        if ndim == 0:
+            continue
+        shape = _shape_of(int(ndim), int(stop - start), columns)
+        embeddings = _read_array(file, _DTYPE, shape)
+        yield key.tobytes(), embeddings.astype(np.float32, copy=False)
@@ -0,0 +1,137 @@
+"""
+Single-flight locking for computing embeddings that are not yet cached.
+
+When a cache entry is missing, ``embed.cached`` holds a lock for its path while
+it checks again, computes the embedding, and saves it. Other callers wanting
+the same entry wait, then find it saved, instead of also calling the API.
+
+Threads in this process are serialized by an in-memory lock per path.
+Processes sharing a cache directory are serialized by advisory locks on lock
+files in its ``.locks`` subdirectory. Entries are spread over a fixed number
+of lock files by the first two characters of their filenames (which are hex
+digits of a hash), so there are never more than 256 lock files, and they are
+never removed. The file locks use ``fcntl.flock`` on POSIX systems and
+``msvcrt.locking`` on Windows.
+
+Other operations on a cache directory that must not overlap, such as appending
+to a shared file, can hold a named lock on the whole directory with
+``exclusive``.
+"""
+
+__all__ = ['LOCKS_DIR_NAME', 'single_flight', 'exclusive']
+
+import contextlib
+import errno
+import os
+from pathlib import Path
+import threading
+
+if os.name == 'nt':
+    import msvcrt
+
+    def _lock_file(fd):
+        """Block until an exclusive lock on the file is acquired."""
+        while True:
+            try:
+                msvcrt.locking(fd, msvcrt.LK_LOCK, 1)
+                return
+            except OSError as error:
+                if error.errno != errno.EDEADLOCK:
+                    raise
+                # LK_LOCK gave up after trying for about 10 seconds.
+
+    def _unlock_file(fd):
+        """Release a lock acquired by ``_lock_file``."""
+        msvcrt.locking(fd, msvcrt.LK_UNLCK, 1)
+else:
+    import fcntl
+
+    def _lock_file(fd):
+        """Block until an exclusive lock on the file is acquired."""
+        fcntl.flock(fd, fcntl.LOCK_EX)
+
+    def _unlock_file(fd):
+        """Release a lock acquired by ``_lock_file``."""
+        fcntl.flock(fd, fcntl.LOCK_UN)
+
+LOCKS_DIR_NAME = '.locks'
+"""Name of the subdirectory of a cache directory that holds lock files."""
+
+_STRIPE_LENGTH = 2
+"""How many leading characters of a cache filename select its lock file."""
+
+_registry_lock = threading.Lock()
+"""Mutex guarding ``_thread_locks``."""
+
+_thread_locks = {}
+"""Map from each path with a lock held or awaited to ``[lock, users]``."""
+
+
+@contextlib.contextmanager
+def _thread_lock(key):
+    """Hold the in-process lock for a key, creating it if needed."""
+    with _registry_lock:
+        entry = _thread_locks.setdefault(key, [threading.Lock(), 0])
+        entry[1] += 1
+    try:
+        with entry[0]:
+            yield
+    finally:
+        with _registry_lock:
+            entry[1] -= 1
+            if entry[1] == 0:
+                del _thread_locks[key]
+
+
+@contextlib.contextmanager
+def _file_lock(lock_path):
+    """Hold an advisory lock on a lock file, creating it if needed."""
+    lock_path.parent.mkdir(exist_ok=True)
+    fd = os.open(lock_path, os.O_RDWR | os.O_CREAT)
+    try:
+        _lock_file(fd)
+        try:
+            yield
+        finally:
+            _unlock_file(fd)
+    finally:
+        os.close(fd)
+
+
+def _lock_path(path):
+    """Get the path of the lock file that guards a cache file's path."""
+    return path.parent / LOCKS_DIR_NAME / f'{path.name[:_STRIPE_LENGTH]}.lock'
+
+
+@contextlib.contextmanager
+def single_flight(paths):
+    """
+    Hold the locks for computing and saving cache entries at ``paths``.
+
+    All the in-process locks are acquired before any file locks, and each kind
+    is acquired in sorted order, so callers locking overlapping sets of paths
+    cannot deadlock.
+    """
+    paths = [Path(path) for path in paths]
+    keys = sorted({os.path.abspath(path) for path in paths})
+    lock_paths = sorted({_lock_path(path) for path in paths})
+
+    with contextlib.ExitStack() as stack:
+        for key in keys:
+            stack.enter_context(_thread_lock(key))
+        for lock_path in lock_paths:
+            stack.enter_context(_file_lock(lock_path))
+        yield
+
+
+@contextlib.contextmanager
+def exclusive(data_dir, name):
+    """
+    Hold a lock, named ``name``, on a whole cache directory.
+
+    Like the locks held by ``single_flight``, this excludes other threads and
+    other processes. Don't call ``single_flight`` while holding it.
+    """
+    lock_path = Path(data_dir) / LOCKS_DIR_NAME / f'{name}.lock'
+    with _thread_lock(os.path.abspath(lock_path)), _file_lock(lock_path):
+        yield
@@ -0,0 +1,233 @@
+"""
+Append-only segment storage for cached embeddings.
+
+This backs the ``'segment'`` file type in ``embed.cached``. Instead of one file
+per entry, a cache directory holds two files:
+
+- ``segment.data``, which holds records appended one after another. Each is a
+  fixed-size header (holding the entry's key and its array's shape) followed by
+  the array's little-endian float32 data.
+
+- ``segment.index``, which holds a fixed-size entry for each record: the key,
+  the record's offset in ``segment.data``, and the record's length.
+
+Keys are the 32-byte blake3 digests that ``embed.cached`` also uses to name
+files. Each process reads the index into a dict once, and reads only what other
+processes have appended since, when a key is not found. A lookup is then a
+dict lookup and a single read at an offset, from a file that is kept open.
+
+Appending is done while holding a lock on the directory, writing the record
+before its index entry. A process killed while appending may leave an
+unreferenced record, which wastes space but is otherwise harmless, or a partial
+index entry, which readers ignore and the next appender truncates away. If a
+key is appended more than once, the last record is used.
+"""
+
+__all__ = [
+    'DATA_FILENAME',
+    'INDEX_FILENAME',
+    'get_store',
+    'close_stores',
+]
+
+import os
+from pathlib import Path
+import struct
+import threading
+
+import numpy as np
+
+from embed import _locking
+
+DATA_FILENAME = 'segment.data'
+"""Name of the file in a cache directory that holds the records."""
+
+INDEX_FILENAME = 'segment.index'
+"""Name of the file in a cache directory that indexes the records."""
+
+_LOCK_NAME = 'segment'
+"""Name of the directory lock that is held while appending."""
+
+_MAGIC = b'EMB1'
+"""Bytes that begin each record, to help detect a corrupt index."""
+
+_HEADER = struct.Struct('<4s32sIQQ')
+"""Record header: magic, key, number of dimensions, rows, columns."""
+
+_INDEX_ENTRY = struct.Struct('<32sQQ')
+"""Index entry: key, offset of the record, and length of the record."""
+
+_DTYPE = np.dtype('<f4')
+"""Data type of the stored arrays."""
+
+_stores = {}
+"""Map from absolute paths of cache directories to their open stores."""
+
+_stores_lock = threading.Lock()
+"""Mutex guarding ``_stores``."""
+
+
+def _shape_of(ndim, rows, columns):
+    """Get an array's shape, given the shape fields of a record header."""
+    if ndim == 1:
+        return (columns,)
+    if ndim == 2:
+        return (rows, columns)
+    raise ValueError(f'unsupported number of dimensions in record: {ndim}')
+
+
+def _shape_fields(embeddings):
+    """Get the shape fields of a record header for an array."""
+    if embeddings.ndim == 1:
+        return 1, 1, embeddings.shape[0]
+    if embeddings.ndim == 2:
+        return 2, *embeddings.shape
+    raise ValueError(f"can't store {embeddings.ndim}-dimensional array")
+
+
+class SegmentStore:
+    """Records and index of cached embeddings in a single cache directory."""
+
+    def __init__(self, data_dir):
+        """Create a store for a directory. Files are opened when needed."""
+        self._data_dir = Path(data_dir)
+        self._data_path = self._data_dir / DATA_FILENAME
+        self._index_path = self._data_dir / INDEX_FILENAME
+        self._lock = threading.Lock()
+        self._index = {}  # Map from each key to (offset, length).
+        self._index_read = 0  # How many bytes of the index file are read.
+        self._data_file = None
+
+    def get(self, key, mmap_mode=None):
+        """
+        Get the array stored for ``key``. Raise ``FileNotFoundError`` if none.
+
+        If ``mmap_mode`` is ``'r'`` or ``'c'``, the array is memory-mapped.
+        """
+        location = self._find(key)
+        if location is None:
+            raise FileNotFoundError(f'{key.hex()} not in {self._data_dir}')
+        offset, length = location
+
+        if mmap_mode is None:
+            record = self._read(offset, length)
+        else:
+            record = self._read(offset, _HEADER.size)
+
+        magic, stored_key, ndim, rows, columns = _HEADER.unpack_from(record)
+        if magic != _MAGIC or stored_key != key:
+            raise ValueError(f'bad record header at offset {offset}')
+        shape = _shape_of(ndim, rows, columns)
+        if length != _HEADER.size + _DTYPE.itemsize * rows * columns:
+            raise ValueError(f'bad record length at offset {offset}')
+
+        if mmap_mode is None:
+            data = np.frombuffer(record, _DTYPE, offset=_HEADER.size)
+            return data.reshape(shape).astype(np.float32)  # Writable copy.
+        if 0 in shape:  # There is no data to map.
+            return np.empty(shape, dtype=np.float32)
+        return np.memmap(self._data_path, dtype=_DTYPE, mode=mmap_mode,
+                         offset=offset + _HEADER.size, shape=shape)
+
+    def put(self, key, embeddings, *, fsync=False):
+        """Append an array for ``key``. If ``fsync``, flush it to disk."""
+        embeddings = np.ascontiguousarray(embeddings, dtype=_DTYPE)
+        header = _HEADER.pack(_MAGIC, key, *_shape_fields(embeddings))
+        record = header + embeddings.tobytes()
+
+        with _locking.exclusive(self._data_dir, _LOCK_NAME):
+            with open(self._data_path, mode='ab') as data_file:
+                offset = data_file.seek(0, os.SEEK_END)
+                data_file.write(record)
+                data_file.flush()
+                if fsync:
+                    os.fsync(data_file.fileno())
+
+            with open(self._index_path, mode='ab') as index_file:
+                end = index_file.seek(0, os.SEEK_END)
+                index_file.truncate(end - end % _INDEX_ENTRY.size)
+                index_file.seek(0, os.SEEK_END)
+                index_file.write(_INDEX_ENTRY.pack(key, offset, len(record)))
+                index_file.flush()
+                if fsync:
+                    os.fsync(index_file.fileno())
+
+        with self._lock:
+            self._index[key] = (offset, len(record))
+
+    def keys(self):
+        """Get a list of the keys of all stored arrays."""
+        with self._lock:
+            self._refresh()
+            return list(self._index)
+
+    def close(self):
+        """Close the data file, if open. It is reopened if needed."""
+        with self._lock:
+            if self._data_file is not None:
+                self._data_file.close()
+                self._data_file = None
+
+    def _find(self, key):
+        """Look up a key's record location, reading new index entries."""
+        with self._lock:
+            location = self._index.get(key)
+            if location is None:
+                self._refresh()
+                location = self._index.get(key)
+            return location
+
+    def _refresh(self):
+        """Read index entries appended since last read. Hold ``_lock``."""
+        try:
+            with open(self._index_path, mode='rb') as index_file:
+                index_file.seek(self._index_read)
+                data = index_file.read()
+        except FileNotFoundError:
+            return
+
+        usable = len(data) - len(data) % _INDEX_ENTRY.size
+        for key, offset, length in _INDEX_ENTRY.iter_unpack(data[:usable]):
+            self._index[key] = (offset, length)
+        self._index_read += usable
+
+    def _read(self, offset, length):
+        """Read bytes from the data file at an offset."""
+        with self._lock:
+            data_file = self._open_data_file()
+            if hasattr(os, 'pread'):
+                data = os.pread(data_file.fileno(), length, offset)
+            else:  # Windows.
+                data_file.seek(offset)
+                data = data_file.read(length)
+
+        if len(data) != length:
+            raise ValueError(f'truncated record at offset {offset}')
+        return data
+
+    def _open_data_file(self):
+        """Get the open data file, opening it if needed. Hold ``_lock``."""
+        if self._data_file is None:
+            # pylint: disable-next=consider-using-with  # Closed by close().
+            self._data_file = open(self._data_path, mode='rb')
+        return self._data_file
+
+
+def get_store(data_dir):
+    """Get the store for a cache directory, creating it if needed."""
+    key = os.path.abspath(data_dir)
+    with _stores_lock:
+        try:
+            return _stores[key]
+        except KeyError:
+            store = _stores[key] = SegmentStore(data_dir)
+            return store
+
+
+def close_stores():
+    """Close the files of all stores, and forget them."""
+    with _stores_lock:
+        stores = list(_stores.values())
+        _stores.clear()
+    for store in stores:
+        store.close()
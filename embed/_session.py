@@ -0,0 +1,114 @@
+"""
+Shared HTTP session for the ``requests``-based embedding functions.
+
+Making every request through one long-lived ``requests.Session`` lets TCP
+connections (and their TLS sessions) be kept alive and reused, instead of
+being set up anew for each embedding. The session is created when first
+needed. It can be replaced with ``set_session`` and closed with
+``close_session``. The public functions here are re-exported by ``embed``.
+"""
+
+__all__ = [
+    'create_session',
+    'get_session',
+    'set_session',
+    'close_session',
+]
+
+import threading
+
+import requests
+import requests.adapters
+import urllib3.util
+
+_RETRY_STATUSES = frozenset({500, 502, 503, 504})
+"""
+HTTP statuses the session's adapters retry on.
+
+This does not include 429 Too Many Requests, which is handled by backoff.
+"""
+
+# pylint: disable-next=invalid-name  # Reassigned, so not a constant.
+_session = None
+"""Session used by ``embed_one_req`` and ``embed_many_req``, once created."""
+
+_lock = threading.Lock()
+"""Mutex guarding creation and replacement of ``_session``."""
+
+
+def create_session(*, pool_size=16, max_retries=3, keep_alive=True):
+    """
+    Create a session suitable for the ``requests``-based embedding functions.
+
+    ``pool_size`` is the most connections kept open to the API host. It should
+    be at least the number of threads making requests at once, such as the
+    ``max_workers`` passed to ``embed_many_req``. ``max_retries`` is how many
+    times to retry a request after a connection error or a server error (5xx).
+    If ``keep_alive`` is false, each connection is closed after one request.
+    """
+    retry = urllib3.util.Retry(
+        total=max_retries,
+        allowed_methods=None,  # Embedding requests are safe to retry.
+        status_forcelist=_RETRY_STATUSES,
+        backoff_factor=0.5,
+        raise_on_status=False,
+        respect_retry_after_header=False,  # Or 429 would be retried here.
+    )
+    adapter = requests.adapters.HTTPAdapter(
+        pool_connections=1,
+        pool_maxsize=pool_size,
+        max_retries=retry,
+    )
+
+    session = requests.Session()
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    if not keep_alive:
+        session.headers['Connection'] = 'close'
+    return session
+
+
+def get_session():
+    """Get the shared session, creating it with default settings if needed."""
+    # pylint: disable-next=global-statement  # Shared state is the point.
+    global _session
+
+    session = _session  # Read only once, in case another thread changes it.
+    if session is not None:
+        return session
+
+    with _lock:
+        if _session is None:
+            _session = create_session()
+        return _session
+
+
+def set_session(session):
+    """
+    Make the ``requests``-based embedding functions use the given session.
+
+    The previous session, if any, is not closed. Passing ``None`` causes a new
+    session with default settings to be created when next needed.
+    """
+    # pylint: disable-next=global-statement  # Shared state is the point.
+    global _session
+
+    with _lock:
+        _session = session
+
+
+def close_session():
+    """
+    Close the shared session, if it exists, and stop using it.
+
+    A new session with default settings is created when next needed.
+    """
+    # pylint: disable-next=global-statement  # Shared state is the point.
+    global _session
+
+    with _lock:
+        session = _session
+        _session = None
+
+    if session is not None:
+        session.close()
@@ -0,0 +1,197 @@
+"""
+SQLite storage for cached embeddings.
+
+This backs the ``'sqlite'`` file type in ``embed.cached``. Each cache directory
+has one database file, ``cache.sqlite3``, with one row per entry. A row holds
+the entry's key (the 32-byte blake3 digest ``embed.cached`` also uses to name
+files), its array's shape, and its little-endian float32 data as a BLOB.
+
+The database uses write-ahead logging (WAL), so readers in any number of
+threads and processes don't block, or get blocked by, a writer. Each thread
+uses its own connection. Many entries can be looked up, or saved, at once, as
+``embed.cached`` does for a batch of texts with ``per_text=True``.
+"""
+
+__all__ = [
+    'DATABASE_FILENAME',
+    'get_store',
+    'close_stores',
+]
+
+import os
+from pathlib import Path
+import sqlite3
+import threading
+
+import numpy as np
+
+DATABASE_FILENAME = 'cache.sqlite3'
+"""Name of the database file in a cache directory."""
+
+_BUSY_TIMEOUT = 60.0
+"""Seconds a connection waits for another to finish writing, before failing."""
+
+_MAX_PARAMETERS = 500
+"""Most keys looked up in one query. SQLite may limit this to 999."""
+
+_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS embeddings (
+    key BLOB PRIMARY KEY,
+    ndim INTEGER NOT NULL,
+    rows INTEGER NOT NULL,
+    columns INTEGER NOT NULL,
+    data BLOB NOT NULL
+) WITHOUT ROWID
+'''
+"""Statement that creates the table, if it does not exist."""
+
+_DTYPE = np.dtype('<f4')
+"""Data type of the stored arrays."""
+
+_stores = {}
+"""Map from absolute paths of cache directories to their stores."""
+
+_stores_lock = threading.Lock()
+"""Mutex guarding ``_stores``."""
+
+
+def _to_row(key, embeddings):
+    """Make a table row from a key and an array."""
+    embeddings = np.ascontiguousarray(embeddings, dtype=_DTYPE)
+    if embeddings.ndim == 1:
+        rows, columns = 1, embeddings.shape[0]
+    elif embeddings.ndim == 2:
+        rows, columns = embeddings.shape
+    else:
+        raise ValueError(f"can't store {embeddings.ndim}-dimensional array")
+    return key, embeddings.ndim, rows, columns, embeddings.tobytes()
+
+
+def _from_row(ndim, rows, columns, data):
+    """Make a writable array from the shape and data of a table row."""
+    if ndim == 1:
+        shape = (columns,)
+    elif ndim == 2:
+        shape = (rows, columns)
+    else:
+        raise ValueError(f'unsupported number of dimensions in row: {ndim}')
+    if len(data) != _DTYPE.itemsize * rows * columns:
+        raise ValueError('row data does not match its shape')
+    return np.frombuffer(data, _DTYPE).reshape(shape).astype(np.float32)
+
+
+class SqliteStore:
+    """Database of cached embeddings in a single cache directory."""
+
+    def __init__(self, data_dir):
+        """Create a store for a directory. Connections are made when needed."""
+        self._path = Path(data_dir) / DATABASE_FILENAME
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._connections = []
+
+    def get(self, key):
+        """Get the array stored for ``key``. Raise ``KeyError`` if none."""
+        row = self._connect().execute(
+            'SELECT ndim, rows, columns, data FROM embeddings WHERE key = ?',
+            (key,),
+        ).fetchone()
+        if row is None:
+            raise KeyError(key)
+        return _from_row(*row)
+
+    def get_many(self, keys):
+        """
+        Get the arrays stored for any of ``keys``, as a dict.
+
+        Keys that have no entry, or whose row is malformed, are absent from the
+        result. Keys are looked up together, in as few queries as SQLite's
+        parameter limit allows.
+        """
+        keys = list(keys)
+        connection = self._connect()
+        found = {}
+        for start in range(0, len(keys), _MAX_PARAMETERS):
+            chunk = keys[start:start + _MAX_PARAMETERS]
+            placeholders = ', '.join('?' * len(chunk))
+            rows = connection.execute(
+                'SELECT key, ndim, rows, columns, data FROM embeddings'
+                f' WHERE key IN ({placeholders})',
+                chunk,
+            )
+            for key, *row in rows:
+                try:
+                    found[key] = _from_row(*row)
+                except ValueError:
+                    pass  # Treat it as missing, so it is recomputed.
+        return found
+
+    def keys(self):
+        """Get a list of the keys of all stored arrays."""
+        rows = self._connect().execute('SELECT key FROM embeddings')
+        return [key for (key,) in rows]
+
+    def put(self, key, embeddings, *, fsync=False):
+        """Store an array for ``key``. If ``fsync``, flush it to disk."""
+        self.put_many([(key, embeddings)], fsync=fsync)
+
+    def put_many(self, items, *, fsync=False):
+        """Store ``(key, array)`` pairs, in a single transaction."""
+        rows = [_to_row(key, embeddings) for key, embeddings in items]
+        connection = self._connect()
+        connection.execute(
+            f'PRAGMA synchronous = {"FULL" if fsync else "NORMAL"}')
+        with connection:
+            connection.executemany(
+                'INSERT OR REPLACE INTO embeddings VALUES (?, ?, ?, ?, ?)',
+                rows,
+            )
+
+    def close(self):
+        """Close all connections. Only call this when no thread uses them."""
+        with self._lock:
+            connections = self._connections
+            self._connections = []
+            self._local = threading.local()
+        for connection in connections:
+            connection.close()
+
+    def _connect(self):
+        """Get this thread's connection, making it if needed."""
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            if not self._path.parent.is_dir():
+                raise FileNotFoundError(
+                    f'cache directory not found: {self._path.parent}')
+            connection = sqlite3.connect(
+                self._path,
+                timeout=_BUSY_TIMEOUT,
+                check_same_thread=False,  # So close() can close it.
+            )
+            connection.execute('PRAGMA journal_mode = WAL')
+            with connection:
+                connection.execute(_SCHEMA)
+            with self._lock:
+                self._connections.append(connection)
+            self._local.connection = connection
+        return connection
+
+
+def get_store(data_dir):
+    """Get the store for a cache directory, creating it if needed."""
+    key = os.path.abspath(data_dir)
+    with _stores_lock:
+        try:
+            return _stores[key]
+        except KeyError:
+            store = _stores[key] = SqliteStore(data_dir)
+            return store
+
+
+def close_stores():
+    """Close the connections of all stores, and forget them."""
+    with _stores_lock:
+        stores = list(_stores.values())
+        _stores.clear()
+    for store in stores:
+        store.close()
@@ -0,0 +1,202 @@
+"""
+Async embed functions, for use with ``asyncio``.
+
+These make requests with ``aiohttp`` instead of ``requests``, so they don't
+block the event loop. Each ``Client`` holds one pooled HTTP session and limits
+how many requests it has in flight at once. To reuse its connections, pass a
+client to the module-level ``embed_one`` and ``embed_many`` functions, or to
+those in ``embed.aio.cached``, with ``client``, or call its methods directly.
+Without ``client``, they each use a new client that is closed when they
+return.
+"""
+
+__all__ = [
+    'cached',
+    'DEFAULT_MAX_CONCURRENCY',
+    'Client',
+    'embed_one',
+    'embed_many',
+]
+
+import asyncio
+import contextlib
+import http
+
+import aiohttp
+import backoff
+import numpy as np
+import orjson
+
+import embed
+from embed import _keys
+
+from . import cached
+
+DEFAULT_MAX_CONCURRENCY = 16
+"""Default maximum number of requests a ``Client`` has in flight at once."""
+
+
+def _needs_backoff(response):
+    """Check if a response has given an HTTP 429 Too Many Requests error."""
+    return response.status == http.HTTPStatus.TOO_MANY_REQUESTS
+
+
+class Client:
+    """
+    Async client for the embeddings endpoint.
+
+    The HTTP session and the semaphore that limits in-flight requests to
+    ``max_concurrency`` are created on first use, in the running event loop.
+    A client should only be used from one event loop. Close it with ``aclose``
+    or by using it in an ``async with`` statement.
+    """
+
+    def __init__(self, *, max_concurrency=None):
+        """Create a client with the given limit on concurrent requests."""
+        if max_concurrency is None:
+            max_concurrency = DEFAULT_MAX_CONCURRENCY
+        if max_concurrency < 1:
+            raise ValueError(
+                f'max_concurrency must be positive, got {max_concurrency!r}')
+
+        self._max_concurrency = max_concurrency
+        self._session = None
+        self._semaphore = None
+
+    async def __aenter__(self):
+        """Enter an ``async with`` block that closes the client on exit."""
+        return self
+
+    async def __aexit__(self, *_):
+        """Close the client."""
+        await self.aclose()
+
+    @property
+    def max_concurrency(self):
+        """Maximum number of requests this client has in flight at once."""
+        return self._max_concurrency
+
+    async def aclose(self):
+        """Close the HTTP session, if it was opened."""
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    async def embed_one(self, text, *, encoding_format='float'):
+        """
+        Embed a single piece of text.
+
+        ``encoding_format`` is as in ``embed.embed_one_req``.
+        """
+        embeddings = await self._fetch_embeddings(text, encoding_format)
+        return embeddings[0]
+
+    async def embed_many(self, texts, *, max_items=None, max_tokens=None,
+                         encoding_format='float'):
+        """
+        Embed multiple pieces of text.
+
+        Chunking with ``max_items`` and ``max_tokens`` is as in
+        ``embed.embed_many``. All chunks are requested concurrently, but no
+        more than ``max_concurrency`` requests are in flight at once. If any
+        chunk fails, the requests for the others are cancelled.
+        ``encoding_format`` is as in ``embed.embed_one_req``.
+        """
+        embeddings = np.empty((len(texts), embed.DIMENSION), dtype=np.float32)
+
+        async def embed_chunk(start, stop):
+            embeddings[start:stop] = await self._fetch_embeddings(
+                texts[start:stop], encoding_format)
+
+        # pylint: disable-next=protected-access  # Chunk as embed does.
+        ranges = embed._split_into_chunks(texts, max_items, max_tokens)
+        tasks = [asyncio.ensure_future(embed_chunk(*bounds))
+                 for bounds in ranges]
+        try:
+            await asyncio.gather(*tasks)
+        except BaseException:
+            for task in tasks:
+                task.cancel()  # Don't keep requesting chunks no one will get.
+            await asyncio.wait(tasks)
+            raise
+        return embeddings
+
+    async def _fetch_embeddings(self, text_or_texts, encoding_format):
+        """Request embeddings. Return them as a matrix."""
+        # pylint: disable=protected-access  # Parse as embed does.
+        response = await self._post_request(text_or_texts, encoding_format)
+        response.raise_for_status()
+        return embed._parse_embeddings(await response.read())
+
+    @backoff.on_predicate(backoff.expo, _needs_backoff)
+    async def _post_request(self, text_or_texts, encoding_format):
+        """Make a POST request to the API endpoint, with backoff."""
+        # pylint: disable=protected-access  # Use the same URL as embed does.
+        session = self._get_session()
+        async with self._semaphore:
+            response = await session.post(
+                url=embed._EMBEDDINGS_URL,
+                headers={
+                    'Authorization': f'Bearer {_keys.api_key}',
+                    'Content-Type': 'application/json',
+                },
+                data=orjson.dumps({
+                    'input': text_or_texts,
+                    'model': 'text-embedding-ada-002',
+                    'encoding_format': encoding_format,
+                }),
+            )
+            await response.read()  # Read the body so the connection is freed.
+        return response
+
+    def _get_session(self):
+        """Get the HTTP session, creating it and the semaphore if needed."""
+        # pylint: disable=protected-access  # Use the same timeout as embed.
+        if self._session is None:
+            self._semaphore = asyncio.Semaphore(self._max_concurrency)
+            self._session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=self._max_concurrency),
+                timeout=aiohttp.ClientTimeout(
+                    total=embed._REQUESTS_TIMEOUT.total_seconds()),
+            )
+        return self._session
+
+
+@contextlib.asynccontextmanager
+async def _using(client):
+    """
+    Use ``client`` in an ``async with`` statement, or a new client if ``None``.
+
+    A client passed in is left open, to be used again. A new one is closed.
+    """
+    if client is not None:
+        yield client
+        return
+    async with Client() as new_client:
+        yield new_client
+
+
+async def embed_one(text, *, encoding_format='float', client=None):
+    """
+    Embed a single piece of text.
+
+    This uses ``client``, or if it is ``None``, a new ``Client`` that is closed
+    when done. ``encoding_format`` is as in ``embed.embed_one_req``.
+    """
+    async with _using(client) as active_client:
+        return await active_client.embed_one(
+            text, encoding_format=encoding_format)
+
+
+async def embed_many(texts, *, max_items=None, max_tokens=None,
+                     encoding_format='float', client=None):
+    """
+    Embed multiple pieces of text.
+
+    This uses ``client``, or if it is ``None``, a new ``Client`` that is closed
+    when done. Other options are as in ``Client.embed_many``.
+    """
+    async with _using(client) as active_client:
+        return await active_client.embed_many(
+            texts, max_items=max_items, max_tokens=max_tokens,
+            encoding_format=encoding_format)
@@ -0,0 +1,182 @@
+"""
+Async versions of embedding functions that cache to disk.
+
+These share their cache with ``embed.cached``. Disk I/O is done in worker
+threads, so loading and saving embeddings does not block the event loop.
+
+Like ``embed.cached``, these compute each missing embedding once, even when
+it is requested concurrently, by tasks in any event loop, by threads, or by
+other processes. They hold the same single-flight locks as ``embed.cached``,
+acquiring and releasing them in worker threads. Tasks in the same event loop
+first wait for each other on ``asyncio`` locks, so worker threads only wait
+for other threads or processes, and can't all be taken up waiting for a task
+that needs one to finish.
+"""
+
+__all__ = [
+    'embed_one',
+    'embed_many',
+]
+
+import asyncio
+import contextlib
+import functools
+from pathlib import Path
+
+from embed import _locking, aio
+from embed import cached as _sync_cached
+
+_loop_locks = {}
+"""Map from each ``(loop, lock file path)`` in use to ``[lock, users]``."""
+
+
+@contextlib.asynccontextmanager
+async def _loop_lock(lock_path):
+    """Hold this event loop's ``asyncio`` lock for a lock file."""
+    key = (asyncio.get_running_loop(), lock_path)
+    entry = _loop_locks.setdefault(key, [asyncio.Lock(), 0])
+    entry[1] += 1
+    try:
+        async with entry[0]:
+            yield
+    finally:
+        entry[1] -= 1
+        if entry[1] == 0:
+            del _loop_locks[key]
+
+
+@contextlib.asynccontextmanager
+async def _in_thread(context_manager):
+    """
+    Enter and exit a blocking context manager in worker threads.
+
+    If this is cancelled while entering, the context manager is exited as soon
+    as it has been entered, so locks it acquires are not left held.
+    """
+    stack = contextlib.ExitStack()
+    entering = asyncio.ensure_future(
+        asyncio.to_thread(stack.enter_context, context_manager))
+
+    def exit_if_entered(task):
+        if not task.cancelled() and task.exception() is None:
+            stack.close()
+
+    try:
+        await asyncio.shield(entering)
+    except asyncio.CancelledError:
+        entering.add_done_callback(exit_if_entered)
+        raise
+    try:
+        yield
+    finally:
+        await asyncio.to_thread(stack.close)
+
+
+@contextlib.asynccontextmanager
+async def _single_flight(paths):
+    """Hold the locks for computing and saving cache entries at ``paths``."""
+    paths = [Path(path) for path in paths]
+    # pylint: disable-next=protected-access  # Lock as single_flight does.
+    lock_paths = sorted({_locking._lock_path(path) for path in paths})
+    async with contextlib.AsyncExitStack() as stack:
+        for lock_path in lock_paths:
+            await stack.enter_async_context(_loop_lock(lock_path))
+        await stack.enter_async_context(
+            _in_thread(_locking.single_flight(paths)))
+        yield
+
+
+async def _embed_cache(func, text_or_texts, data_dir, file_type, mmap_mode):
+    """Load embeddings from disk, or compute and save them."""
+    # pylint: disable=protected-access  # We share the implementation.
+    name = func.__name__
+    file_type = _sync_cached._resolve_file_type(file_type)
+    _sync_cached._check_mmap_mode(mmap_mode)
+    tier_paths = _sync_cached._build_tier_paths(text_or_texts, data_dir,
+                                                file_type)
+    try:
+        return await asyncio.to_thread(
+            functools.partial(_sync_cached._load, mmap_mode=mmap_mode),
+            name, tier_paths, file_type)
+    except _sync_cached._CacheMiss:
+        pass
+
+    async with _single_flight(tier_paths[:1]):
+        try:  # Another task, thread, or process may have saved it meanwhile.
+            return await asyncio.to_thread(
+                functools.partial(_sync_cached._load, mmap_mode=mmap_mode,
+                                  quarantine=True),
+                name, tier_paths, file_type)
+        except _sync_cached._CacheMiss:
+            embeddings = await func(text_or_texts)
+            await asyncio.to_thread(_sync_cached._save,
+                                    name, text_or_texts, embeddings,
+                                    data_dir, file_type)
+            return embeddings
+
+
+async def _embed_cache_per_text(func, texts, data_dir, file_type):
+    """
+    Load each text's embedding from disk, or compute and save the missing ones.
+
+    This behaves like the function of the same name in ``embed.cached``.
+    """
+    # pylint: disable=protected-access  # We share the implementation.
+    name = func.__name__
+    file_type = _sync_cached._resolve_file_type(file_type)
+    embeddings, missing = await asyncio.to_thread(
+        _sync_cached._load_per_text, name, texts, data_dir, file_type)
+    if not missing:
+        return embeddings
+
+    paths = _sync_cached._build_paths(
+        missing, _sync_cached._tiers(data_dir)[0], file_type)
+    async with _single_flight(paths):
+        # Others may have saved some of them while we waited.
+        found = await asyncio.to_thread(
+            functools.partial(_sync_cached._load_missing, quarantine=True),
+            name, missing, data_dir, file_type)
+        missing = _sync_cached._fill_rows(embeddings, missing, found)
+        if missing:
+            computed = await func(list(missing))
+            _sync_cached._fill_rows(embeddings, missing,
+                                    dict(zip(missing, computed)))
+            await asyncio.to_thread(_sync_cached._save_per_text, name,
+                                    missing, computed, data_dir, file_type)
+    return embeddings
+
+
+def _embedder(client, name):
+    """Get an embedding function of ``client``, or of ``embed.aio``."""
+    return getattr(aio if client is None else client, name)
+
+
+async def embed_one(text, *, data_dir=None, file_type=None, mmap_mode=None,
+                    client=None):
+    """
+    Embed a single piece of text. Caches to disk.
+
+    ``mmap_mode`` is as in ``embed.cached.embed_one``. ``client`` is as in
+    ``embed.aio.embed_one``.
+    """
+    return await _embed_cache(
+        _embedder(client, 'embed_one'), text, data_dir, file_type, mmap_mode)
+
+
+# pylint: disable-next=too-many-arguments  # All options are keyword-only.
+async def embed_many(texts, *, data_dir=None, file_type=None, per_text=False,
+                     mmap_mode=None, client=None):
+    """
+    Embed multiple pieces of text. Caches to disk.
+
+    If ``per_text`` is true, each text is cached separately (sharing entries
+    with ``embed_one``), and only texts not already cached are sent to the API.
+    ``mmap_mode`` is as in ``embed.cached.embed_many``. ``client`` is as in
+    ``embed.aio.embed_many``.
+    """
+    func = _embedder(client, 'embed_many')
+    if per_text:
+        # pylint: disable-next=protected-access  # We share the check.
+        _sync_cached._check_mmap_mode(mmap_mode)
+        return await _embed_cache_per_text(func, texts, data_dir, file_type)
+    return await _embed_cache(func, texts, data_dir, file_type, mmap_mode)
@@ -0,0 +1,201 @@
+"""
+Micro-batching of single-text embedding requests.
+
+A ``MicroBatcher`` gathers texts submitted concurrently, from any number of
+threads, over a short window, and embeds them together with one call to an
+``embed_many``-like function. Each caller gets a future for its own row.
+
+To batch calls that would otherwise go to ``embed.cached.embed_one``, use a
+per-text caching function, so cached texts are not sent to the API::
+
+    batcher = MicroBatcher(
+        functools.partial(embed.cached.embed_many, per_text=True))
+"""
+
+__all__ = [
+    'DEFAULT_MAX_WAIT',
+    'DEFAULT_MAX_BATCH_SIZE',
+    'MicroBatcher',
+]
+
+import collections
+import concurrent.futures
+import datetime
+import threading
+import time
+
+import embed
+
+DEFAULT_MAX_WAIT = datetime.timedelta(milliseconds=10)
+"""Default longest time a text waits for others to be batched with it."""
+
+DEFAULT_MAX_BATCH_SIZE = 256
+"""Default maximum number of distinct texts sent in a single batch."""
+
+_Settings = collections.namedtuple('_Settings', [
+    'embed_many',
+    'max_wait',
+    'max_batch_size',
+])
+"""How a ``MicroBatcher`` embeds texts, and when it sends a batch."""
+
+
+class MicroBatcher:
+    """
+    Batch concurrent single-text embedding requests into multi-text calls.
+
+    When a text is submitted and no batch is being gathered, a batch starts.
+    It is sent once it holds ``max_batch_size`` distinct texts or once
+    ``max_wait`` has elapsed since it started, whichever is first. Up to
+    ``max_concurrency`` batches may be in flight at once.
+
+    A text that is submitted while an identical text is still waiting or in
+    flight is not sent again. Each submission still gets its own future, so
+    one caller cancelling does not cancel the others, but the resulting array
+    is shared, and should not be modified. A text is only left out of its
+    batch if all its callers cancel before the batch is sent.
+    """
+
+    def __init__(self, embed_many=None, *, max_wait=None,
+                 max_batch_size=None, max_concurrency=4):
+        """
+        Create a batcher and start its background thread.
+
+        ``embed_many`` is called with a list of texts and must return a matrix
+        with one row per text. If it is omitted, ``embed.embed_many`` is used.
+        """
+        if max_wait is None:
+            max_wait = DEFAULT_MAX_WAIT
+        if max_batch_size is None:
+            max_batch_size = DEFAULT_MAX_BATCH_SIZE
+        if max_batch_size < 1:
+            raise ValueError(
+                f'max_batch_size must be positive, got {max_batch_size!r}')
+
+        self._settings = _Settings(
+            embed_many=embed_many,
+            max_wait=max_wait.total_seconds(),
+            max_batch_size=max_batch_size,
+        )
+
+        self._condition = threading.Condition()
+        self._waiting = {}  # Texts not yet sent, mapped to callers' futures.
+        self._in_flight = {}  # Same, but also including texts already sent.
+        self._closed = False
+
+        self._executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=max_concurrency,
+            thread_name_prefix='MicroBatcher-send',
+        )
+        self._thread = threading.Thread(
+            target=self._gather_batches,
+            name='MicroBatcher-gather',
+            daemon=True,
+        )
+        self._thread.start()
+
+    def __enter__(self):
+        """Enter a ``with`` block that closes the batcher on exit."""
+        return self
+
+    def __exit__(self, *_):
+        """Close the batcher."""
+        self.close()
+
+    def submit(self, text):
+        """Submit a text to be embedded. Return a future for its embedding."""
+        with self._condition:
+            if self._closed:
+                raise RuntimeError('cannot submit to a closed MicroBatcher')
+
+            future = concurrent.futures.Future()
+            futures = self._in_flight.get(text)
+            if futures is None:
+                self._waiting[text] = self._in_flight[text] = [future]
+                self._condition.notify()
+            else:
+                futures.append(future)  # Resolved when the first one is.
+
+            return future
+
+    def embed_one(self, text):
+        """Embed a single piece of text, in a batch. Wait for the result."""
+        return self.submit(text).result()
+
+    def close(self):
+        """Send any texts still waiting, wait for all batches, and stop."""
+        with self._condition:
+            self._closed = True
+            self._condition.notify()
+
+        self._thread.join()
+        self._executor.shutdown(wait=True)
+
+    def _gather_batches(self):
+        """Gather texts into batches and send them. Run by the thread."""
+        while True:
+            with self._condition:
+                while not self._waiting and not self._closed:
+                    self._condition.wait()
+                if not self._waiting:
+                    return  # Closed, and nothing left to send.
+
+                deadline = time.monotonic() + self._settings.max_wait
+                while (len(self._waiting) < self._settings.max_batch_size
+                       and not self._closed):
+                    timeout = deadline - time.monotonic()
+                    if timeout <= 0:
+                        break
+                    self._condition.wait(timeout)
+
+                batch = self._take_batch()
+
+            if batch:
+                self._executor.submit(self._send, batch)
+
+    def _take_batch(self):
+        """Remove up to ``max_batch_size`` waiting texts, and return them."""
+        batch = []
+        for text in list(self._waiting)[:self._settings.max_batch_size]:
+            futures = self._waiting.pop(text)
+            futures[:] = [future for future in futures
+                          if future.set_running_or_notify_cancel()]
+            if futures:
+                batch.append(text)
+            else:
+                del self._in_flight[text]  # All cancelled, so don't send it.
+        return batch
+
+    def _send(self, texts):
+        """Embed a batch of texts and resolve their callers' futures."""
+        try:
+            if self._settings.embed_many is None:
+                embeddings = embed.embed_many(texts)
+            else:
+                embeddings = self._settings.embed_many(texts)
+            if len(embeddings) != len(texts):
+                raise ValueError(
+                    f'got {len(embeddings)} embeddings for {len(texts)} texts')
+        # pylint: disable-next=broad-exception-caught  # Caller gets it.
+        except BaseException as error:
+            for futures in self._finish(texts):
+                for future in futures:
+                    future.set_exception(error)
+        else:
+            for futures, embedding in zip(self._finish(texts), embeddings):
+                for future in futures:
+                    future.set_result(embedding)
+
+    def _finish(self, texts):
+        """
+        Stop treating the texts as in flight. Return their callers' futures.
+
+        Futures of callers who submitted a text after it was sent are marked
+        running here, unless they were cancelled, so they can't be cancelled
+        while being resolved.
+        """
+        with self._condition:
+            batch = [self._in_flight.pop(text) for text in texts]
+        return [[future for future in futures
+                 if future.running() or future.set_running_or_notify_cancel()]
+                for futures in batch]
@@ -1,8 +1,81 @@
-"""Versions of embedding functions that cache to disk."""
+"""
+Versions of embedding functions that cache to disk.
+
+When several threads or processes sharing a cache directory need the same
+uncached embedding at once, only one of them computes it. The others wait
+for it to be saved, then load it.
+
+Each file is written under a temporary name and renamed into place, so a
+process that is killed while saving never leaves a partial file behind. A
+cache file that cannot be parsed (such as one truncated by an older version)
+is treated as missing, and moved aside with a ``.corrupt`` suffix.
+
+Cached safetensors and segment entries (see below) can be loaded by
+memory-mapping them instead of reading them, by passing ``mmap_mode``. This is
+faster for large batches, and only the parts of the file that are used take up
+memory. With ``'r'``, the result is read-only. With ``'c'``, it can be
+modified, and changes are not written back. (On Windows, a mapped file cannot
+be replaced or removed while the result is still in use.) Embeddings that were
+not cached are returned as ordinary arrays. Calls that pass ``mmap_mode`` skip
+``MEMORY_CACHE``, so they don't get an in-memory copy instead of a mapping.
+
+With the ``'segment'`` file type, entries are not kept in separate files, but
+appended to a single file, with an index of where each one is. This scales to
+far more entries, since lookups don't open files or search the directory.
+
+With the ``'sqlite'`` file type, entries are rows in a single SQLite database
+per directory. Then ``embed_many`` with ``per_text=True`` looks up a whole
+batch of texts in one query, and saves what it computes in one transaction.
+
+A ``'json'`` entry is loaded from a ``.safetensors`` file for the same entry
+instead, if there is one, since that holds the same values, and is much
+faster to load. With ``CONVERT_JSON = True``, such a file is saved, in a
+background thread, for each ``'json'`` entry that is loaded without one, so an
+existing JSON cache gets faster as it is used. (The ``.json`` files are kept.)
+To convert a whole cache at once, use ``embed.maintenance.convert_json``.
+
+To take less space, entries can be saved with less precision, with the
+``'float16'`` file type (half the size of ``'safetensors'``), or the ``'int8'``
+file type (a quarter of the size), which saves each vector's elements as 8-bit
+integers, scaled by the vector's largest magnitude. Loaded entries are
+converted back to float32. Cosine similarities between loaded
+``text-embedding-ada-002`` embeddings were found to differ from those between
+the originals by up to about ``1e-4`` with ``'float16'``, and ``5e-3`` with
+``'int8'`` (see ``benchmarks.bench_quantized``). Embeddings that were just
+computed, rather than loaded, are returned at full precision.
+
+Cache files are either all directly in the cache directory, or, with
+``LAYOUT = 'sharded'``, spread over two levels of subdirectories. Either way,
+files in the other layout are also found, so an existing cache keeps working
+while, or without, being converted with ``embed.maintenance.migrate``.
+
+Nothing here removes cache files, or copies whole caches. For that, see
+``embed.maintenance``.
+
+The ``data_dir`` argument can also be a list of cache directories, fastest
+first, such as a local directory followed by one shared by many machines (over
+NFS, or a mounted volume). They are checked in order, before calling the API.
+Embeddings found in a later directory are promoted: saved in each directory
+before it. Newly computed embeddings are saved in the first directory, and in
+the others if ``WRITE_BACK`` is ``'all'``. Failures to save in any but the
+first directory, such as one mounted read-only, are logged, not raised.
+Only the first directory's locks keep callers from computing the same
+embedding at once, so machines sharing only a later directory may each compute
+it.
+
+To keep frequently used embeddings in memory, so they need not be loaded from
+disk at all, set ``MEMORY_CACHE`` to an ``embed.memory.MemoryCache``.
+"""
 
 __all__ = [
     'DEFAULT_DATA_DIR',
     'DEFAULT_FILE_TYPE',
+    'FSYNC',
+    'MEMORY_CACHE',
+    'CORRUPT_SUFFIX',
+    'LAYOUT',
+    'WRITE_BACK',
+    'CONVERT_JSON',
     'embed_one',
     'embed_many',
     'embed_one_eu',
@@ -11,8 +84,16 @@ __all__ = [
     'embed_many_req',
 ]
 
+import concurrent.futures
+import contextlib
 import logging
+import os
 from pathlib import Path
+import re
+import secrets
+import sqlite3
+import struct
+import threading
 
 import blake3
 import numpy as np
@@ -20,6 +101,7 @@ import orjson
 import safetensors.numpy
 
 import embed
+from embed import _locking, _segment, _sqlite
 
 DEFAULT_DATA_DIR = Path('data')
 """Default directory to cache embeddings."""
@@ -27,6 +109,64 @@ DEFAULT_DATA_DIR = Path('data')
 DEFAULT_FILE_TYPE = 'safetensors'
 """Default file type to use for caching embeddings."""
 
+FSYNC = False
+"""
+Whether to flush each saved file to the storage device before using it.
+
+This makes saves slower, but keeps entries saved shortly before a power loss
+or operating system crash. Saves are atomic either way: a cache file is either
+fully written or absent.
+"""
+
+MEMORY_CACHE = None
+"""
+``embed.memory.MemoryCache`` to check before loading from disk, or ``None``.
+
+When this is set, embeddings loaded from or saved to disk are also stored in
+it, and those stored are returned from it (as copies) without touching disk.
+Loads that pass ``mmap_mode`` neither check it nor store what they map.
+"""
+
+CORRUPT_SUFFIX = '.corrupt'
+"""Suffix added to the names of cache files found to be corrupt."""
+
+LAYOUT = 'flat'
+"""
+How cache files are arranged in a cache directory: ``'flat'`` or ``'sharded'``.
+
+With ``'flat'``, each file is directly in the cache directory. With
+``'sharded'``, each is in a subdirectory of a subdirectory, named for the first
+and second pairs of hex digits of its filename (as in ``ab/cd/abcd...``), so no
+directory holds a huge number of entries. Files are saved in this layout, and
+looked for first in it, then in the other one. This has no effect on the
+``'segment'`` and ``'sqlite'`` file types, which keep each directory's entries
+in a single store.
+"""
+
+WRITE_BACK = 'all'
+"""
+Which cache directories newly computed embeddings are saved in: ``'all'`` or
+``'first'``.
+
+This matters only when ``data_dir`` is a list of cache directories. Either way,
+embeddings found in a later directory are promoted into the earlier ones.
+"""
+
+CONVERT_JSON = False
+"""
+Whether to save a ``.safetensors`` copy of each ``'json'`` entry loaded.
+
+Copies are saved in a background thread, next to the JSON files, which are
+kept. Later lookups of the entries, still with ``file_type='json'``, load the
+copies, which is much faster.
+"""
+
+_WRITE_BACK_POLICIES = frozenset({'all', 'first'})
+"""Values ``WRITE_BACK`` may have."""
+
+_SHARD_LENGTH = 2
+"""How many hex digits of a filename name each level of subdirectory."""
+
 _ORJSON_SAVE_OPTIONS = (
     orjson.OPT_APPEND_NEWLINE |
     orjson.OPT_INDENT_2 |
@@ -34,99 +174,820 @@ _ORJSON_SAVE_OPTIONS = (
 )
 """Options for ``orjson.dumps`` when it is called to serialize embeddings."""
 
+_HASH_SLICE_LENGTH = 1024
+"""How many texts of a batch are serialized and hashed at a time."""
+
+_PARALLEL_HASH_SIZE = 1 << 20
+"""Size of serialized input from which it is hashed with multiple threads."""
+
+_INT8_LIMIT = 127
+"""Magnitude to which the largest element of each vector saved as int8 maps."""
+
+_SAFETENSORS_DTYPES = {'F32': '<f4'}
+"""
+NumPy dtypes of safetensors dtypes that may be memory-mapped.
+
+Tensors of other dtypes are loaded into memory instead.
+"""
+
 _logger = logging.getLogger(__name__)
 """Logger for messages from this submodule (``embed.cached``)."""
 
+_converter = concurrent.futures.ThreadPoolExecutor(
+    max_workers=1, thread_name_prefix='embed.cached-convert')
+"""Executor that saves ``.safetensors`` copies of ``'json'`` entries."""
+
+_pending_conversions = set()
+"""Paths of ``.safetensors`` copies that ``_converter`` is going to save."""
+
+_pending_conversions_lock = threading.Lock()
+"""Mutex guarding ``_pending_conversions``."""
+
+
+def _hash_serialized(serialized):
+    """Hash serialized input, using multiple threads if it is large."""
+    if len(serialized) < _PARALLEL_HASH_SIZE:
+        return blake3.blake3(serialized).hexdigest()
+    return blake3.blake3(serialized,
+                         max_threads=blake3.blake3.AUTO).hexdigest()
+
 
 def _compute_input_hash(text_or_texts):
-    """Compute a blake3-based hash of input. Used for building a filename."""
-    serialized = orjson.dumps(text_or_texts)
-    hasher = blake3.blake3(serialized)
+    """
+    Compute a blake3-based hash of input. Used for building a filename.
+
+    This is the hash of the input serialized as JSON. A list of texts is
+    serialized a slice at a time, as it is hashed, so a huge batch is never
+    held in memory as a single JSON document.
+    """
+    if not isinstance(text_or_texts, (list, tuple)):
+        return _hash_serialized(orjson.dumps(text_or_texts))
+
+    hasher = blake3.blake3(b'[', max_threads=blake3.blake3.AUTO)
+    for start in range(0, len(text_or_texts), _HASH_SLICE_LENGTH):
+        if start:
+            hasher.update(b',')
+        serialized = orjson.dumps(
+            text_or_texts[start:start + _HASH_SLICE_LENGTH])
+        hasher.update(memoryview(serialized)[1:-1])  # Without the brackets.
+    hasher.update(b']')
     return hasher.hexdigest()
 
 
+def _compute_input_hashes(texts):
+    """Compute the hash of each text, as ``_compute_input_hash`` would."""
+    return [_hash_serialized(orjson.dumps(text)) for text in texts]
+
+
+def _resolve_data_dir(data_dir):
+    """Get the path of the cache directory, which may be the default."""
+    return Path(DEFAULT_DATA_DIR if data_dir is None else data_dir)
+
+
+def _tiers(data_dir):
+    """Get the cache directories to use, fastest first, as a list of paths."""
+    if data_dir is None or isinstance(data_dir, (str, os.PathLike)):
+        return [_resolve_data_dir(data_dir)]
+    tiers = [Path(tier) for tier in data_dir]
+    if not tiers:
+        raise ValueError('data_dir must not be an empty list')
+    if WRITE_BACK not in _WRITE_BACK_POLICIES:
+        raise ValueError(
+            f"WRITE_BACK must be 'all' or 'first', got {WRITE_BACK!r}")
+    return tiers
+
+
 def _build_path(text_or_texts, data_dir, file_type):
     """Build a path for ``_disk_cache``'s wrapper to save/load embeddings."""
-    data_dir = Path(DEFAULT_DATA_DIR if data_dir is None else data_dir)
     basename = _compute_input_hash(text_or_texts)
-    return data_dir / f'{basename}.{file_type}'
+    return _resolve_data_dir(data_dir) / f'{basename}.{file_type}'
+
+
+def _build_paths(texts, data_dir, file_type):
+    """Build the path of each text's entry, as ``_build_path`` would."""
+    data_dir = _resolve_data_dir(data_dir)
+    return [data_dir.joinpath(f'{basename}.{file_type}')
+            for basename in _compute_input_hashes(texts)]
+
+
+def _build_tier_paths(text_or_texts, data_dir, file_type):
+    """Build the paths of an entry in each cache directory, in order."""
+    tiers = _tiers(data_dir)
+    path = _build_path(text_or_texts, tiers[0], file_type)
+    return [tier / path.name for tier in tiers]
+
+
+def _shard(path):
+    """Get where the file for an entry at ``path`` is in the sharded layout."""
+    name = path.name
+    return (path.parent / name[:_SHARD_LENGTH]
+            / name[_SHARD_LENGTH:_SHARD_LENGTH * 2] / name)
+
+
+def _locations(path, file_type):
+    """
+    Get the paths where an entry may be, in the order they are checked.
+
+    Paths built for entries are in the flat layout. The sharded layout puts
+    files elsewhere, except for file types that keep their entries in a store.
+    """
+    if file_type in _STORE_FILE_TYPES:
+        return [path]
+    if LAYOUT == 'sharded':
+        return [_shard(path), path]
+    return [path, _shard(path)]
+
+
+def _make_shard_directories(location):
+    """Create an entry's sharded subdirectories, if needed, but not above."""
+    location.parent.parent.mkdir(exist_ok=True)
+    location.parent.mkdir(exist_ok=True)
+
 
+def _load_json(path, mmap_mode):
+    """Load embeddings from a JSON file. JSON can't be memory-mapped."""
+    del mmap_mode
+    return np.array(orjson.loads(path.read_bytes()), dtype=np.float32)
 
-def _embed_cache_json(func, text_or_texts, data_dir):
-    """Load embeddings as JSON from disk, or compute and save them."""
-    path = _build_path(text_or_texts, data_dir, 'json')
+
+def _save_json(path, embeddings):
+    """Save embeddings to a JSON file, atomically."""
+    data = orjson.dumps(embeddings, option=_ORJSON_SAVE_OPTIONS)
+    _write_atomically(path, data)
+
+
+def _read_safetensors_header(path):
+    """
+    Read the header of a safetensors file that holds a single tensor.
+
+    This returns the tensor's NumPy dtype (or ``None`` if it can't be mapped),
+    its shape, and the offset of its data from the start of the file. It
+    raises ``ValueError`` if the file is malformed.
+    """
+    with open(path, mode='rb') as file:
+        try:
+            (header_size,) = struct.unpack('<Q', file.read(8))
+        except struct.error:
+            raise ValueError('truncated safetensors header') from None
+        header = file.read(header_size)
+
+    if len(header) != header_size:
+        raise ValueError('truncated safetensors header')
     try:
-        json_bytes = path.read_bytes()
+        info = orjson.loads(header)['embeddings']
+        dtype = _SAFETENSORS_DTYPES.get(info['dtype'])
+        shape = tuple(info['shape'])
+        start, _ = info['data_offsets']
+    except (KeyError, TypeError) as error:
+        raise ValueError(f'unexpected safetensors header: {error!r}') from None
+
+    return dtype, shape, 8 + header_size + start
+
+
+def _map_safetensors(path, mmap_mode):
+    """Memory-map the embeddings in a safetensors file, if possible."""
+    dtype, shape, offset = _read_safetensors_header(path)
+    if dtype is None:  # Load instead, which also checks the data.
+        return safetensors.numpy.load_file(path)['embeddings']
+    if 0 in shape:  # There is no data to map.
+        return np.empty(shape, dtype=np.float32)
+    return np.memmap(path, dtype=dtype, mode=mmap_mode,
+                     offset=offset, shape=shape)
+
+
+def _load_safetensors(path, mmap_mode):
+    """Load embeddings from a safetensors file, or memory-map them."""
+    if mmap_mode is None:
+        return safetensors.numpy.load_file(path)['embeddings']
+    return _map_safetensors(path, mmap_mode)
+
+
+def _save_safetensors(path, embeddings):
+    """Save embeddings to a safetensors file, atomically."""
+    _write_atomically(path, safetensors.numpy.save({'embeddings': embeddings}))
+
+
+def _get_tensor(tensors, name, dtype):
+    """Get a tensor of a given dtype. Raise ``ValueError`` if there is none."""
+    try:
+        tensor = tensors[name]
+    except KeyError:
+        raise ValueError(f'no {name!r} tensor') from None
+    if tensor.dtype != dtype:
+        raise ValueError(f'{name!r} tensor is {tensor.dtype}, not {dtype}')
+    return tensor
+
+
+def _load_float16(path, mmap_mode):
+    """Load embeddings saved as float16, converting them back to float32."""
+    del mmap_mode  # Converted values can't be memory-mapped.
+    tensors = safetensors.numpy.load_file(path)
+    return _get_tensor(tensors, 'embeddings', np.float16).astype(np.float32)
+
+
+def _save_float16(path, embeddings):
+    """Save embeddings as float16 to a safetensors file, atomically."""
+    embeddings = np.asarray(embeddings, dtype=np.float16)
+    _write_atomically(path, safetensors.numpy.save({'embeddings': embeddings}))
+
+
+def _load_int8(path, mmap_mode):
+    """Load embeddings saved as int8 and scales, converting them to float32."""
+    del mmap_mode  # Converted values can't be memory-mapped.
+    tensors = safetensors.numpy.load_file(path)
+    quantized = _get_tensor(tensors, 'embeddings', np.int8)
+    scales = _get_tensor(tensors, 'scales', np.float32)
+    if quantized.ndim not in (1, 2) or scales.shape != quantized.shape[:-1]:
+        raise ValueError(f"'scales' shape {scales.shape} doesn't match"
+                         f" 'embeddings' shape {quantized.shape}")
+    return quantized.astype(np.float32) * scales[..., np.newaxis]
+
+
+def _save_int8(path, embeddings):
+    """
+    Save embeddings as int8 to a safetensors file, atomically.
+
+    Each vector is scaled so its largest magnitude is ``_INT8_LIMIT``, and
+    rounded. Its scale is saved with it, as float32, to convert it back.
+    """
+    embeddings = np.asarray(embeddings, dtype=np.float32)
+    scales = np.abs(embeddings).max(axis=-1, initial=0.0) / _INT8_LIMIT
+    divisors = np.where(scales == 0.0, 1.0, scales)[..., np.newaxis]
+    quantized = np.rint(embeddings / divisors).astype(np.int8)
+    data = safetensors.numpy.save({
+        'embeddings': quantized,
+        'scales': np.asarray(scales, dtype=np.float32),
+    })
+    _write_atomically(path, data)
+
+
+def _load_segment(path, mmap_mode):
+    """Load embeddings from the segment store in the directory of ``path``."""
+    store = _segment.get_store(path.parent)
+    return store.get(_key_of(path), mmap_mode)
+
+
+def _save_segment(path, embeddings):
+    """Append embeddings to the segment store in the directory of ``path``."""
+    store = _segment.get_store(path.parent)
+    store.put(_key_of(path), embeddings, fsync=FSYNC)
+
+
+def _key_of(path):
+    """Get the key in a store of the entry that would be at a path."""
+    return bytes.fromhex(path.stem)
+
+
+def _load_sqlite(path, mmap_mode):
+    """Load embeddings from the database in the directory of ``path``."""
+    del mmap_mode  # BLOBs can't be memory-mapped.
+    store = _sqlite.get_store(path.parent)
+    try:
+        return store.get(_key_of(path))
+    except KeyError:
+        raise FileNotFoundError(path) from None
+
+
+def _save_sqlite(path, embeddings):
+    """Save embeddings to the database in the directory of ``path``."""
+    _save_many_sqlite([(path, embeddings)])
+
+
+def _load_many_sqlite(paths):
+    """Load embeddings at many paths in the same directory, in bulk."""
+    if not paths:
+        return {}
+    store = _sqlite.get_store(paths[0].parent)
+    keys = [_key_of(path) for path in paths]
+    try:
+        found = store.get_many(keys)
     except FileNotFoundError:
-        embeddings = func(text_or_texts)
-        path.write_bytes(orjson.dumps(embeddings, option=_ORJSON_SAVE_OPTIONS))
-        _logger.info('%s: saved: %s', func.__name__, path)
-    else:
-        embeddings = np.array(orjson.loads(json_bytes), dtype=np.float32)
-        _logger.info('%s: loaded: %s', func.__name__, path)
+        return {}
+    return {path: found[key] for path, key in zip(paths, keys) if key in found}
+
+
+def _save_many_sqlite(items):
+    """Save embeddings at many paths in the same directory, in bulk."""
+    if not items:
+        return
+    store = _sqlite.get_store(items[0][0].parent)
+    store.put_many([(_key_of(path), embeddings) for path, embeddings in items],
+                   fsync=FSYNC)
+
+
+_FORMATS = {
+    'json': (_load_json, _save_json),
+    'safetensors': (_load_safetensors, _save_safetensors),
+    'float16': (_load_float16, _save_float16),
+    'int8': (_load_int8, _save_int8),
+    'segment': (_load_segment, _save_segment),
+    'sqlite': (_load_sqlite, _save_sqlite),
+}
+"""
+Loader and saver functions for each file type.
 
-    return embeddings
+For the ``'segment'`` and ``'sqlite'`` file types, no file exists at the path
+built for an entry. Its name only holds the key, and its directory is the
+store's directory.
+"""
+
+_STORE_FILE_TYPES = frozenset({'segment', 'sqlite'})
+"""File types whose entries are kept in a single store per directory."""
 
+_FILE_NAME_PATTERN = re.compile(
+    r'[0-9a-f]{64}\.(?:json|safetensors|float16|int8)')
+"""Regular expression that matches the names of cache files."""
 
-def _embed_cache_safetensors(func, text_or_texts, data_dir):
-    """Load embeddings as safetensors from disk, or compute and save them."""
-    path = _build_path(text_or_texts, data_dir, 'safetensors')
+_BULK_FORMATS = {
+    'sqlite': (_load_many_sqlite, _save_many_sqlite),
+}
+"""Functions to load and save many entries at once, where supported."""
+
+_MMAP_MODES = frozenset({None, 'r', 'c'})
+"""Values ``mmap_mode`` may have."""
+
+_CORRUPTION_ERRORS = (ValueError, safetensors.SafetensorError)
+"""Exceptions a loader raises when a file exists but cannot be parsed."""
+
+
+class _CacheMiss(Exception):
+    """Embeddings were not found on disk, or their file was corrupt."""
+
+
+def _fsync_directory(directory):
+    """Flush a directory's entries to disk, if the platform supports it."""
+    if os.name == 'nt':
+        return  # Windows can't open directories, and doesn't need this.
+    fd = os.open(directory, os.O_RDONLY)
     try:
-        tensor_dict = safetensors.numpy.load_file(path)
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def _create_temp_file(path):
+    """
+    Create a temporary file to write, beside ``path``. Return its fd and path.
+
+    Unlike ``tempfile.mkstemp``, whose files have mode 0600, this creates it
+    with mode 0666 less the umask, like any new file, so other users sharing a
+    cache directory can still read the file it is renamed to.
+    """
+    flags = os.O_WRONLY | os.O_CREAT | os.O_EXCL | getattr(os, 'O_BINARY', 0)
+    while True:
+        temp_path = path.with_name(f'.{path.name}.{secrets.token_hex(8)}.tmp')
+        try:
+            return os.open(temp_path, flags, 0o666), temp_path
+        except FileExistsError:
+            continue
+
+
+@contextlib.contextmanager
+def _open_atomically(path):
+    """
+    Open a temporary file to write, and rename it to ``path`` when done.
+
+    If an exception is raised, the temporary file is removed instead.
+    """
+    fd, temp_name = _create_temp_file(path)
+    try:
+        with open(fd, mode='wb') as file:
+            yield file
+            if FSYNC:
+                file.flush()
+                os.fsync(file.fileno())
+        os.replace(temp_name, path)
+    except BaseException:
+        with contextlib.suppress(OSError):
+            os.remove(temp_name)
+        raise
+
+    if FSYNC:
+        _fsync_directory(path.parent)
+
+
+def _write_atomically(path, data):
+    """Write a file by writing a temporary file and renaming it into place."""
+    with _open_atomically(path) as file:
+        file.write(data)
+
+
+def _quarantine(name, path, error):
+    """Move a corrupt cache file aside, so it is not loaded again."""
+    corrupt_path = path.with_name(path.name + CORRUPT_SUFFIX)
+    try:
+        os.replace(path, corrupt_path)
     except FileNotFoundError:
-        embeddings = func(text_or_texts)
-        safetensors.numpy.save_file({'embeddings': embeddings}, path)
-        _logger.info('%s: saved: %s', func.__name__, path)
+        return  # Already moved or replaced.
+    _logger.warning('%s: quarantined: %s (%s)', name, corrupt_path, error)
+
+
+def _resolve_file_type(file_type):
+    """Get the file type to use, which is ``DEFAULT_FILE_TYPE`` if ``None``."""
+    return DEFAULT_FILE_TYPE if file_type is None else file_type
+
+
+def _check_mmap_mode(mmap_mode):
+    """Raise ``ValueError`` if ``mmap_mode`` is not a supported mode."""
+    if mmap_mode not in _MMAP_MODES:
+        raise ValueError(
+            f"mmap_mode must be None, 'r', or 'c', got {mmap_mode!r}")
+
+
+def _recall(name, path):
+    """Get embeddings from ``MEMORY_CACHE`` if it is set and has them."""
+    memory_cache = MEMORY_CACHE
+    if memory_cache is None:
+        return None
+    embeddings = memory_cache.get(path)
+    if embeddings is not None:
+        _logger.debug('%s: loaded from memory: %s', name, path)
+    return embeddings
+
+
+def _remember(path, embeddings):
+    """Store embeddings in ``MEMORY_CACHE``, if it is set."""
+    memory_cache = MEMORY_CACHE
+    if memory_cache is not None:
+        memory_cache.put(path, embeddings)
+
+
+def _sources(path, file_type):
+    """
+    Get the ``(location, file_type)`` pairs to try loading an entry from.
+
+    A ``'json'`` entry is first looked for as a ``.safetensors`` file, which
+    holds the same values, and loads much faster.
+    """
+    sources = [(location, file_type)
+               for location in _locations(path, file_type)]
+    if file_type == 'json':
+        copy = path.with_suffix('.safetensors')
+        sources[:0] = [(location, 'safetensors')
+                       for location in _locations(copy, 'safetensors')]
+    return sources
+
+
+def _convert(name, target, embeddings):
+    """Save a ``.safetensors`` copy of a JSON entry. Runs on ``_converter``."""
+    try:
+        _save_safetensors(target, embeddings)
+    except OSError as error:
+        _logger.warning('%s: not converted: %s (%s)', name, target, error)
+    else:
+        _logger.info('%s: converted: %s', name, target)
+    finally:
+        with _pending_conversions_lock:
+            _pending_conversions.discard(target)
+
+
+def _convert_later(name, location, embeddings):
+    """Save a ``.safetensors`` copy of a JSON file, in the background."""
+    target = location.with_suffix('.safetensors')
+    with _pending_conversions_lock:
+        if target in _pending_conversions:
+            return
+        _pending_conversions.add(target)
+    _converter.submit(_convert, name, target, embeddings.copy())
+
+
+def _load_path(name, path, file_type, *, mmap_mode=None, quarantine=False):
+    """
+    Load embeddings from a path. Raise ``_CacheMiss`` if not cached.
+
+    A corrupt file is also a miss. If ``quarantine`` is true, it is moved
+    aside. Only do that while holding the entry's single-flight lock, so a
+    good file that another caller just saved is never moved aside instead.
+
+    ``MEMORY_CACHE`` is not used if ``mmap_mode`` is given, so the caller gets
+    the mapping it asked for, and the whole file is not copied into memory.
+    """
+    if mmap_mode is None:
+        embeddings = _recall(name, path)
+        if embeddings is not None:
+            return embeddings
+
+    for location, source_type in _sources(path, file_type):
+        load, _ = _FORMATS[source_type]
+        try:
+            embeddings = load(location, mmap_mode if source_type == file_type
+                              else None)
+        except FileNotFoundError:
+            continue
+        except _CORRUPTION_ERRORS as error:
+            if quarantine:
+                _quarantine(name, location, error)
+            if source_type != file_type:
+                continue  # It was a copy. Try the entry's own file.
+            raise _CacheMiss(path) from error
+        break
     else:
-        embeddings = tensor_dict['embeddings']
-        _logger.info('%s: loaded: %s', func.__name__, path)
+        raise _CacheMiss(path)
+    _logger.info('%s: loaded: %s', name, location)
 
+    if source_type == 'json' and CONVERT_JSON:
+        _convert_later(name, location, embeddings)
+    if mmap_mode is None:
+        _remember(path, embeddings)
     return embeddings
 
 
-def _embed_cache_default(func, text_or_texts, data_dir):
+def _load(name, tier_paths, file_type, *, mmap_mode=None, quarantine=False):
     """
-    Load embeddings in the default format from disk, or compute and save them.
+    Load embeddings from disk. Raise ``_CacheMiss`` if not cached.
+
+    ``tier_paths`` are the entry's paths in each cache directory, from
+    ``_build_tier_paths``, which are checked in order. If the embeddings are
+    found in any but the first, they are promoted: saved in each directory
+    checked before. Only files in the first directory are quarantined.
+    """
+    for index, path in enumerate(tier_paths):
+        try:
+            embeddings = _load_path(name, path, file_type,
+                                    mmap_mode=mmap_mode,
+                                    quarantine=quarantine and index == 0)
+        except _CacheMiss:
+            continue
+        _save_copies(name, [(tier_paths[0], embeddings)],
+                     [path.parent for path in tier_paths[:index]], file_type)
+        return embeddings
+    raise _CacheMiss(tier_paths[0])
+
+
+def _load_paths(name, paths, file_type, *, quarantine=False):
     """
-    return _CACHERS[DEFAULT_FILE_TYPE](func, text_or_texts, data_dir)
+    Load embeddings from each path that has them. Return a dict of them.
 
+    For file types that support it, the paths not found in memory are looked
+    up together, instead of one by one.
+    """
+    if file_type not in _BULK_FORMATS:
+        found = {}
+        for path in paths:
+            try:
+                found[path] = _load_path(name, path, file_type,
+                                         quarantine=quarantine)
+            except _CacheMiss:
+                pass
+        return found
+
+    found = {}
+    to_load = []
+    for path in paths:
+        embeddings = _recall(name, path)
+        if embeddings is None:
+            to_load.append(path)
+        else:
+            found[path] = embeddings
+
+    load_many, _ = _BULK_FORMATS[file_type]
+    for path, embeddings in load_many(to_load).items():
+        _logger.info('%s: loaded: %s', name, path)
+        _remember(path, embeddings)
+        found[path] = embeddings
+    return found
+
+
+def _save_paths(name, items, file_type):
+    """
+    Save ``(path, embeddings)`` pairs to disk.
 
-_CACHERS = {
-    'json': _embed_cache_json,
-    'safetensors': _embed_cache_safetensors,
-    None: _embed_cache_default,
-}
+    For file types that support it, they are saved together, instead of one by
+    one.
+    """
+    if file_type in _BULK_FORMATS:
+        _, save_many = _BULK_FORMATS[file_type]
+        save_many(items)
+        for path, embeddings in items:
+            _logger.info('%s: saved: %s', name, path)
+            _remember(path, embeddings)
+        return
+
+    _, save = _FORMATS[file_type]
+    for path, embeddings in items:
+        location = _locations(path, file_type)[0]
+        if location != path:
+            _make_shard_directories(location)
+        save(location, embeddings)
+        _logger.info('%s: saved: %s', name, location)
+        _remember(path, embeddings)
+
+
+def _save_copies(name, items, tiers, file_type):
+    """
+    Save copies of ``(path, embeddings)`` pairs in other cache directories.
 
+    The paths are those in the first cache directory. Failures are logged, not
+    raised, since these are only extra copies.
+    """
+    for tier in tiers:
+        tier_items = [(tier / path.name, embeddings)
+                      for path, embeddings in items]
+        try:
+            _save_paths(name, tier_items, file_type)
+        except (OSError, sqlite3.Error) as error:
+            _logger.warning('%s: not saved in %s (%s)', name, tier, error)
+
+
+def _write_back(name, items, tiers, file_type):
+    """Save newly computed embeddings, saved in the first tier, in others."""
+    if WRITE_BACK == 'all':
+        _save_copies(name, items, tiers[1:], file_type)
+
+
+def _save(name, text_or_texts, embeddings, data_dir, file_type):
+    """Save embeddings to disk, atomically, in cache directories per policy."""
+    tiers = _tiers(data_dir)
+    items = [(_build_path(text_or_texts, tiers[0], file_type), embeddings)]
+    _save_paths(name, items, file_type)
+    _write_back(name, items, tiers, file_type)
+
+
+def _embed_cache(func, text_or_texts, data_dir, file_type, mmap_mode=None):
+    """Load embeddings from disk, or compute and save them."""
+    file_type = _resolve_file_type(file_type)
+    _check_mmap_mode(mmap_mode)
+    tier_paths = _build_tier_paths(text_or_texts, data_dir, file_type)
+    try:
+        return _load(func.__name__, tier_paths, file_type,
+                     mmap_mode=mmap_mode)
+    except _CacheMiss:
+        pass
+
+    with _locking.single_flight(tier_paths[:1]):
+        try:  # Another thread or process may have saved it while we waited.
+            return _load(func.__name__, tier_paths, file_type,
+                         mmap_mode=mmap_mode, quarantine=True)
+        except _CacheMiss:
+            embeddings = func(text_or_texts)
+            _save(func.__name__, text_or_texts, embeddings,
+                  data_dir, file_type)
+            return embeddings
+
+
+def _load_per_text(name, texts, data_dir, file_type):
+    """
+    Load each text's embedding from disk, if cached, into a new matrix.
 
-def embed_one(text, *, data_dir=None, file_type=None):
-    """Embed a single piece of text. Caches to disk."""
-    return _CACHERS[file_type](embed.embed_one, text, data_dir)
+    This returns the matrix, whose rows for texts not found are uninitialized,
+    and a dict that maps each text not found to the indices of its rows.
+    """
+    embeddings = np.empty((len(texts), embed.DIMENSION), dtype=np.float32)
+    wanted = {}
+    for index, text in enumerate(texts):
+        wanted.setdefault(text, []).append(index)
 
+    found = _load_missing(name, wanted, data_dir, file_type)
+    return embeddings, _fill_rows(embeddings, wanted, found)
 
-def embed_many(texts, *, data_dir=None, file_type=None):
-    """Embed multiple pieces of text. Caches to disk."""
-    return _CACHERS[file_type](embed.embed_many, texts, data_dir)
 
+def _load_missing(name, missing, data_dir, file_type, *, quarantine=False):
+    """
+    Load the embeddings of texts in ``missing`` that are cached on disk.
 
-def embed_one_eu(text, *, data_dir=None, file_type=None):
+    This returns a dict that maps each text found to its embedding. Cache
+    directories are checked, and embeddings promoted, as by ``_load``.
+    """
+    tiers = _tiers(data_dir)
+    paths = dict(zip(missing, _build_paths(missing, tiers[0], file_type)))
+    found = {}
+    for index, tier in enumerate(tiers):
+        remaining = [text for text in missing if text not in found]
+        if not remaining:
+            break
+        tier_paths = {text: tier / paths[text].name for text in remaining}
+        loaded = _load_paths(name, tier_paths.values(), file_type,
+                             quarantine=quarantine and index == 0)
+        loaded = {text: loaded[tier_paths[text]]
+                  for text in remaining if tier_paths[text] in loaded}
+
+        _save_copies(name, [(paths[text], loaded[text]) for text in loaded],
+                     tiers[:index], file_type)
+        found.update(loaded)
+    return found
+
+
+def _fill_rows(embeddings, missing, found):
+    """
+    Fill in the rows of texts in ``missing`` whose embeddings are in ``found``.
+
+    This returns a dict like ``missing`` but with only the texts not found.
+    """
+    for text, embedding in found.items():
+        embeddings[missing[text]] = embedding
+    return {text: indices for text, indices in missing.items()
+            if text not in found}
+
+
+def _save_per_text(name, texts, embeddings, data_dir, file_type):
+    """Save each text's embedding (a row of ``embeddings``) to disk."""
+    tiers = _tiers(data_dir)
+    items = list(zip(_build_paths(texts, tiers[0], file_type), embeddings))
+    _save_paths(name, items, file_type)
+    _write_back(name, items, tiers, file_type)
+
+
+def _embed_cache_per_text(func, texts, data_dir, file_type, mmap_mode=None):
+    """
+    Load each text's embedding from disk, or compute and save the missing ones.
+
+    Each text is cached under the same key as it would be by ``embed_one*``.
+    All texts not found on disk are embedded together, in one call to
+    ``func``, and the results are combined with the loaded embeddings into a
+    single matrix whose rows are in the same order as ``texts``. So
+    ``mmap_mode`` is only checked, since the rows are copied anyway.
+    """
+    name = func.__name__
+    file_type = _resolve_file_type(file_type)
+    _check_mmap_mode(mmap_mode)
+    embeddings, missing = _load_per_text(name, texts, data_dir, file_type)
+    if not missing:
+        return embeddings
+
+    paths = _build_paths(missing, _tiers(data_dir)[0], file_type)
+    with _locking.single_flight(paths):
+        # Others may have saved some of them while we waited.
+        found = _load_missing(name, missing, data_dir, file_type,
+                              quarantine=True)
+        missing = _fill_rows(embeddings, missing, found)
+        if missing:
+            computed = func(list(missing))
+            _fill_rows(embeddings, missing, dict(zip(missing, computed)))
+            _save_per_text(name, missing, computed, data_dir, file_type)
+    return embeddings
+
+
+def embed_one(text, *, data_dir=None, file_type=None, mmap_mode=None):
+    """
+    Embed a single piece of text. Caches to disk.
+
+    If ``mmap_mode`` is ``'r'`` or ``'c'``, a cached embedding is memory-mapped
+    read-only or copy-on-write, rather than read into memory. This only has
+    an effect if ``file_type`` is ``'safetensors'`` or ``'segment'``.
+    """
+    return _embed_cache(embed.embed_one, text, data_dir, file_type, mmap_mode)
+
+
+def embed_many(texts, *, data_dir=None, file_type=None, per_text=False,
+               mmap_mode=None):
+    """
+    Embed multiple pieces of text. Caches to disk.
+
+    If ``per_text`` is true, each text is cached separately (sharing entries
+    with ``embed_one``), and only texts not already cached are sent to the API.
+
+    If ``mmap_mode`` is ``'r'`` or ``'c'``, a cached matrix is memory-mapped
+    read-only or copy-on-write, rather than read into memory. This only has
+    an effect if ``file_type`` is ``'safetensors'`` or ``'segment'``, and
+    ``per_text`` is false.
+    """
+    embed_cache = _embed_cache_per_text if per_text else _embed_cache
+    return embed_cache(embed.embed_many, texts, data_dir, file_type, mmap_mode)
+
+
+def embed_one_eu(text, *, data_dir=None, file_type=None, mmap_mode=None):
     """
     Embed a single piece of text. Uses ``embeddings_utils``. Caches to disk.
+
+    ``mmap_mode`` is as in ``embed_one``.
     """
-    return _CACHERS[file_type](embed.embed_one_eu, text, data_dir)
+    return _embed_cache(
+        embed.embed_one_eu, text, data_dir, file_type, mmap_mode)
 
 
-def embed_many_eu(texts, *, data_dir=None, file_type=None):
+def embed_many_eu(texts, *, data_dir=None, file_type=None, per_text=False,
+                  mmap_mode=None):
     """
     Embed multiple pieces of text. Uses ``embeddings_utils``. Caches to disk.
+
+    If ``per_text`` is true, each text is cached separately (sharing entries
+    with ``embed_one_eu``), and only texts not already cached are sent.
+    ``mmap_mode`` is as in ``embed_many``.
     """
-    return _CACHERS[file_type](embed.embed_many_eu, texts, data_dir)
+    embed_cache = _embed_cache_per_text if per_text else _embed_cache
+    return embed_cache(
+        embed.embed_many_eu, texts, data_dir, file_type, mmap_mode)
 
 
-def embed_one_req(text, *, data_dir=None, file_type=None):
-    """Embed a single piece of text. Uses ``requests``. Caches to disk."""
-    return _CACHERS[file_type](embed.embed_one_req, text, data_dir)
+def embed_one_req(text, *, data_dir=None, file_type=None, mmap_mode=None):
+    """
+    Embed a single piece of text. Uses ``requests``. Caches to disk.
+
+    ``mmap_mode`` is as in ``embed_one``.
+    """
+    return _embed_cache(
+        embed.embed_one_req, text, data_dir, file_type, mmap_mode)
 
 
-def embed_many_req(texts, *, data_dir=None, file_type=None):
-    """Embed multiple pieces of text. Uses ``requests``. Caches to disk."""
-    return _CACHERS[file_type](embed.embed_many_req, texts, data_dir)
+def embed_many_req(texts, *, data_dir=None, file_type=None, per_text=False,
+                   mmap_mode=None):
+    """
+    Embed multiple pieces of text. Uses ``requests``. Caches to disk.
+
+    If ``per_text`` is true, each text is cached separately (sharing entries
+    with ``embed_one_req``), and only texts not already cached are sent.
+    ``mmap_mode`` is as in ``embed_many``.
+    """
+    embed_cache = _embed_cache_per_text if per_text else _embed_cache
+    return embed_cache(
+        embed.embed_many_req, texts, data_dir, file_type, mmap_mode)
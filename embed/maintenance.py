@@ -0,0 +1,479 @@
+"""
+Maintenance of cache directories used by ``embed.cached``.
+
+``migrate`` moves a cache directory's files between the flat and sharded
+layouts (see ``embed.cached.LAYOUT``). ``collect_garbage`` removes corrupt and
+abandoned files and redundant copies of entries, and evicts the least recently
+used files to keep a cache directory within limits. ``export_archive`` packs a
+whole cache into a single file, and ``import_archive`` unpacks one into a cache
+of any file type, to copy caches between machines quickly. ``convert_json``
+saves a ``.safetensors`` copy of each JSON cache file, so lookups of those
+entries are faster. ``sample_entries`` loads a random sample of the entries, to
+train indexes in ``embed.search`` on.
+
+These are safe to use while the caches are in use, even by other processes.
+They can also be run from the command line, with ``python -m embed``.
+"""
+
+__all__ = [
+    'GarbageCollection',
+    'migrate',
+    'collect_garbage',
+    'export_archive',
+    'import_archive',
+    'convert_json',
+    'sample_entries',
+]
+
+# pylint: disable=protected-access  # We share embed.cached's implementation.
+
+import collections
+import contextlib
+import logging
+import os
+from pathlib import Path
+import re
+import time
+
+import numpy as np
+
+import embed
+from embed import _archive, _locking, _segment, _sqlite, cached
+
+GarbageCollection = collections.namedtuple('GarbageCollection', [
+    'removed_files',
+    'reclaimed_bytes',
+    'kept_files',
+    'kept_bytes',
+])
+"""What ``collect_garbage`` removed (or would remove), and what it kept."""
+
+_LAYOUTS = frozenset({'flat', 'sharded'})
+"""Values ``embed.cached.LAYOUT`` may have."""
+
+_SHARD_NAME_PATTERN = re.compile(f'[0-9a-f]{{{cached._SHARD_LENGTH}}}')
+"""Regular expression that matches the names of sharded subdirectories."""
+
+_ARCHIVE_BATCH_SIZE = 1000
+"""Number of entries loaded or saved together by exports and imports."""
+
+_STALE_TEMP_SECONDS = 3600
+"""How old a temporary file must be, to be assumed abandoned by its writer."""
+
+_CORRUPT_NAME_PATTERN = re.compile(
+    cached._FILE_NAME_PATTERN.pattern + re.escape(cached.CORRUPT_SUFFIX))
+"""Regular expression that matches the names of quarantined cache files."""
+
+_TEMP_NAME_PATTERN = re.compile(
+    r'\.' + cached._FILE_NAME_PATTERN.pattern + r'\..+\.tmp')
+"""Regular expression that matches the names of temporary files being saved."""
+
+_logger = logging.getLogger(__name__)
+"""Logger for messages from this submodule (``embed.maintenance``)."""
+
+
+def _group_of(path):
+    """Get a cache file's group, whose files are moved or removed together."""
+    return path.name[:cached._SHARD_LENGTH]
+
+
+def _shard_directories(data_dir):
+    """Yield the paths of a directory's inner sharded subdirectories."""
+    for outer in data_dir.iterdir():
+        if _SHARD_NAME_PATTERN.fullmatch(outer.name) and outer.is_dir():
+            for inner in outer.iterdir():
+                if (_SHARD_NAME_PATTERN.fullmatch(inner.name)
+                        and inner.is_dir()):
+                    yield inner
+
+
+def _sharded_files(data_dir):
+    """Yield the paths of cache files in a directory's sharded layout."""
+    for inner in _shard_directories(data_dir):
+        for path in inner.iterdir():
+            if (cached._FILE_NAME_PATTERN.fullmatch(path.name)
+                    and cached._shard(data_dir / path.name) == path):
+                yield path
+
+
+def _remove_empty_shard_directories(data_dir):
+    """Remove sharded subdirectories that are empty."""
+    outers = set()
+    for inner in list(_shard_directories(data_dir)):
+        outers.add(inner.parent)
+        with contextlib.suppress(OSError):  # Not empty.
+            inner.rmdir()
+    for outer in outers:
+        with contextlib.suppress(OSError):
+            outer.rmdir()
+
+
+def migrate(layout, *, data_dir=None):
+    """
+    Move a cache directory's files into a layout, ``'flat'`` or ``'sharded'``.
+
+    Files already in ``layout`` are left alone, as are files that are not
+    cache files, including those of the ``'segment'`` and ``'sqlite'`` file
+    types. If an entry has a file in both layouts, the one in ``layout`` is
+    kept. After moving files out of subdirectories, empty ones are removed.
+
+    This can be done while the cache is in use, even by other processes, which
+    find each file in either layout. Set ``embed.cached.LAYOUT`` to ``layout``,
+    too, so new files are saved in it. Returns how many files were moved (or
+    removed, if already in ``layout``).
+    """
+    if layout not in _LAYOUTS:
+        raise ValueError(f"layout must be 'flat' or 'sharded', got {layout!r}")
+    data_dir = Path(cached.DEFAULT_DATA_DIR if data_dir is None else data_dir)
+
+    if layout == 'sharded':
+        sources = [path for path in data_dir.iterdir()
+                   if cached._FILE_NAME_PATTERN.fullmatch(path.name)]
+    else:
+        sources = list(_sharded_files(data_dir))
+
+    # Hold each group's single-flight lock, so callers that miss a file while
+    # it is being moved wait, then find it.
+    groups = {}
+    for source in sources:
+        groups.setdefault(_group_of(source), []).append(source)
+
+    count = 0
+    for group in groups.values():
+        with _locking.single_flight(data_dir / path.name for path in group):
+            for source in group:
+                flat = data_dir / source.name
+                target = cached._shard(flat) if layout == 'sharded' else flat
+                if target.exists():
+                    with contextlib.suppress(FileNotFoundError):
+                        os.remove(source)
+                else:
+                    if layout == 'sharded':
+                        cached._make_shard_directories(target)
+                    with contextlib.suppress(FileNotFoundError):
+                        os.replace(source, target)
+                count += 1
+
+    if layout == 'flat':
+        _remove_empty_shard_directories(data_dir)
+    _logger.info('migrated %d files to %s layout: %s', count, layout, data_dir)
+    return count
+
+
+def _scan_files(data_dir):
+    """Yield the path and ``os.stat_result`` of each file in both layouts."""
+    for directory in [data_dir, *_shard_directories(data_dir)]:
+        with os.scandir(directory) as entries:
+            for entry in entries:
+                if entry.is_file(follow_symlinks=False):
+                    yield Path(entry.path), entry.stat(follow_symlinks=False)
+
+
+def _is_shadowed(data_dir, path, paths):
+    """
+    Check if lookups of a cache file's type would load another of ``paths``.
+
+    Such a file is never loaded, so it is a redundant copy. The file it is
+    shadowed by is never itself shadowed, since anything loaded before that
+    file would be loaded before this one too.
+    """
+    file_type = path.suffix[1:]
+    for location, _ in cached._sources(data_dir / path.name, file_type):
+        if location == path:
+            return False
+        if location in paths:
+            return True
+    return False
+
+
+def _plan_garbage_collection(data_dir):
+    """
+    Find what to remove regardless of size, and the cache files to keep.
+
+    Returns lists of ``(path, stat)`` of quarantined and abandoned temporary
+    files, of cache files that are redundant copies of entries, and of the rest
+    of the cache files, which may be evicted if the directory is too big.
+    """
+    junk = []
+    copies = {}
+    stale = time.time() - _STALE_TEMP_SECONDS
+    for path, stat in _scan_files(data_dir):
+        name = path.name
+        if cached._FILE_NAME_PATTERN.fullmatch(name):
+            flat = data_dir / name
+            if path in (flat, cached._shard(flat)):
+                copies.setdefault(name.split('.')[0], []).append((path, stat))
+        elif _CORRUPT_NAME_PATTERN.fullmatch(name):
+            junk.append((path, stat))
+        elif _TEMP_NAME_PATTERN.fullmatch(name) and stat.st_mtime < stale:
+            junk.append((path, stat))
+
+    redundant = []
+    files = []
+    for entry_copies in copies.values():
+        paths = {path for path, _ in entry_copies}
+        for path, stat in entry_copies:
+            if _is_shadowed(data_dir, path, paths):
+                redundant.append((path, stat))
+            else:
+                files.append((path, stat))
+    return junk, redundant, files
+
+
+def _plan_eviction(files, max_bytes, max_files):
+    """Choose least recently used files to remove, to stay within limits."""
+    total_bytes = sum(stat.st_size for _, stat in files)
+    total_files = len(files)
+    evicted = []
+    # With "relatime" mounts, access times are only updated now and then, and
+    # never before modification times, so use whichever is later.
+    for path, stat in sorted(files, key=lambda file: max(file[1].st_atime,
+                                                         file[1].st_mtime)):
+        if ((max_bytes is None or total_bytes <= max_bytes)
+                and (max_files is None or total_files <= max_files)):
+            break
+        evicted.append((path, stat))
+        total_bytes -= stat.st_size
+        total_files -= 1
+    return evicted
+
+
+def _remove_unchanged(path, stat):
+    """Remove a file if it is the same as when stat-ed. Return if removed."""
+    try:
+        current = os.stat(path)
+        if (current.st_ino, current.st_mtime_ns) != (stat.st_ino,
+                                                     stat.st_mtime_ns):
+            return False  # Saved again since.
+        os.remove(path)
+    except FileNotFoundError:
+        return False
+    except PermissionError:
+        return False  # On Windows, the file may be open or mapped.
+    return True
+
+
+def _remove_cache_files(data_dir, to_remove):
+    """Remove cache files that are still unchanged. Return those removed."""
+    groups = {}
+    for path, stat in to_remove:
+        groups.setdefault(_group_of(path), []).append((path, stat))
+
+    removed = []
+    for group in groups.values():
+        # Hold the group's single-flight lock, so a file that is saved again
+        # as it is being removed is never removed.
+        with _locking.single_flight(data_dir / path.name for path, _ in group):
+            for path, stat in group:
+                if _remove_unchanged(path, stat):
+                    removed.append((path, stat))
+    return removed
+
+
+def collect_garbage(*, data_dir=None, max_bytes=None, max_files=None,
+                    dry_run=False):
+    """
+    Remove unneeded files from a cache directory, and keep it within limits.
+
+    This removes quarantined files, temporary files abandoned by processes
+    killed while saving, and redundant copies of entries: a ``.json`` file
+    when there is a ``.safetensors`` file for the same entry (which lookups
+    with ``file_type='json'`` load instead), and a file in the layout other
+    than ``embed.cached.LAYOUT`` when the entry is in both. A ``.float16`` or
+    ``.int8`` file is kept even if there is a more precise file for the entry,
+    since lookups with those file types never load other files. Then, if the
+    remaining cache files total more than ``max_bytes`` or number more than
+    ``max_files``, the least recently used (by access time, or modification
+    time if later) are removed until they don't. Files of the ``'segment'``
+    and ``'sqlite'`` file types are left alone.
+
+    This can be done while the cache is in use, even by other processes. A
+    file saved again while this runs is not removed. Others just miss removed
+    entries, as if never cached, and compute them again.
+
+    If ``dry_run`` is true, nothing is removed, but the result is the same.
+    Returns a ``GarbageCollection``.
+    """
+    limits = {'max_bytes': max_bytes, 'max_files': max_files}
+    for limit_name, limit in limits.items():
+        if limit is not None and limit < 0:
+            raise ValueError(
+                f'{limit_name} must not be negative, got {limit!r}')
+    data_dir = Path(cached.DEFAULT_DATA_DIR if data_dir is None else data_dir)
+    junk, redundant, files = _plan_garbage_collection(data_dir)
+    evicted = _plan_eviction(files, max_bytes, max_files)
+
+    if dry_run:
+        to_remove = junk + redundant + evicted
+    else:
+        to_remove = [(path, stat) for path, stat in junk
+                     if _remove_unchanged(path, stat)]
+        to_remove += _remove_cache_files(data_dir, redundant + evicted)
+
+    removed_paths = {path for path, _ in to_remove}
+    kept = [stat for path, stat in files if path not in removed_paths]
+    result = GarbageCollection(
+        removed_files=len(to_remove),
+        reclaimed_bytes=sum(stat.st_size for _, stat in to_remove),
+        kept_files=len(kept),
+        kept_bytes=sum(stat.st_size for stat in kept),
+    )
+    _logger.info('collected garbage in %s: %s', data_dir, result)
+    return result
+
+
+def _entry_paths(data_dir, file_type):
+    """Get the paths built for all entries of a file type in a directory."""
+    if file_type in cached._STORE_FILE_TYPES:
+        store_module = _segment if file_type == 'segment' else _sqlite
+        keys = store_module.get_store(data_dir).keys()
+        return [data_dir / f'{key.hex()}.{file_type}' for key in keys]
+
+    names = {path.name for path, _ in _scan_files(data_dir)
+             if cached._FILE_NAME_PATTERN.fullmatch(path.name)
+             and path.suffix == f'.{file_type}'}
+    return [data_dir / name for name in sorted(names)]
+
+
+def _export_to_file(file, data_dir, file_type):
+    """Write an archive of all entries in a cache to an open file."""
+    name = export_archive.__name__
+    paths = _entry_paths(data_dir, file_type)
+    writer = _archive.ArchiveWriter(file, len(paths), embed.DIMENSION)
+    for start in range(0, len(paths), _ARCHIVE_BATCH_SIZE):
+        batch = paths[start:start + _ARCHIVE_BATCH_SIZE]
+        found = cached._load_paths(name, batch, file_type)
+        for path in batch:
+            if path in found:
+                writer.write(cached._key_of(path), found[path])
+            else:  # Removed, or corrupt, since it was listed.
+                writer.skip(cached._key_of(path))
+    return writer.finish()
+
+
+def export_archive(archive_path, *, data_dir=None, file_type=None):
+    """
+    Pack all the entries in a cache directory into a single archive file.
+
+    Only the entries of ``file_type`` are exported. The archive is a
+    safetensors file, written in one pass, with one entry in memory at a time
+    (or, for the ``'sqlite'`` file type, one batch). It is written under a
+    temporary name and renamed into place when complete. Returns the number of
+    entries exported.
+    """
+    data_dir = Path(cached.DEFAULT_DATA_DIR if data_dir is None else data_dir)
+    file_type = cached._resolve_file_type(file_type)
+    with cached._open_atomically(Path(archive_path)) as file:
+        count = _export_to_file(file, data_dir, file_type)
+    _logger.info('exported %d entries: %s', count, archive_path)
+    return count
+
+
+def _import_from_file(file, data_dir, file_type):
+    """Read an archive from an open file, and save its entries in a cache."""
+    name = import_archive.__name__
+    count = 0
+    batch = []
+    for key, embeddings in _archive.read_archive(file):
+        batch.append((data_dir / f'{key.hex()}.{file_type}', embeddings))
+        if len(batch) == _ARCHIVE_BATCH_SIZE:
+            cached._save_paths(name, batch, file_type)
+            count += len(batch)
+            batch = []
+    cached._save_paths(name, batch, file_type)
+    return count + len(batch)
+
+
+def import_archive(archive, *, data_dir=None, file_type=None):
+    """
+    Save all the entries in an archive made by ``export_archive`` in a cache.
+
+    ``archive`` is a path, or a binary file open for reading, which need not be
+    seekable, so it may be a pipe. The archive is read in one pass, and only
+    one batch of entries is in memory at a time. Entries are saved with
+    ``file_type``, which need not be the file type they were exported from,
+    replacing any already cached. Returns the number of entries imported.
+    """
+    data_dir = Path(cached.DEFAULT_DATA_DIR if data_dir is None else data_dir)
+    file_type = cached._resolve_file_type(file_type)
+    if isinstance(archive, (str, os.PathLike)):
+        with open(archive, mode='rb') as file:
+            count = _import_from_file(file, data_dir, file_type)
+    else:
+        count = _import_from_file(archive, data_dir, file_type)
+    _logger.info('imported %d entries to: %s', count, data_dir)
+    return count
+
+
+def _has_safetensors_copy(data_dir, json_path):
+    """Check if a JSON cache file's entry has a ``.safetensors`` file."""
+    copy = data_dir / Path(json_path.name).with_suffix('.safetensors')
+    return any(location.exists()
+               for location in cached._locations(copy, 'safetensors'))
+
+
+def convert_json(*, data_dir=None):
+    """
+    Save a ``.safetensors`` copy of each JSON cache file that has none.
+
+    Each copy is saved in the same subdirectory as its JSON file, which is
+    kept, so tools that read the JSON files still work (but see
+    ``collect_garbage``, which removes them). Lookups with
+    ``file_type='json'`` load the copies, which is much faster. (Setting
+    ``embed.cached.CONVERT_JSON`` does the same for each entry as it is
+    loaded, instead of all at once.) Corrupt JSON files are skipped.
+
+    This can be done while the cache is in use, even by other processes.
+    Returns how many files were converted.
+    """
+    data_dir = Path(cached.DEFAULT_DATA_DIR if data_dir is None else data_dir)
+    json_paths = [path for path, _ in _scan_files(data_dir)
+                  if cached._FILE_NAME_PATTERN.fullmatch(path.name)
+                  and path.suffix == '.json']
+
+    count = 0
+    for path in json_paths:
+        if _has_safetensors_copy(data_dir, path):
+            continue
+        try:
+            embeddings = cached._load_json(path, None)
+        except FileNotFoundError:
+            continue  # Removed since it was listed.
+        except cached._CORRUPTION_ERRORS as error:
+            _logger.warning('not converted: %s (%s)', path, error)
+            continue
+        cached._save_safetensors(path.with_suffix('.safetensors'), embeddings)
+        count += 1
+    _logger.info('converted %d JSON files in %s', count, data_dir)
+    return count
+
+
+def sample_entries(count, *, data_dir=None, file_type=None, seed=0):
+    """
+    Get up to ``count`` embeddings, from randomly chosen entries in a cache.
+
+    Entries of ``file_type`` are chosen in a random order determined by
+    ``seed``, and loaded a batch at a time until there are enough rows. An
+    entry of a batch of texts gives a row for each text. Returns a matrix with
+    one embedding per row, to train indexes in ``embed.search`` on embeddings
+    like those they will hold.
+    """
+    data_dir = Path(cached.DEFAULT_DATA_DIR if data_dir is None else data_dir)
+    file_type = cached._resolve_file_type(file_type)
+    name = sample_entries.__name__
+    paths = _entry_paths(data_dir, file_type)
+    order = np.random.default_rng(seed).permutation(len(paths))
+
+    rows = [np.empty((0, embed.DIMENSION), dtype=np.float32)]
+    total = 0
+    start = 0
+    while total < count and start < len(paths):
+        stop = start + min(count - total, _ARCHIVE_BATCH_SIZE)
+        batch = [paths[position] for position in order[start:stop]]
+        found = cached._load_paths(name, batch, file_type)
+        for path in batch:
+            if path in found:  # Otherwise removed, or corrupt.
+                rows.append(np.reshape(found[path], (-1, embed.DIMENSION)))
+                total += len(rows[-1])
+        start = stop
+    return np.concatenate(rows)[:count]
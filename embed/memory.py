@@ -0,0 +1,111 @@
+"""
+In-memory tier for cached embeddings.
+
+A ``MemoryCache`` holds recently used embeddings in memory, up to a budget in
+bytes, evicting the least recently used ones first. To have the functions in
+``embed.cached`` and ``embed.aio.cached`` check one before the disk, set
+``embed.cached.MEMORY_CACHE`` to it::
+
+    embed.cached.MEMORY_CACHE = embed.memory.MemoryCache(max_bytes=2**28)
+"""
+
+__all__ = [
+    'DEFAULT_MAX_BYTES',
+    'CacheInfo',
+    'MemoryCache',
+]
+
+import collections
+import threading
+
+DEFAULT_MAX_BYTES = 2**27
+"""Default budget of a ``MemoryCache``: 128 MiB, over 20,000 embeddings."""
+
+CacheInfo = collections.namedtuple('CacheInfo', [
+    'hits',
+    'misses',
+    'evictions',
+    'max_bytes',
+    'current_bytes',
+])
+"""Statistics about a ``MemoryCache``, like ``functools.lru_cache``'s."""
+
+
+class MemoryCache:
+    """
+    Thread-safe, size-bounded LRU cache of embeddings, by key.
+
+    Only embedding arrays' data count toward ``max_bytes``, not the keys or the
+    bookkeeping. An array bigger than ``max_bytes`` is never stored. Arrays are
+    copied when stored and when retrieved, so callers may modify them freely.
+    """
+
+    def __init__(self, max_bytes=None):
+        """Create an empty cache that holds up to ``max_bytes`` of data."""
+        if max_bytes is None:
+            max_bytes = DEFAULT_MAX_BYTES
+        if max_bytes < 0:
+            raise ValueError(
+                f'max_bytes must not be negative, got {max_bytes!r}')
+
+        self._max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._entries = collections.OrderedDict()  # Least recent first.
+        self._current_bytes = 0
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+
+    def __len__(self):
+        """Get the number of embeddings arrays currently stored."""
+        with self._lock:
+            return len(self._entries)
+
+    def get(self, key):
+        """Get a copy of the array stored for ``key``, or ``None``."""
+        with self._lock:
+            try:
+                embeddings = self._entries[key]
+            except KeyError:
+                self._misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self._hits += 1
+        return embeddings.copy()
+
+    def put(self, key, embeddings):
+        """Store a copy of an array for ``key``, evicting others if needed."""
+        if embeddings.nbytes > self._max_bytes:
+            return
+        embeddings = embeddings.copy()
+        embeddings.flags.writeable = False
+
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._current_bytes -= old.nbytes
+            self._entries[key] = embeddings
+            self._current_bytes += embeddings.nbytes
+
+            while self._current_bytes > self._max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self._current_bytes -= evicted.nbytes
+                self._evictions += 1
+
+    def clear(self):
+        """Remove all arrays, and reset the statistics."""
+        with self._lock:
+            self._entries.clear()
+            self._current_bytes = 0
+            self._hits = self._misses = self._evictions = 0
+
+    def cache_info(self):
+        """Get statistics about hits, misses, evictions, and size."""
+        with self._lock:
+            return CacheInfo(
+                hits=self._hits,
+                misses=self._misses,
+                evictions=self._evictions,
+                max_bytes=self._max_bytes,
+                current_bytes=self._current_bytes,
+            )
@@ -0,0 +1,984 @@
+"""
+Similarity search over matrices of embeddings.
+
+An ``ExactIndex`` holds a matrix of embeddings, and finds the ``k`` rows most
+similar (by cosine similarity) to each of a batch of query embeddings, such as
+those returned by ``embed.embed_many``::
+
+    index = embed.search.ExactIndex(embed.cached.embed_many(documents))
+    results = index.search(embed.embed_many(queries), k=10)
+
+Rows are compared to queries a block at a time, with a matrix multiplication,
+and only the best ``k`` of each block are kept, found with ``np.argpartition``.
+So a search of millions of rows never holds the whole matrix of similarities,
+and takes time proportional to the number of rows, not that times its log. With
+``max_workers``, the rows are split into shards, searched on multiple threads.
+
+An ``IVFIndex`` is approximate, and faster for large numbers of rows. It
+clusters rows by k-means, and compares queries only with rows in the clusters
+whose centroids are most similar to them. It can be added to incrementally,
+and saved to and loaded from a safetensors file.
+
+A ``PQIndex`` compresses embeddings to a few dozen bytes each by product
+quantization, for searching more embeddings than fit in memory at full
+precision. It can re-rank its best candidates by their exact similarities.
+
+A ``MappedIndex`` is exact, like an ``ExactIndex``, but keeps its matrix in a
+file that is memory-mapped, so the matrix can be larger than memory. It can be
+built incrementally from the entries in a cache directory of ``embed.cached``.
+"""
+
+__all__ = [
+    'SearchResults',
+    'DEFAULT_N_PROBE',
+    'DEFAULT_N_SUBVECTORS',
+    'ExactIndex',
+    'IVFIndex',
+    'PQIndex',
+    'MappedIndex',
+]
+
+import collections
+import concurrent.futures
+import os
+from pathlib import Path
+
+import numpy as np
+import orjson
+import safetensors
+import safetensors.numpy
+import scipy.cluster.vq
+
+import embed
+from embed import _locking, cached, maintenance
+
+SearchResults = collections.namedtuple('SearchResults', [
+    'scores',
+    'indices',
+])
+"""
+Results of a search: arrays of similarity scores, and the rows they are for.
+
+For a batch of ``q`` queries, each array has shape ``(q, k)``, and each row is
+sorted from most to least similar. For a single query, each has shape ``(k,)``.
+"""
+
+DEFAULT_N_PROBE = 8
+"""Number of inverted lists an ``IVFIndex`` searches for each query."""
+
+DEFAULT_N_SUBVECTORS = 48
+"""Number of one-byte codes a ``PQIndex`` stores per embedding."""
+
+_BLOCK_ELEMENTS = 2**24
+"""Most similarities, or elements of rows, used at once: 64 MiB of float32."""
+
+_KMEANS_ITERATIONS = 20
+"""Iterations of k-means run to find ``IVFIndex`` and ``PQIndex`` centroids."""
+
+_CODEWORDS = 256
+"""Number of codewords for each subvector in a ``PQIndex``: one per byte."""
+
+_MATRIX_DTYPES = {'float32': '<f4', 'float16': '<f2'}
+"""Data types the rows of a ``MappedIndex`` may have, as saved in its file."""
+
+_MATRIX_KEY_DTYPE = np.dtype([('key', 'V32'), ('row', '<u4')])
+"""Record of the table of keys of a ``MappedIndex``, for each row."""
+
+_MATRIX_METADATA_NAME = 'matrix.json'
+"""Name of the file in a ``MappedIndex`` that holds its dimension and dtype."""
+
+_MATRIX_KEYS_NAME = 'keys'
+"""Name of the file in a ``MappedIndex`` that holds its table of keys."""
+
+_MATRIX_LOCK_NAME = 'matrix'
+"""Name of the directory lock a ``MappedIndex`` holds while appending."""
+
+_MATRIX_UPDATE_BATCH_SIZE = 1000
+"""Number of cache entries ``MappedIndex.update`` loads and appends at once."""
+
+
+def _normalized(embeddings):
+    """Get a C-contiguous float32 copy of a matrix, with unit-length rows."""
+    embeddings = np.array(embeddings, dtype=np.float32, order='C')
+    if embeddings.ndim != 2:
+        raise ValueError('expected a matrix of embeddings,'
+                         f' got {embeddings.ndim} dimensions')
+    norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
+    norms[norms == 0.0] = 1.0  # Leave zero vectors alone.
+    embeddings /= norms
+    return embeddings
+
+
+def _check_k(k):
+    """Raise ``ValueError`` if ``k`` is not a valid number of results."""
+    if k < 0:
+        raise ValueError(f'k must not be negative, got {k!r}')
+
+
+def _top_k(scores, k):
+    """
+    Get the ``k`` highest scores in each row of a matrix, and their columns.
+
+    Results are in no particular order, and ties at the ``k``-th score are
+    broken arbitrarily. ``k`` must be at most the number of columns.
+    """
+    if k == 0:
+        columns = np.empty((len(scores), 0), dtype=np.int64)
+    elif k < scores.shape[1]:
+        kth = scores.shape[1] - k
+        columns = np.argpartition(scores, kth, axis=1)[:, kth:]
+    else:
+        columns = np.broadcast_to(np.arange(scores.shape[1]), scores.shape)
+    return np.take_along_axis(scores, columns, axis=1), columns
+
+
+def _sort_results(scores, indices):
+    """Sort each row of results from highest to lowest score, then by index."""
+    order = np.lexsort((indices, -scores), axis=1)
+    return SearchResults(np.take_along_axis(scores, order, axis=1),
+                         np.take_along_axis(indices, order, axis=1))
+
+
+def _merge(best, candidates, k):
+    """Keep the ``k`` best of two ``(scores, indices)`` results, per query."""
+    scores = np.concatenate([best[0], candidates[0]], axis=1)
+    indices = np.concatenate([best[1], candidates[1]], axis=1)
+    scores, columns = _top_k(scores, min(k, scores.shape[1]))
+    return scores, np.take_along_axis(indices, columns, axis=1)
+
+
+def _search_blocks(embeddings, queries, k, *, block_rows=None, offset=0):
+    """
+    Find the ``k`` rows of ``embeddings`` most similar to each query.
+
+    Both are matrices of unit-length rows. Queries are float32. Embeddings may
+    be float16, or memory-mapped, since only a block of ``block_rows`` rows is
+    used (and converted to float32) at a time. Returns unsorted ``(scores,
+    indices)``, where indices are of rows, plus ``offset``, and each has ``k``
+    columns (or fewer, if there are fewer rows).
+    """
+    if block_rows is None:
+        block_rows = max(1, _BLOCK_ELEMENTS // max(queries.shape))
+    k = min(k, len(embeddings))
+    best = (np.empty((len(queries), 0), dtype=np.float32),
+            np.empty((len(queries), 0), dtype=np.int64))
+    for start in range(0, len(embeddings), block_rows):
+        block = np.asarray(embeddings[start:start + block_rows],
+                           dtype=np.float32)
+        scores, columns = _top_k(queries @ block.T, min(k, len(block)))
+        best = _merge(best, (scores, columns + (offset + start)), k)
+    return best
+
+
+def _search_shards(embeddings, queries, k, *, block_rows=None,
+                   max_workers=None):
+    """
+    Find the ``k`` rows of ``embeddings`` most similar to each query.
+
+    This is as ``_search_blocks``, but if ``max_workers`` is given, the rows
+    are split into that many shards, which are searched concurrently on a pool
+    of that many threads, and their results are merged. NumPy releases the GIL
+    while multiplying matrices and partitioning, so shards are searched on
+    separate cores.
+    """
+    if max_workers is None:
+        return _search_blocks(embeddings, queries, k, block_rows=block_rows)
+
+    bounds = np.linspace(0, len(embeddings), max_workers + 1, dtype=np.int64)
+    best = (np.empty((len(queries), 0), dtype=np.float32),
+            np.empty((len(queries), 0), dtype=np.int64))
+    with concurrent.futures.ThreadPoolExecutor(max_workers) as executor:
+        futures = [
+            executor.submit(_search_blocks, embeddings[start:stop], queries,
+                            k, block_rows=block_rows, offset=start)
+            for start, stop in zip(bounds[:-1], bounds[1:]) if start < stop
+        ]
+        try:
+            for future in futures:
+                best = _merge(best, future.result(), k)
+        except BaseException:
+            for future in futures:
+                future.cancel()  # Don't start any shards not yet started.
+            raise
+    return best
+
+
+def _prepare_queries(queries, dimension):
+    """Normalize a query, or matrix of queries. Tell if it was one query."""
+    single = np.ndim(queries) == 1
+    queries = _normalized(np.reshape(queries, (1, -1)) if single else queries)
+    if queries.shape[1] != dimension:
+        raise ValueError(f'expected queries of dimension {dimension},'
+                         f' got {queries.shape[1]}')
+    return queries, single
+
+
+def _prepare_embeddings(embeddings, dimension):
+    """Normalize a matrix of embeddings to add to an index of a dimension."""
+    embeddings = _normalized(embeddings)
+    if embeddings.shape[1] != dimension:
+        raise ValueError(f'expected embeddings of dimension {dimension},'
+                         f' got {embeddings.shape[1]}')
+    return embeddings
+
+
+def _finish(scores, indices, single):
+    """Sort results into ``SearchResults``, of just one row if ``single``."""
+    results = _sort_results(scores, indices)
+    if single:
+        return SearchResults(results.scores[0], results.indices[0])
+    return results
+
+
+class ExactIndex:
+    """
+    Index that finds the most similar embeddings by comparing with all rows.
+
+    The index holds its own copy of the embeddings, normalized to unit length
+    (as ``text-embedding-ada-002`` embeddings already nearly are), so scores
+    are cosine similarities.
+    """
+
+    def __init__(self, embeddings, *, block_rows=None):
+        """
+        Create an index of a matrix of embeddings, one per row.
+
+        Rows are compared to queries ``block_rows`` at a time. By default, this
+        is chosen so each block, and its similarities, take up at most 64 MiB.
+        """
+        if block_rows is not None and block_rows < 1:
+            raise ValueError(
+                f'block_rows must be positive, got {block_rows!r}')
+        self._embeddings = _normalized(embeddings)
+        self._embeddings.flags.writeable = False
+        self._block_rows = block_rows
+
+    def __len__(self):
+        """Get the number of embeddings in the index."""
+        return len(self._embeddings)
+
+    def __repr__(self):
+        """Representation for debugging."""
+        return (f'<{type(self).__name__} of {len(self)} embeddings'
+                f' of dimension {self.dimension}>')
+
+    @property
+    def dimension(self):
+        """Number of dimensions of the embeddings."""
+        return self._embeddings.shape[1]
+
+    @property
+    def embeddings(self):
+        """Read-only matrix of the normalized embeddings, one per row."""
+        return self._embeddings
+
+    def search(self, queries, k, *, max_workers=None):
+        """
+        Find the ``k`` embeddings most similar to each query embedding.
+
+        ``queries`` is a single embedding, or a matrix of them, one per row,
+        such as from ``embed.embed_many``. Returns ``SearchResults``. If there
+        are fewer than ``k`` embeddings, all of them are returned.
+
+        If ``max_workers`` is given, the rows are split into that many shards,
+        searched concurrently on a pool of that many threads. Each thread uses
+        memory for its own blocks. For this to use more cores, NumPy's BLAS
+        library should use one thread per call (for example, by setting
+        ``OPENBLAS_NUM_THREADS=1``), or it may already use all of them.
+        """
+        _check_k(k)
+        queries, single = _prepare_queries(queries, self.dimension)
+        scores, indices = _search_shards(self._embeddings, queries, k,
+                                         block_rows=self._block_rows,
+                                         max_workers=max_workers)
+        return _finish(scores, indices, single)
+
+
+def _assign(embeddings, centroids):
+    """Get the index of the most similar centroid to each row."""
+    block_rows = max(1, _BLOCK_ELEMENTS // len(centroids))
+    assignments = np.empty(len(embeddings), dtype=np.int64)
+    for start in range(0, len(embeddings), block_rows):
+        block = embeddings[start:start + block_rows]
+        assignments[start:start + len(block)] = np.argmax(
+            block @ centroids.T, axis=1)
+    return assignments
+
+
+def _group(assignments, count):
+    """
+    Group positions by their values, which are integers from 0 to ``count``.
+
+    Returns the positions, sorted by value, and, for each value, the bounds of
+    its run of positions.
+    """
+    order = np.argsort(assignments, kind='stable')
+    bounds = np.searchsorted(assignments[order], np.arange(count + 1))
+    return order, bounds
+
+
+def _check_n_probe(n_probe):
+    """Raise ``ValueError`` if ``n_probe`` is not a valid number of lists."""
+    if n_probe < 1:
+        raise ValueError(f'n_probe must be positive, got {n_probe!r}')
+
+
+class IVFIndex:
+    """
+    Approximate index that compares queries only with rows in nearby clusters.
+
+    This is an inverted file (IVF) index. Each row is put in the inverted list
+    of its most similar centroid, and a search compares each query with all
+    rows in only the lists of the ``n_probe`` centroids most similar to it. So
+    it may miss a row that is in another list. Raising ``n_probe`` finds more
+    of the true nearest neighbors, more slowly. Probing every list is exact.
+
+    As in ``ExactIndex``, embeddings are normalized and scores are cosine
+    similarities. Each row has an integer ID, reported as its index in results.
+    If fewer than ``k`` rows are in the probed lists, the missing results have
+    score ``-inf`` and index ``-1``.
+    """
+
+    def __init__(self, centroids, *, n_probe=DEFAULT_N_PROBE):
+        """
+        Create an empty index with inverted lists for the given centroids.
+
+        Usually ``IVFIndex.train`` is called instead, to find the centroids.
+        """
+        self._centroids = _normalized(centroids)
+        if len(self._centroids) == 0:
+            raise ValueError('an IVF index needs at least one centroid')
+        self._centroids.flags.writeable = False
+        self.n_probe = n_probe
+        self._vectors = [np.empty((0, self.dimension), dtype=np.float32)
+                         for _ in range(self.n_lists)]
+        self._ids = [np.empty(0, dtype=np.int64)
+                     for _ in range(self.n_lists)]
+        self._pending = [[] for _ in range(self.n_lists)]
+        self._count = 0
+
+    @classmethod
+    def train(cls, sample, *, n_lists, n_probe=DEFAULT_N_PROBE, seed=0):
+        """
+        Create an empty index, finding ``n_lists`` centroids by k-means.
+
+        ``sample`` is a matrix of embeddings like those to be added, such as a
+        random sample of them. It should have many more rows than ``n_lists``.
+        A common choice of ``n_lists`` is about the square root of the number
+        of rows the index will hold.
+        """
+        sample = _normalized(sample)
+        if not 0 < n_lists <= len(sample):
+            raise ValueError(f'n_lists must be from 1 to the {len(sample)}'
+                             f' rows of the sample, got {n_lists!r}')
+        centroids, _ = scipy.cluster.vq.kmeans2(sample, n_lists,
+                                                iter=_KMEANS_ITERATIONS,
+                                                minit='points', seed=seed)
+        return cls(centroids, n_probe=n_probe)
+
+    @classmethod
+    def load(cls, path):
+        """Load an index saved with ``save``."""
+        with safetensors.safe_open(path, framework='numpy') as file:
+            metadata = file.metadata() or {}
+            tensors = {name: file.get_tensor(name) for name in file.keys()}
+        # pylint: disable=protected-access  # Checked as cache entries are.
+        centroids = cached._get_tensor(tensors, 'centroids', np.float32)
+        vectors = cached._get_tensor(tensors, 'embeddings', np.float32)
+        ids = cached._get_tensor(tensors, 'ids', np.int64)
+        bounds = cached._get_tensor(tensors, 'bounds', np.int64)
+        if not (centroids.ndim == vectors.ndim == 2
+                and centroids.shape[1] == vectors.shape[1]
+                and ids.shape == vectors.shape[:1]
+                and bounds.shape == (len(centroids) + 1,)
+                and bounds[0] == 0 and bounds[-1] == len(ids)
+                and (np.diff(bounds) >= 0).all()):
+            raise ValueError('inconsistent IVF index tensors')
+
+        index = cls(centroids,
+                    n_probe=int(metadata.get('n_probe', DEFAULT_N_PROBE)))
+        for position in range(index.n_lists):
+            start, stop = bounds[position:position + 2]
+            index._vectors[position] = vectors[start:stop]
+            index._ids[position] = ids[start:stop]
+        index._count = len(ids)
+        return index
+
+    def __len__(self):
+        """Get the number of embeddings in the index."""
+        return self._count
+
+    def __repr__(self):
+        """Representation for debugging."""
+        return (f'<{type(self).__name__} of {len(self)} embeddings'
+                f' of dimension {self.dimension} in {self.n_lists} lists'
+                f', n_probe={self.n_probe}>')
+
+    @property
+    def dimension(self):
+        """Number of dimensions of the embeddings."""
+        return self._centroids.shape[1]
+
+    @property
+    def n_lists(self):
+        """Number of inverted lists, one per centroid."""
+        return len(self._centroids)
+
+    @property
+    def centroids(self):
+        """Read-only matrix of the normalized centroids, one per row."""
+        return self._centroids
+
+    @property
+    def n_probe(self):
+        """Number of inverted lists searched for each query, by default."""
+        return self._n_probe
+
+    @n_probe.setter
+    def n_probe(self, value):
+        _check_n_probe(value)
+        self._n_probe = value
+
+    def add(self, embeddings, ids=None):
+        """
+        Add a matrix of embeddings, one per row, with the given integer IDs.
+
+        By default, IDs are consecutive, from the number of embeddings already
+        in the index, as if they were indices of rows. Returns the IDs.
+        """
+        embeddings = _prepare_embeddings(embeddings, self.dimension)
+        if ids is None:
+            ids = np.arange(self._count, self._count + len(embeddings),
+                            dtype=np.int64)
+        else:
+            ids = np.array(ids, dtype=np.int64)
+            if ids.shape != (len(embeddings),):
+                raise ValueError(f'expected {len(embeddings)} IDs,'
+                                 f' got shape {ids.shape}')
+
+        order, bounds = _group(_assign(embeddings, self._centroids),
+                               self.n_lists)
+        for position in np.flatnonzero(np.diff(bounds)):
+            rows = order[bounds[position]:bounds[position + 1]]
+            self._pending[position].append((embeddings[rows], ids[rows]))
+        self._count += len(embeddings)
+        return ids
+
+    def search(self, queries, k, *, n_probe=None):
+        """
+        Find about the ``k`` embeddings most similar to each query embedding.
+
+        ``queries`` is a single embedding, or a matrix of them, as for
+        ``ExactIndex.search``. ``n_probe`` overrides the ``n_probe`` attribute
+        for this search. Returns ``SearchResults``, whose indices are IDs.
+        """
+        _check_k(k)
+        if n_probe is None:
+            n_probe = self.n_probe
+        else:
+            _check_n_probe(n_probe)
+        queries, single = _prepare_queries(queries, self.dimension)
+        self._merge_pending()
+
+        k = min(k, len(self))
+        n_probe = min(n_probe, self.n_lists)
+        scores = np.full((len(queries), k), -np.inf, dtype=np.float32)
+        indices = np.full((len(queries), k), -1, dtype=np.int64)
+        _, probes = _top_k(queries @ self._centroids.T, n_probe)
+        order, bounds = _group(probes.ravel(), self.n_lists)
+        for position in np.flatnonzero(np.diff(bounds)):
+            rows = order[bounds[position]:bounds[position + 1]] // n_probe
+            list_scores, list_rows = _search_blocks(
+                self._vectors[position], queries[rows], k)
+            scores[rows], indices[rows] = _merge(
+                (scores[rows], indices[rows]),
+                (list_scores, self._ids[position][list_rows]), k)
+
+        return _finish(scores, indices, single)
+
+    def save(self, path):
+        """Save the index to a safetensors file, atomically."""
+        self._merge_pending()
+        data = safetensors.numpy.save({
+            'centroids': self._centroids,
+            'embeddings': np.concatenate(self._vectors),
+            'ids': np.concatenate(self._ids),
+            'bounds': np.cumsum([0] + [len(ids) for ids in self._ids],
+                                dtype=np.int64),
+        }, metadata={'n_probe': str(self.n_probe)})
+        # pylint: disable-next=protected-access  # Saved as cache entries are.
+        cached._write_atomically(Path(path), data)
+
+    def _merge_pending(self):
+        """Append embeddings added since the last search to their lists."""
+        for position, pending in enumerate(self._pending):
+            if pending:
+                vectors, ids = zip(*pending)
+                self._vectors[position] = np.concatenate(
+                    [self._vectors[position], *vectors])
+                self._ids[position] = np.concatenate(
+                    [self._ids[position], *ids])
+                pending.clear()
+
+
+def _split(embeddings, n_subvectors):
+    """View a matrix of rows as ``(rows, n_subvectors, subvector length)``."""
+    return embeddings.reshape(len(embeddings), n_subvectors, -1)
+
+
+def _encode(embeddings, codebooks):
+    """Get the code of the nearest codeword to each subvector of each row."""
+    subvectors = _split(embeddings, len(codebooks))
+    half_norms = 0.5 * np.einsum('ijk,ijk->ij', codebooks, codebooks)
+    codes = np.empty(subvectors.shape[:2], dtype=np.uint8)
+    for position, codebook in enumerate(codebooks):
+        # Nearest by Euclidean distance: highest x.c - |c|^2 / 2.
+        scores = subvectors[:, position] @ codebook.T
+        scores -= half_norms[position]
+        codes[:, position] = np.argmax(scores, axis=1)
+    return codes
+
+
+def _score_codes(tables, codes):
+    """
+    Approximate similarities of queries to codes, as a ``(queries, codes)``.
+
+    ``tables`` has, for each subvector and codeword, a row of the similarities
+    of the queries' subvectors to the codeword. Rows are added up, rather than
+    columns, because copying whole rows is much faster.
+    """
+    scores = np.zeros((len(codes), tables.shape[2]), dtype=np.float32)
+    for position, table in enumerate(tables):
+        scores += table.take(codes[:, position], axis=0)
+    return scores.T
+
+
+def _search_codes(tables, codes, k):
+    """
+    Find the ``k`` rows of ``codes`` that score highest, for each query.
+
+    Rows are scored a block at a time, as in ``_search_blocks``. Returns
+    unsorted ``(scores, indices)``, where indices are of rows.
+    """
+    queries = tables.shape[2]
+    block_rows = max(1, _BLOCK_ELEMENTS // max(1, queries))
+    k = min(k, len(codes))
+    best = (np.empty((queries, 0), dtype=np.float32),
+            np.empty((queries, 0), dtype=np.int64))
+    for start in range(0, len(codes), block_rows):
+        block = codes[start:start + block_rows]
+        scores, columns = _top_k(_score_codes(tables, block),
+                                 min(k, len(block)))
+        best = _merge(best, (scores, columns + start), k)
+    return best
+
+
+def _rescore(queries, ids, fetch):
+    """Compute exact similarities of queries to the rows with given IDs."""
+    unique_ids, inverse = np.unique(ids, return_inverse=True)
+    rows = _normalized(fetch(unique_ids))
+    if rows.shape != (len(unique_ids), queries.shape[1]):
+        raise ValueError(f'expected fetched rows of shape'
+                         f' {(len(unique_ids), queries.shape[1])},'
+                         f' got {rows.shape}')
+    inverse = inverse.reshape(ids.shape)
+    block_queries = max(1, _BLOCK_ELEMENTS // max(1, rows.size // len(rows)
+                                                  * ids.shape[1]))
+    scores = np.empty(ids.shape, dtype=np.float32)
+    for start in range(0, len(ids), block_queries):
+        stop = start + block_queries
+        scores[start:stop] = np.einsum('ij,ikj->ik', queries[start:stop],
+                                       rows[inverse[start:stop]])
+    return scores
+
+
+class PQIndex:
+    """
+    Compressed index that scores queries against product-quantized codes.
+
+    Each embedding is split into ``n_subvectors`` equal parts, and each part is
+    replaced by the one-byte code of the nearest of 256 codewords, found for
+    that part by k-means. So an index of ``text-embedding-ada-002`` embeddings
+    with the default of 48 subvectors takes 48 bytes per embedding (and 8 for
+    its ID), instead of 6144. A search scores each code by adding up entries of
+    a table of each query's similarity to every codeword, so scores are
+    approximate. They can be made exact for the best candidates by re-ranking
+    them, if the full-precision embeddings are available, such as in a cache.
+
+    As in ``IVFIndex``, each row has an integer ID, reported as its index in
+    results, and embeddings are normalized.
+    """
+
+    def __init__(self, codebooks):
+        """
+        Create an empty index, with a codebook of 256 codewords per subvector.
+
+        Usually ``PQIndex.train`` is called instead, to find the codebooks.
+        """
+        codebooks = np.array(codebooks, dtype=np.float32, order='C')
+        if codebooks.ndim != 3 or codebooks.shape[1] != _CODEWORDS:
+            raise ValueError(f'expected codebooks of shape (subvectors,'
+                             f' {_CODEWORDS}, length), got {codebooks.shape}')
+        codebooks.flags.writeable = False
+        self._codebooks = codebooks
+        self._codes = np.empty((0, self.n_subvectors), dtype=np.uint8)
+        self._ids = np.empty(0, dtype=np.int64)
+        self._pending = []
+
+    @classmethod
+    def train(cls, sample, *, n_subvectors=DEFAULT_N_SUBVECTORS, seed=0):
+        """
+        Create an empty index, finding codebooks by k-means on a sample.
+
+        ``sample`` is a matrix of embeddings like those to be added, such as
+        from ``embed.maintenance.sample_entries``. It needs at least 256 rows,
+        and should have many more. ``n_subvectors`` must divide the dimension.
+        """
+        sample = _normalized(sample)
+        if len(sample) < _CODEWORDS:
+            raise ValueError(f'need a sample of at least {_CODEWORDS} rows,'
+                             f' got {len(sample)}')
+        if n_subvectors < 1 or sample.shape[1] % n_subvectors != 0:
+            raise ValueError(f'n_subvectors must divide the dimension,'
+                             f' {sample.shape[1]}, got {n_subvectors!r}')
+        subvectors = _split(sample, n_subvectors)
+        codebooks = [
+            scipy.cluster.vq.kmeans2(
+                np.ascontiguousarray(subvectors[:, position]), _CODEWORDS,
+                iter=_KMEANS_ITERATIONS, minit='points', seed=seed)[0]
+            for position in range(n_subvectors)
+        ]
+        return cls(np.stack(codebooks))
+
+    @classmethod
+    def load(cls, path):
+        """Load an index saved with ``save``."""
+        tensors = safetensors.numpy.load_file(path)
+        # pylint: disable=protected-access  # Checked as cache entries are.
+        codebooks = cached._get_tensor(tensors, 'codebooks', np.float32)
+        codes = cached._get_tensor(tensors, 'codes', np.uint8)
+        ids = cached._get_tensor(tensors, 'ids', np.int64)
+        index = cls(codebooks)
+        if codes.shape != (len(ids), index.n_subvectors):
+            raise ValueError('inconsistent PQ index tensors')
+        index._codes = codes
+        index._ids = ids
+        return index
+
+    def __len__(self):
+        """Get the number of embeddings in the index."""
+        return len(self._ids) + sum(len(ids) for _, ids in self._pending)
+
+    def __repr__(self):
+        """Representation for debugging."""
+        return (f'<{type(self).__name__} of {len(self)} embeddings'
+                f' of dimension {self.dimension}'
+                f' in {self.n_subvectors} subvectors>')
+
+    @property
+    def dimension(self):
+        """Number of dimensions of the embeddings."""
+        return self._codebooks.shape[0] * self._codebooks.shape[2]
+
+    @property
+    def n_subvectors(self):
+        """Number of parts embeddings are split into, each coded as a byte."""
+        return len(self._codebooks)
+
+    @property
+    def codebooks(self):
+        """Read-only array of the codewords, for each subvector."""
+        return self._codebooks
+
+    def add(self, embeddings, ids=None):
+        """
+        Add a matrix of embeddings, one per row, with the given integer IDs.
+
+        IDs are as for ``IVFIndex.add``. Returns the IDs.
+        """
+        embeddings = _prepare_embeddings(embeddings, self.dimension)
+        count = len(self)
+        if ids is None:
+            ids = np.arange(count, count + len(embeddings), dtype=np.int64)
+        else:
+            ids = np.array(ids, dtype=np.int64)
+            if ids.shape != (len(embeddings),):
+                raise ValueError(f'expected {len(embeddings)} IDs,'
+                                 f' got shape {ids.shape}')
+        self._pending.append((_encode(embeddings, self._codebooks), ids))
+        return ids
+
+    def search(self, queries, k, *, rerank=0, fetch=None):
+        """
+        Find about the ``k`` embeddings most similar to each query embedding.
+
+        ``queries`` is a single embedding, or a matrix of them, as for
+        ``ExactIndex.search``. Returns ``SearchResults``, whose indices are
+        IDs, and whose scores approximate cosine similarities.
+
+        To re-rank, pass ``rerank``, a number of candidates greater than ``k``,
+        and ``fetch``, a function that takes an array of IDs and returns their
+        full-precision embeddings, one per row. Then ``rerank`` candidates are
+        found for each query, and the ``k`` with the highest exact similarities
+        are returned, with those similarities as scores.
+        """
+        _check_k(k)
+        if rerank and fetch is None:
+            raise ValueError('rerank requires a fetch function')
+        queries, single = _prepare_queries(queries, self.dimension)
+        self._merge_pending()
+
+        tables = np.ascontiguousarray(np.einsum(
+            'ijk,jlk->jli', _split(queries, self.n_subvectors),
+            self._codebooks))
+        scores, rows = _search_codes(tables, self._codes, max(k, rerank))
+        indices = self._ids[rows]
+        if rerank and indices.size:
+            scores = _rescore(queries, indices, fetch)
+            scores, columns = _top_k(scores, min(k, scores.shape[1]))
+            indices = np.take_along_axis(indices, columns, axis=1)
+        return _finish(scores, indices, single)
+
+    def save(self, path):
+        """Save the index to a safetensors file, atomically."""
+        self._merge_pending()
+        data = safetensors.numpy.save({
+            'codebooks': self._codebooks,
+            'codes': self._codes,
+            'ids': self._ids,
+        })
+        # pylint: disable-next=protected-access  # Saved as cache entries are.
+        cached._write_atomically(Path(path), data)
+
+    def _merge_pending(self):
+        """Append codes of embeddings added since the last search."""
+        if self._pending:
+            codes, ids = zip(*self._pending)
+            self._codes = np.concatenate([self._codes, *codes])
+            self._ids = np.concatenate([self._ids, *ids])
+            self._pending.clear()
+
+
+class MappedIndex:
+    """
+    Exact index of a matrix of embeddings in files, memory-mapped to search.
+
+    The index is a directory of three files:
+
+    - ``matrix.json``, which holds the dimension and the data type of rows,
+      ``'float32'`` or ``'float16'`` (which takes half the space, and changes
+      cosine similarities by about ``1e-4``).
+
+    - ``embeddings.float32`` or ``embeddings.float16``, a raw little-endian
+      matrix of the normalized embeddings, one per row.
+
+    - ``keys``, a table with a fixed-size record for each row: the 32-byte
+      blake3 digest that ``embed.cached`` uses as the key of the entry the row
+      is from, and which row of that entry's embeddings it is. An entry of a
+      single text, which has one row, has the digest of that text.
+
+    A search streams the matrix through ``np.memmap`` a block at a time, as
+    ``ExactIndex`` does, so the matrix can be far larger than memory. Rows are
+    appended while holding a lock on the directory, the matrix before the
+    table, and the number of rows is the number of whole records in the table.
+    So a process killed while appending leaves at most some unused bytes, which
+    the next append truncates away, and searches (even by other processes) see
+    only whole rows.
+    """
+
+    def __init__(self, path, *, dimension=None, dtype=None, block_rows=None):
+        """
+        Open the index in a directory, creating it if it does not exist.
+
+        A new index has ``dimension`` (by default, ``embed.DIMENSION``) and
+        ``dtype`` (by default, ``'float32'``). For an existing index, these are
+        read from it, and if given must match. ``block_rows`` is as for
+        ``ExactIndex``.
+        """
+        if block_rows is not None and block_rows < 1:
+            raise ValueError(
+                f'block_rows must be positive, got {block_rows!r}')
+        self._path = Path(path)
+        self._block_rows = block_rows
+        metadata_path = self._path / _MATRIX_METADATA_NAME
+        try:
+            metadata = orjson.loads(metadata_path.read_bytes())
+        except FileNotFoundError:
+            metadata = {
+                'dimension': (embed.DIMENSION if dimension is None
+                              else dimension),
+                'dtype': 'float32' if dtype is None else dtype,
+            }
+            self._check_metadata(metadata)
+            self._path.mkdir(parents=True, exist_ok=True)
+            # pylint: disable-next=protected-access  # Saved as entries are.
+            cached._write_atomically(metadata_path, orjson.dumps(metadata))
+        else:
+            self._check_metadata(metadata)
+            for name, value in ('dimension', dimension), ('dtype', dtype):
+                if value is not None and value != metadata[name]:
+                    raise ValueError(f'{self._path} has {name}'
+                                     f' {metadata[name]!r}, not {value!r}')
+
+        self._dimension = metadata['dimension']
+        self._dtype = np.dtype(_MATRIX_DTYPES[metadata['dtype']])
+        self._matrix_path = self._path / f'embeddings.{metadata["dtype"]}'
+        self._keys_path = self._path / _MATRIX_KEYS_NAME
+
+    def __len__(self):
+        """Get the number of embeddings in the index."""
+        try:
+            size = self._keys_path.stat().st_size
+        except FileNotFoundError:
+            return 0
+        return size // _MATRIX_KEY_DTYPE.itemsize
+
+    def __repr__(self):
+        """Representation for debugging."""
+        return (f'<{type(self).__name__} of {len(self)} embeddings'
+                f' of dimension {self.dimension}, as {self._dtype.name},'
+                f' in {str(self._path)!r}>')
+
+    @property
+    def dimension(self):
+        """Number of dimensions of the embeddings."""
+        return self._dimension
+
+    @property
+    def embeddings(self):
+        """Read-only memory-mapped matrix of the embeddings, one per row."""
+        return self._map(self._matrix_path, self._dtype,
+                         (len(self), self.dimension))
+
+    @property
+    def keys(self):
+        """
+        Read-only memory-mapped table of each row's entry key and position.
+
+        It is a structured array, with fields ``'key'`` and ``'row'``.
+        """
+        return self._map(self._keys_path, _MATRIX_KEY_DTYPE, (len(self),))
+
+    def add(self, texts, embeddings):
+        """
+        Append the embeddings of texts, such as from ``embed.embed_many``.
+
+        Each text's row is recorded as being from the entry ``embed.cached``
+        would cache that text's embedding in, with ``per_text=True``. Returns
+        the indices of the new rows.
+        """
+        embeddings = _prepare_embeddings(embeddings, self.dimension)
+        if len(texts) != len(embeddings):
+            raise ValueError(f'got {len(texts)} texts'
+                             f' but {len(embeddings)} embeddings')
+        keys = np.zeros(len(texts), dtype=_MATRIX_KEY_DTYPE)
+        # pylint: disable-next=protected-access  # Keys as entries have.
+        hashes = cached._compute_input_hashes(texts)
+        keys['key'] = [bytes.fromhex(digest) for digest in hashes]
+        return self._append(embeddings, keys)
+
+    def update(self, *, data_dir=None, file_type=None):
+        """
+        Append the embeddings of all entries in a cache not already appended.
+
+        Entries are found and loaded as ``embed.maintenance.export_archive``
+        finds and loads them, a batch at a time. So this can be called again
+        as the cache grows, to index only new entries. Returns the number of
+        rows appended.
+        """
+        # pylint: disable=protected-access  # We share the cache's internals.
+        data_dir = cached._resolve_data_dir(data_dir)
+        file_type = cached._resolve_file_type(file_type)
+        name = f'{type(self).__name__}.update'
+        known = {bytes(key) for key in self.keys['key']}
+        paths = [path for path in maintenance._entry_paths(data_dir, file_type)
+                 if cached._key_of(path) not in known]
+
+        count = 0
+        for start in range(0, len(paths), _MATRIX_UPDATE_BATCH_SIZE):
+            batch = paths[start:start + _MATRIX_UPDATE_BATCH_SIZE]
+            found = cached._load_paths(name, batch, file_type)
+            matrices = []
+            keys = []
+            for path in batch:
+                if path not in found:  # Removed, or corrupt, since listed.
+                    continue
+                matrix = np.reshape(found[path], (-1, self.dimension))
+                entry_keys = np.zeros(len(matrix), dtype=_MATRIX_KEY_DTYPE)
+                entry_keys['key'] = cached._key_of(path)
+                entry_keys['row'] = np.arange(len(matrix))
+                matrices.append(matrix)
+                keys.append(entry_keys)
+            if matrices:
+                count += len(self._append(
+                    _prepare_embeddings(np.concatenate(matrices),
+                                        self.dimension),
+                    np.concatenate(keys)))
+        return count
+
+    def search(self, queries, k, *, max_workers=None):
+        """
+        Find the ``k`` embeddings most similar to each query embedding.
+
+        This is as ``ExactIndex.search``, but reads the rows from disk (or the
+        operating system's cache of it) as they are compared. With
+        ``max_workers``, shards are also read from disk concurrently.
+        """
+        _check_k(k)
+        queries, single = _prepare_queries(queries, self.dimension)
+        scores, indices = _search_shards(self.embeddings, queries, k,
+                                         block_rows=self._block_rows,
+                                         max_workers=max_workers)
+        return _finish(scores, indices, single)
+
+    def fetch(self, indices):
+        """
+        Get the embeddings in rows with the given indices, as float32.
+
+        This can be passed as ``fetch`` to ``PQIndex.search``, for an index of
+        the same embeddings, added in the same order, to re-rank from disk.
+        """
+        return np.asarray(self.embeddings[np.asarray(indices)],
+                          dtype=np.float32)
+
+    def _append(self, embeddings, keys):
+        """Append normalized rows and their keys. Return the rows' indices."""
+        data = np.ascontiguousarray(embeddings, dtype=self._dtype).tobytes()
+        row_size = self.dimension * self._dtype.itemsize
+        with _locking.exclusive(self._path, _MATRIX_LOCK_NAME):
+            with open(self._keys_path, mode='ab') as keys_file:
+                end = keys_file.seek(0, os.SEEK_END)
+                start = end // _MATRIX_KEY_DTYPE.itemsize
+
+                with open(self._matrix_path, mode='ab') as matrix_file:
+                    matrix_file.truncate(start * row_size)
+                    matrix_file.seek(0, os.SEEK_END)
+                    matrix_file.write(data)
+                    matrix_file.flush()
+                    if cached.FSYNC:
+                        os.fsync(matrix_file.fileno())
+
+                keys_file.truncate(start * _MATRIX_KEY_DTYPE.itemsize)
+                keys_file.seek(0, os.SEEK_END)
+                keys_file.write(keys.tobytes())
+                keys_file.flush()
+                if cached.FSYNC:
+                    os.fsync(keys_file.fileno())
+        return np.arange(start, start + len(keys), dtype=np.int64)
+
+    def _check_metadata(self, metadata):
+        """Raise ``ValueError`` if an index's dimension or dtype is invalid."""
+        dimension = metadata.get('dimension')
+        if not isinstance(dimension, int) or dimension < 1:
+            raise ValueError(f'{self._path}: dimension must be a positive'
+                             f' integer, got {dimension!r}')
+        if metadata.get('dtype') not in _MATRIX_DTYPES:
+            raise ValueError(f"{self._path}: dtype must be 'float32' or"
+                             f" 'float16', got {metadata.get('dtype')!r}")
+
+    @staticmethod
+    def _map(path, dtype, shape):
+        """Memory-map the first rows of a file, read-only."""
+        if 0 in shape:  # There is nothing to map, and maybe no file.
+            return np.empty(shape, dtype=dtype)
+        return np.memmap(path, dtype=dtype, mode='r', shape=shape)
@@ -5,13 +5,18 @@ from pathlib import Path
 import sys
 from tempfile import TemporaryDirectory
 import unittest
+from unittest.mock import Mock, patch
 
 import numpy as np
 from parameterized import parameterized
 
 import embed
+from embed import cached
 from tests import _helpers
 
+_STORE_TEXTS = ['hola', 'hello', 'bonjour']
+"""Texts embedded together in a batch by ``TestStoreBase`` tests."""
+
 
 class TestBase(unittest.TestCase):
     """Base class for all test classes in the project."""
@@ -77,6 +82,120 @@ class TestDiskCachedBase(TestEmbedBase):
     def file_type(self):
         """File type (in file-extension form) to save and load embeddings."""
 
+    def _patch_embedder(self, name, fake):
+        """Patch a function in ``embed`` with a fake. Unpatch on cleanup."""
+        mock = Mock(wraps=fake, __name__=name)
+        self.enterContext(patch.object(embed, name, mock))
+        return mock
+
+
+class TestStoreBase(TestDiskCachedBase):
+    """
+    Tests shared by the file types that keep all entries in a single store.
+
+    These use fake embedding functions in place of the ones in ``embed``.
+    Subclasses give the ``file_type`` and the ``store_module`` implementing it.
+    """
+
+    def setUp(self):
+        """Patch ``embed_one`` and ``embed_many`` with fakes."""
+        super().setUp()
+        self.addCleanup(self.store_module.close_stores)
+        self.mock_one = self._patch_embedder('embed_one',
+                                             _helpers.fake_embed_one)
+        self.mock_many = self._patch_embedder('embed_many',
+                                              _helpers.fake_embed_many)
+
+    @property
+    def func(self):
+        return cached.embed_one
+
+    @property
+    @abstractmethod
+    def store_module(self):
+        """Module implementing the store, which has ``close_stores``."""
+
+    # pylint: disable=missing-function-docstring  # Tests' names describe them.
+
+    def test_embed_one_loads_saved_entry(self):
+        self._call_one('hola')
+        self.mock_one.reset_mock()
+        result = self._call_one('hola')
+        with self.subTest('call'):
+            self.mock_one.assert_not_called()
+        with self.subTest('dtype'):
+            self.assertEqual(result.dtype, np.float32)
+        with self.subTest('values'):
+            np.testing.assert_array_equal(
+                result, _helpers.fake_embed_one('hola'))
+
+    def test_embed_many_loads_saved_entry(self):
+        self._call_many(_STORE_TEXTS)
+        self.mock_many.reset_mock()
+        result = self._call_many(_STORE_TEXTS)
+        with self.subTest('call'):
+            self.mock_many.assert_not_called()
+        with self.subTest('values'):
+            np.testing.assert_array_equal(
+                result, _helpers.fake_embed_many(_STORE_TEXTS))
+
+    def test_loaded_entry_is_writable(self):
+        self._call_one('hola')
+        self._call_one('hola')[:] = 0.0
+        np.testing.assert_array_equal(
+            self._call_one('hola'), _helpers.fake_embed_one('hola'))
+
+    def test_empty_batch_round_trips(self):
+        self._call_many([])
+        result = self._call_many([])
+        self.assertEqual(result.shape, (0, embed.DIMENSION))
+
+    def test_per_text_uses_store(self):
+        self._call_one('hello')
+        result = self._call_many(_STORE_TEXTS, per_text=True)
+        with self.subTest('call'):
+            self.mock_many.assert_called_once_with(['hola', 'bonjour'])
+        with self.subTest('values'):
+            np.testing.assert_array_equal(
+                result, _helpers.fake_embed_many(_STORE_TEXTS))
+
+    def test_corrupt_entry_is_a_miss(self):
+        self._call_one('hola')
+        self._corrupt()
+        self.mock_one.reset_mock()
+
+        result = self._call_one('hola')
+
+        with self.subTest('call'):
+            self.mock_one.assert_called_once_with('hola')
+        with self.subTest('values'):
+            np.testing.assert_array_equal(
+                result, _helpers.fake_embed_one('hola'))
+
+    @abstractmethod
+    def _corrupt(self):
+        """Damage the saved entries in a way the store detects when loading."""
+
+    def _check_all_cached(self, texts):
+        """Check that all ``texts`` are loaded, per text, from the store."""
+        self.mock_many.reset_mock()
+        result = self._call_many(texts, per_text=True)
+        with self.subTest('calls'):
+            self.mock_many.assert_not_called()
+        with self.subTest('values'):
+            np.testing.assert_array_equal(
+                result, _helpers.fake_embed_many(texts))
+
+    def _call_one(self, text, **kwargs):
+        """Call cached ``embed_one`` with the file type under test."""
+        return cached.embed_one(text, data_dir=self.dir_path,
+                                file_type=self.file_type, **kwargs)
+
+    def _call_many(self, texts, **kwargs):
+        """Call cached ``embed_many`` with the file type under test."""
+        return cached.embed_many(texts, data_dir=self.dir_path,
+                                 file_type=self.file_type, **kwargs)
+
 
 class TestEmbedOneBase(TestEmbedBase):
     """
@@ -4,9 +4,14 @@ __all__ = [
     'getenv_bool',
     'configure_logging',
     'cache_embeddings_in_memory',
+    'fake_embed_one',
+    'fake_embed_many',
+    'random_matrix',
+    'fake_response_body',
 ]
 
 import atexit
+import base64
 import functools
 import logging
 import os
@@ -15,6 +20,9 @@ import re
 import unittest.mock
 
 import attrs
+import blake3
+import numpy as np
+import orjson
 
 import embed
 
@@ -66,6 +74,61 @@ def configure_logging():
     logging.basicConfig(level=getattr(logging, level))
 
 
+def fake_embed_one(text):
+    """
+    Compute a deterministic, normalized fake embedding of a single text.
+
+    This does not contact the API. Different texts almost always get different
+    embeddings, so mixing up rows or texts is detectable in tests.
+    """
+    seed = int.from_bytes(blake3.blake3(text.encode()).digest()[:8], 'little')
+    embedding = np.random.default_rng(seed).standard_normal(embed.DIMENSION)
+    return (embedding / np.linalg.norm(embedding)).astype(np.float32)
+
+
+def fake_embed_many(texts):
+    """Compute deterministic, normalized fake embeddings of multiple texts."""
+    embeddings = np.empty((len(texts), embed.DIMENSION), dtype=np.float32)
+    for index, text in enumerate(texts):
+        embeddings[index] = fake_embed_one(text)
+    return embeddings
+
+
+def random_matrix(rows, columns, seed=0):
+    """Make a matrix of random vectors, not normalized, as fake embeddings."""
+    rng = np.random.default_rng(seed)
+    return rng.standard_normal((rows, columns)).astype(np.float32)
+
+
+def fake_response_body(request_body):
+    """
+    Make the body of a fake API response to an embeddings request body.
+
+    The embeddings are from ``fake_embed_many``. They are encoded as the
+    request asks: as lists of floats, or as base64 strings.
+    """
+    request = orjson.loads(request_body)
+    texts = request['input']
+    if isinstance(texts, str):
+        texts = [texts]
+
+    embeddings = fake_embed_many(texts)
+    if request.get('encoding_format') == 'base64':
+        embeddings = [
+            base64.b64encode(embedding.tobytes()).decode('ascii')
+            for embedding in embeddings
+        ]
+
+    return orjson.dumps({
+        'object': 'list',
+        'data': [
+            {'object': 'embedding', 'index': index, 'embedding': embedding}
+            for index, embedding in enumerate(embeddings)
+        ],
+        'model': 'text-embedding-ada-002',
+    }, option=orjson.OPT_SERIALIZE_NUMPY)
+
+
 @attrs.mutable
 class _CacheStats:
     """Cache statistics (misses and hits)."""
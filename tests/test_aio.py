@@ -0,0 +1,326 @@
+#!/usr/bin/env python
+
+"""
+Tests for the async embedding functions in ``embed.aio``.
+
+These run against a local ``aiohttp`` server that returns fake embeddings, so
+they don't call the API.
+"""
+
+import asyncio
+import http
+from pathlib import Path
+from tempfile import TemporaryDirectory
+import unittest
+from unittest.mock import AsyncMock, Mock, patch
+
+import aiohttp.test_utils
+import aiohttp.web
+import numpy as np
+import orjson
+
+import embed
+from embed import aio, cached
+from tests import _bases, _helpers
+
+
+class _FakeEndpoint:
+    """Fake embeddings endpoint. Records requests. Can respond with 429."""
+
+    def __init__(self):
+        """Create a fake endpoint with no requests yet."""
+        self.inputs = []
+        self.request_count = 0
+        self.pending_rate_limits = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.delay = 0.0
+
+    async def handle(self, request):
+        """Respond to a request for embeddings."""
+        self.request_count += 1
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            await asyncio.sleep(self.delay)
+            if self.pending_rate_limits:
+                self.pending_rate_limits -= 1
+                return aiohttp.web.Response(
+                    status=http.HTTPStatus.TOO_MANY_REQUESTS)
+
+            request_body = await request.read()
+            self.inputs.append(orjson.loads(request_body)['input'])
+            return aiohttp.web.Response(
+                body=_helpers.fake_response_body(request_body),
+                content_type='application/json',
+            )
+        finally:
+            self.in_flight -= 1
+
+
+class _TestAioBase(_bases.TestBase, unittest.IsolatedAsyncioTestCase):
+    """Base for tests that use a fake endpoint on a local server."""
+
+    async def asyncSetUp(self):
+        """Start the server and point ``embed.aio`` at it."""
+        await super().asyncSetUp()
+
+        self.endpoint = _FakeEndpoint()
+        app = aiohttp.web.Application()
+        app.router.add_post('/v1/embeddings', self.endpoint.handle)
+        server = aiohttp.test_utils.TestServer(app)
+        await server.start_server()
+        self.addAsyncCleanup(server.close)
+
+        url = str(server.make_url('/v1/embeddings'))
+        self.enterContext(patch.object(embed, '_EMBEDDINGS_URL', url))
+
+
+class TestClient(_TestAioBase):
+    """Tests for ``embed.aio.Client`` and the module-level functions."""
+
+    # pylint: disable=missing-function-docstring  # Tests' names describe them.
+
+    async def test_embed_one_returns_float32_vector(self):
+        result = await aio.embed_one('hola')
+        with self.subTest('dtype'):
+            self.assertEqual(result.dtype, np.float32)
+        with self.subTest('values'):
+            np.testing.assert_array_almost_equal(
+                result, _helpers.fake_embed_one('hola'))
+
+    async def test_embed_many_returns_rows_in_input_order(self):
+        texts = ['hola', 'hello', 'bonjour', 'ciao', 'hallo']
+        result = await aio.embed_many(texts, max_items=2)
+        with self.subTest('requests'):
+            self.assertCountEqual(self.endpoint.inputs, [
+                ['hola', 'hello'],
+                ['bonjour', 'ciao'],
+                ['hallo'],
+            ])
+        with self.subTest('values'):
+            np.testing.assert_array_almost_equal(
+                result, _helpers.fake_embed_many(texts))
+
+    async def test_base64_encoding_gives_same_result(self):
+        texts = ['hola', 'hello', 'bonjour']
+        result = await aio.embed_many(texts, encoding_format='base64')
+        np.testing.assert_array_equal(result, _helpers.fake_embed_many(texts))
+
+    async def test_backs_off_on_rate_limit(self):
+        self.endpoint.pending_rate_limits = 2
+        with patch('asyncio.sleep', AsyncMock()):  # Don't really wait.
+            result = await aio.embed_one('hola')
+        with self.subTest('requests'):
+            self.assertEqual(self.endpoint.request_count, 3)
+        with self.subTest('values'):
+            np.testing.assert_array_almost_equal(
+                result, _helpers.fake_embed_one('hola'))
+
+    async def test_limits_requests_in_flight(self):
+        self.endpoint.delay = 0.02
+        async with aio.Client(max_concurrency=2) as client:
+            await client.embed_many([str(n) for n in range(10)], max_items=1)
+        self.assertEqual(self.endpoint.max_in_flight, 2)
+
+    async def test_reuses_one_session(self):
+        # pylint: disable=protected-access  # Checking the session directly.
+        client = aio.Client()
+        self.addAsyncCleanup(client.aclose)
+        await client.embed_one('hola')
+        session = client._session
+        await client.embed_one('hello')
+        self.assertIs(client._session, session)
+
+    async def test_module_functions_close_their_sessions(self):
+        sessions = []
+        make_session = aiohttp.ClientSession
+
+        def record_session(*args, **kwargs):
+            session = make_session(*args, **kwargs)
+            sessions.append(session)
+            return session
+
+        with patch.object(aiohttp, 'ClientSession', record_session):
+            await aio.embed_one('hola')
+            await aio.embed_many(['hola', 'hello'])
+        with self.subTest('count'):
+            self.assertEqual(len(sessions), 2)
+        with self.subTest('closed'):
+            self.assertTrue(all(session.closed for session in sessions))
+
+    async def test_module_functions_use_given_client(self):
+        # pylint: disable=protected-access  # Checking the session directly.
+        client = aio.Client()
+        self.addAsyncCleanup(client.aclose)
+        await aio.embed_one('hola', client=client)
+        session = client._session
+        await aio.embed_many(['hola', 'hello'], client=client)
+        with self.subTest('same session'):
+            self.assertIs(client._session, session)
+        with self.subTest('left open'):
+            self.assertFalse(session.closed)
+
+    async def test_failed_chunk_cancels_other_chunks(self):
+        cancelled = []
+
+        async def fetch(_self, text_or_texts, _encoding_format):
+            if text_or_texts == ['bad']:
+                raise aiohttp.ClientError('chunk failed')
+            try:
+                await asyncio.sleep(60)
+            except asyncio.CancelledError:
+                cancelled.append(text_or_texts)
+                raise
+            return _helpers.fake_embed_many(text_or_texts)
+
+        with patch.object(aio.Client, '_fetch_embeddings', fetch):
+            async with aio.Client() as client:
+                with self.assertRaises(aiohttp.ClientError):
+                    await client.embed_many(['hola', 'bad', 'hello'],
+                                            max_items=1)
+        self.assertCountEqual(cancelled, [['hola'], ['hello']])
+
+    async def test_closed_client_can_be_reused(self):
+        async with aio.Client() as client:
+            await client.embed_one('hola')
+        async with client:
+            result = await client.embed_one('hola')
+        self.assertEqual(result.shape, (embed.DIMENSION,))
+
+    def test_nonpositive_max_concurrency_is_rejected(self):
+        with self.assertRaises(ValueError):
+            aio.Client(max_concurrency=0)
+
+
+class TestCached(_bases.TestBase, unittest.IsolatedAsyncioTestCase):
+    """Tests for the async disk caching functions in ``embed.aio.cached``."""
+
+    def setUp(self):
+        """Create a temporary directory and patch in fake embedders."""
+        super().setUp()
+
+        # pylint: disable-next=consider-using-with
+        self.dir_path = Path(self.enterContext(TemporaryDirectory()))
+
+        self.mock_one = AsyncMock(
+            side_effect=_helpers.fake_embed_one, __name__='embed_one')
+        self.mock_many = AsyncMock(
+            side_effect=_helpers.fake_embed_many, __name__='embed_many')
+        self.enterContext(patch.object(aio, 'embed_one', self.mock_one))
+        self.enterContext(patch.object(aio, 'embed_many', self.mock_many))
+
+    # pylint: disable=missing-function-docstring  # Tests' names describe them.
+
+    async def test_embed_one_saves_then_loads(self):
+        first = await aio.cached.embed_one('hola', data_dir=self.dir_path)
+        second = await aio.cached.embed_one('hola', data_dir=self.dir_path)
+        with self.subTest('calls'):
+            self.mock_one.assert_awaited_once_with('hola')
+        with self.subTest('values'):
+            np.testing.assert_array_equal(first, second)
+
+    async def test_shares_cache_with_sync_version(self):
+        await aio.cached.embed_many(['hola', 'hello'], data_dir=self.dir_path)
+        mock_sync = Mock(__name__='embed_many')
+        with patch.object(embed, 'embed_many', mock_sync):
+            result = cached.embed_many(
+                ['hola', 'hello'], data_dir=self.dir_path)
+        with self.subTest('calls'):
+            mock_sync.assert_not_called()
+        with self.subTest('values'):
+            np.testing.assert_array_equal(
+                result, _helpers.fake_embed_many(['hola', 'hello']))
+
+    async def test_per_text_embeds_only_uncached_texts(self):
+        await aio.cached.embed_one('hola', data_dir=self.dir_path)
+        texts = ['hello', 'hola', 'bonjour']
+        result = await aio.cached.embed_many(
+            texts, data_dir=self.dir_path, per_text=True)
+        with self.subTest('calls'):
+            self.mock_many.assert_awaited_once_with(['hello', 'bonjour'])
+        with self.subTest('values'):
+            np.testing.assert_array_equal(
+                result, _helpers.fake_embed_many(texts))
+
+    async def test_concurrent_misses_are_embedded_once(self):
+        self.mock_one.side_effect = self._slow(_helpers.fake_embed_one)
+        results = await asyncio.gather(*(
+            aio.cached.embed_one('hola', data_dir=self.dir_path)
+            for _ in range(10)  # More than the default thread pool's workers.
+        ))
+        with self.subTest('calls'):
+            self.mock_one.assert_awaited_once_with('hola')
+        with self.subTest('values'):
+            for result in results:
+                np.testing.assert_array_equal(
+                    result, _helpers.fake_embed_one('hola'))
+
+    async def test_concurrent_per_text_misses_are_embedded_once(self):
+        self.mock_many.side_effect = self._slow(_helpers.fake_embed_many)
+        texts = ['hola', 'hello']
+        results = await asyncio.gather(*(
+            aio.cached.embed_many(texts, data_dir=self.dir_path,
+                                  per_text=True)
+            for _ in range(10)
+        ))
+        with self.subTest('calls'):
+            self.mock_many.assert_awaited_once_with(texts)
+        with self.subTest('values'):
+            for result in results:
+                np.testing.assert_array_equal(
+                    result, _helpers.fake_embed_many(texts))
+
+    async def test_cancelled_waiter_leaves_no_lock_held(self):
+        self.mock_one.side_effect = self._slow(_helpers.fake_embed_one)
+        first = asyncio.ensure_future(
+            aio.cached.embed_one('hola', data_dir=self.dir_path))
+        waiter = asyncio.ensure_future(
+            aio.cached.embed_one('hola', data_dir=self.dir_path))
+        await asyncio.sleep(0.01)
+        waiter.cancel()
+        await first
+        result = await asyncio.wait_for(
+            aio.cached.embed_one('hello', data_dir=self.dir_path), 10)
+        with self.subTest('cancelled'):
+            self.assertTrue(waiter.cancelled())
+        with self.subTest('other entry'):
+            np.testing.assert_array_equal(result,
+                                          _helpers.fake_embed_one('hello'))
+
+    async def test_uses_given_client(self):
+        client = Mock(embed_one=AsyncMock(
+            side_effect=_helpers.fake_embed_one, __name__='embed_one'))
+        await aio.cached.embed_one('hola', data_dir=self.dir_path,
+                                   client=client)
+        with self.subTest('client'):
+            client.embed_one.assert_awaited_once_with('hola')
+        with self.subTest('default'):
+            self.mock_one.assert_not_awaited()
+
+    async def test_promotes_from_later_cache_directory(self):
+        with TemporaryDirectory() as shared:
+            await aio.cached.embed_one('hola', data_dir=shared)
+            self.mock_one.reset_mock()
+            result = await aio.cached.embed_one(
+                'hola', data_dir=[self.dir_path, shared])
+            with self.subTest('calls'):
+                self.mock_one.assert_not_awaited()
+            with self.subTest('promoted'):
+                self.assertTrue(any(self.dir_path.glob('*.safetensors')))
+            with self.subTest('values'):
+                np.testing.assert_array_equal(
+                    result, _helpers.fake_embed_one('hola'))
+
+    @staticmethod
+    def _slow(fake):
+        """Make an async version of a fake embedder that takes a while."""
+        async def slow_fake(text_or_texts):
+            await asyncio.sleep(0.05)
+            return fake(text_or_texts)
+
+        return slow_fake
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,195 @@
+#!/usr/bin/env python
+
+"""Tests for micro-batching single-text requests with ``embed.batching``."""
+
+import concurrent.futures
+import datetime
+import threading
+import unittest
+from unittest.mock import Mock, patch
+
+import numpy as np
+
+import embed
+from embed.batching import MicroBatcher
+from tests import _bases, _helpers
+
+_LONG_WAIT = datetime.timedelta(seconds=60)
+"""Wait long enough that only a full batch or closing sends a batch."""
+
+
+class TestMicroBatcher(_bases.TestBase):
+    """Tests for ``MicroBatcher``."""
+
+    def setUp(self):
+        """Make a fake ``embed_many`` function."""
+        super().setUp()
+        self.mock_many = Mock(wraps=_helpers.fake_embed_many)
+
+    # pylint: disable=missing-function-docstring  # Tests' names describe them.
+
+    def test_each_caller_gets_own_row(self):
+        texts = ['hola', 'hello', 'bonjour']
+        with self._make_batcher(max_batch_size=3) as batcher:
+            futures = [batcher.submit(text) for text in texts]
+        for text, future in zip(texts, futures):
+            with self.subTest(text=text):
+                np.testing.assert_array_equal(
+                    future.result(), _helpers.fake_embed_one(text))
+
+    def test_full_batch_is_sent_without_waiting(self):
+        with self._make_batcher(max_batch_size=2) as batcher:
+            futures = [batcher.submit(text) for text in ['hola', 'hello']]
+            concurrent.futures.wait(futures, timeout=10)
+            self.assertTrue(all(future.done() for future in futures))
+
+    def test_texts_submitted_together_are_sent_in_one_call(self):
+        with self._make_batcher() as batcher:
+            for text in ['hola', 'hello', 'bonjour']:
+                batcher.submit(text)
+        self.mock_many.assert_called_once_with(['hola', 'hello', 'bonjour'])
+
+    def test_batches_are_no_bigger_than_max_batch_size(self):
+        with self._make_batcher(max_batch_size=2) as batcher:
+            for text in ['a', 'b', 'c', 'd', 'e']:
+                batcher.submit(text)
+        sizes = [len(args[0]) for args, _ in self.mock_many.call_args_list]
+        with self.subTest('sizes'):
+            self.assertLessEqual(max(sizes), 2)
+        with self.subTest('total'):
+            self.assertEqual(sum(sizes), 5)
+
+    def test_identical_texts_are_sent_once(self):
+        with self._make_batcher() as batcher:
+            first = batcher.submit('hola')
+            second = batcher.submit('hola')
+        with self.subTest('own futures'):
+            self.assertIsNot(first, second)
+        with self.subTest('same result'):
+            self.assertIs(first.result(), second.result())
+        with self.subTest('call'):
+            self.mock_many.assert_called_once_with(['hola'])
+
+    def test_cancelling_does_not_affect_other_callers(self):
+        with self._make_batcher() as batcher:
+            first = batcher.submit('hola')
+            second = batcher.submit('hola')
+            first.cancel()
+        with self.subTest('cancelled'):
+            self.assertTrue(first.cancelled())
+        with self.subTest('other'):
+            np.testing.assert_array_equal(second.result(timeout=10),
+                                          _helpers.fake_embed_one('hola'))
+
+    def test_text_is_not_sent_if_all_callers_cancel(self):
+        with self._make_batcher() as batcher:
+            for future in [batcher.submit('hola'), batcher.submit('hola')]:
+                future.cancel()
+            batcher.submit('hello')
+        self.mock_many.assert_called_once_with(['hello'])
+
+    def test_caller_joining_text_in_flight_gets_result(self):
+        release = threading.Event()
+        sent = threading.Event()
+
+        def slow_embed_many(texts):
+            sent.set()
+            release.wait(timeout=10)
+            return _helpers.fake_embed_many(texts)
+
+        self.mock_many.side_effect = slow_embed_many
+        with self._make_batcher(max_batch_size=1) as batcher:
+            first = batcher.submit('hola')
+            sent.wait(timeout=10)
+            second = batcher.submit('hola')
+            release.set()
+        with self.subTest('result'):
+            np.testing.assert_array_equal(second.result(timeout=10),
+                                          first.result(timeout=10))
+        with self.subTest('call'):
+            self.mock_many.assert_called_once_with(['hola'])
+
+    def test_batches_calls_from_many_threads(self):
+        texts = [f'text {index}' for index in range(40)]
+        with self._make_batcher(max_batch_size=len(texts)) as batcher:
+            with concurrent.futures.ThreadPoolExecutor(len(texts)) as executor:
+                results = list(executor.map(batcher.embed_one, texts))
+        with self.subTest('call'):
+            self.mock_many.assert_called_once()
+        with self.subTest('values'):
+            np.testing.assert_array_equal(
+                np.array(results), _helpers.fake_embed_many(texts))
+
+    def test_sends_after_max_wait(self):
+        max_wait = datetime.timedelta(milliseconds=20)
+        with self._make_batcher(max_wait=max_wait) as batcher:
+            result = batcher.submit('hola').result(timeout=10)
+        np.testing.assert_array_equal(result, _helpers.fake_embed_one('hola'))
+
+    def test_error_is_given_to_every_caller(self):
+        self.mock_many.side_effect = RuntimeError('batch failed')
+        with self._make_batcher() as batcher:
+            futures = [batcher.submit(text) for text in ['hola', 'hello']]
+        for future in futures:
+            with self.assertRaisesRegex(RuntimeError, r'\Abatch failed\Z'):
+                future.result()
+
+    def test_wrong_number_of_rows_is_an_error(self):
+        self.mock_many.side_effect = lambda texts: np.zeros((1, 3))
+        with self._make_batcher() as batcher:
+            future = batcher.submit('hola')
+            batcher.submit('hello')
+        with self.assertRaises(ValueError):
+            future.result()
+
+    def test_text_sent_again_after_result(self):
+        with self._make_batcher(max_batch_size=1) as batcher:
+            batcher.embed_one('hola')
+            batcher.embed_one('hola')
+        self.assertEqual(self.mock_many.call_count, 2)
+
+    def test_submit_after_close_is_an_error(self):
+        batcher = self._make_batcher()
+        batcher.close()
+        with self.assertRaises(RuntimeError):
+            batcher.submit('hola')
+
+    def test_uses_embed_many_by_default(self):
+        mock_embed_many = Mock(wraps=_helpers.fake_embed_many)
+        with patch.object(embed, 'embed_many', mock_embed_many):
+            with MicroBatcher(max_wait=_LONG_WAIT) as batcher:
+                batcher.submit('hola')
+        mock_embed_many.assert_called_once_with(['hola'])
+
+    def test_batches_in_flight_are_limited(self):
+        release = threading.Event()
+        in_flight = []
+        peak = []
+
+        def slow_embed_many(texts):
+            in_flight.append(None)
+            peak.append(len(in_flight))
+            release.wait(timeout=10)
+            in_flight.pop()
+            return _helpers.fake_embed_many(texts)
+
+        self.mock_many.side_effect = slow_embed_many
+        with self._make_batcher(max_batch_size=1,
+                                max_concurrency=2) as batcher:
+            futures = [batcher.submit(str(index)) for index in range(6)]
+            release.set()
+        concurrent.futures.wait(futures)
+        self.assertLessEqual(max(peak), 2)
+
+    def test_nonpositive_max_batch_size_is_rejected(self):
+        with self.assertRaises(ValueError):
+            MicroBatcher(self.mock_many, max_batch_size=0)
+
+    def _make_batcher(self, **kwargs):
+        """Make a batcher that uses the fake and, by default, waits long."""
+        kwargs.setdefault('max_wait', _LONG_WAIT)
+        return MicroBatcher(self.mock_many, **kwargs)
+
+
+if __name__ == '__main__':
+    unittest.main()
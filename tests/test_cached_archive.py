@@ -0,0 +1,215 @@
+#!/usr/bin/env python
+
+"""
+Tests for exporting caches to archive files, and importing them.
+
+These tests use fake embedding functions in place of the ones in ``embed``, so
+they check how entries are packed and unpacked, without calling the API.
+"""
+
+import contextlib
+import io
+import unittest
+from unittest.mock import patch
+
+import numpy as np
+from parameterized import parameterized
+import safetensors.numpy
+
+import embed
+from embed import __main__, _archive, _segment, _sqlite, cached, maintenance
+from tests import _bases, _helpers
+
+_TEXTS = ['hola', 'hello', 'bonjour']
+"""Texts whose embeddings are cached by some of these tests."""
+
+_FILE_TYPES = ['json', 'safetensors', 'segment', 'sqlite']
+"""File types that entries are exported from and imported to."""
+
+
+class _Unseekable(io.RawIOBase):
+    """Binary stream that can only be read in order, like a pipe."""
+
+    def __init__(self, data):
+        """Create a stream of the given bytes."""
+        super().__init__()
+        self._source = io.BytesIO(data)
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        return self._source.readinto(buffer)
+
+
+class TestArchive(_bases.TestDiskCachedBase):
+    """Tests for ``export_archive``, ``import_archive``, and their commands."""
+
+    def setUp(self):
+        """Patch ``embed_one`` and ``embed_many`` with fakes. Make dirs."""
+        super().setUp()
+        self.addCleanup(_segment.close_stores)
+        self.addCleanup(_sqlite.close_stores)
+        self.mock_one = self._patch_embedder('embed_one',
+                                             _helpers.fake_embed_one)
+        self.mock_many = self._patch_embedder('embed_many',
+                                              _helpers.fake_embed_many)
+        self.source_dir = self.dir_path / 'source'
+        self.target_dir = self.dir_path / 'target'
+        self.source_dir.mkdir()
+        self.target_dir.mkdir()
+        self.archive_path = self.dir_path / 'cache.archive'
+
+    @property
+    def func(self):
+        return cached.embed_one
+
+    @property
+    def file_type(self):
+        return cached.DEFAULT_FILE_TYPE
+
+    # pylint: disable=missing-function-docstring  # Tests' names describe them.
+
+    @parameterized.expand(
+        (f'{source}_to_{target}', source, target)
+        for source in _FILE_TYPES for target in _FILE_TYPES
+    )
+    def test_round_trip(self, _name, source, target):
+        self._populate(source)
+        exported = self._export(file_type=source)
+        imported = self._import(file_type=target)
+        self.mock_one.reset_mock()
+        self.mock_many.reset_mock()
+
+        one = [cached.embed_one(text, data_dir=self.target_dir,
+                                file_type=target) for text in _TEXTS]
+        many = cached.embed_many(_TEXTS, data_dir=self.target_dir,
+                                 file_type=target)
+
+        with self.subTest('counts'):
+            self.assertEqual((exported, imported), (4, 4))
+        with self.subTest('calls'):
+            self.mock_one.assert_not_called()
+            self.mock_many.assert_not_called()
+        with self.subTest('one'):
+            np.testing.assert_array_equal(
+                one, _helpers.fake_embed_many(_TEXTS))
+        with self.subTest('many'):
+            np.testing.assert_array_equal(
+                many, _helpers.fake_embed_many(_TEXTS))
+
+    def test_archive_is_a_safetensors_file(self):
+        self._populate(self.file_type)
+        self._export()
+        tensors = safetensors.numpy.load_file(self.archive_path)
+        with self.subTest('keys'):
+            self.assertEqual(tensors['keys'].shape, (4, 32))
+        with self.subTest('embeddings'):
+            self.assertEqual(tensors['embeddings'].shape,
+                             (2 * len(_TEXTS), embed.DIMENSION))
+
+    def test_empty_cache_round_trips(self):
+        with self.subTest('export'):
+            self.assertEqual(self._export(), 0)
+        with self.subTest('import'):
+            self.assertEqual(self._import(), 0)
+
+    def test_export_finds_sharded_files(self):
+        with patch.object(cached, 'LAYOUT', 'sharded'):
+            self._populate(self.file_type)
+        self.assertEqual(self._export(), 4)
+
+    def test_import_reads_unseekable_stream(self):
+        self._populate(self.file_type)
+        self._export()
+        stream = io.BufferedReader(
+            _Unseekable(self.archive_path.read_bytes()))
+        count = maintenance.import_archive(stream, data_dir=self.target_dir)
+        self.assertEqual(count, 4)
+
+    def test_import_saves_in_batches(self):
+        self._populate('sqlite')
+        self._export(file_type='sqlite')
+        with patch.object(maintenance, '_ARCHIVE_BATCH_SIZE', 3), \
+                patch.object(_sqlite.SqliteStore, 'put_many',
+                             autospec=True,
+                             side_effect=_sqlite.SqliteStore.put_many) as mock:
+            self._import(file_type='sqlite')
+        self.assertEqual([len(call.args[1]) for call in mock.call_args_list],
+                         [3, 1])
+
+    def test_entry_missing_while_exporting_is_skipped(self):
+        self._populate(self.file_type)
+        # pylint: disable-next=protected-access  # To list a missing entry.
+        entry_paths = maintenance._entry_paths
+
+        def with_missing_entry(data_dir, file_type):
+            missing = data_dir / f'{"0" * 64}.{file_type}'
+            return [missing, *entry_paths(data_dir, file_type)]
+
+        with patch.object(maintenance, '_entry_paths', with_missing_entry):
+            exported = self._export()
+        with self.subTest('export'):
+            self.assertEqual(exported, 4)
+        with self.subTest('import'):
+            self.assertEqual(self._import(), 4)
+
+    def test_failed_export_leaves_no_file(self):
+        self._populate(self.file_type)
+        with patch.object(_archive.ArchiveWriter, 'finish',
+                          side_effect=OSError('disk full')):
+            with self.assertRaises(OSError):
+                self._export()
+        self.assertEqual(sorted(path.name for path in self.dir_path.iterdir()),
+                         ['source', 'target'])
+
+    def test_truncated_archive_is_an_error(self):
+        self._populate(self.file_type)
+        self._export()
+        data = self.archive_path.read_bytes()
+        self.archive_path.write_bytes(data[:-100])
+        with self.assertRaises(ValueError):
+            self._import()
+
+    def test_other_safetensors_file_is_not_an_archive(self):
+        safetensors.numpy.save_file(
+            {'embeddings': _helpers.fake_embed_one('hola')}, self.archive_path)
+        with self.assertRaises(ValueError):
+            self._import()
+
+    def test_commands_export_and_import(self):
+        self._populate(self.file_type)
+        with contextlib.redirect_stdout(io.StringIO()) as stdout:
+            __main__.main(['export', str(self.archive_path),
+                           str(self.source_dir)])
+            __main__.main(['import', '--file-type', 'sqlite',
+                           str(self.archive_path), str(self.target_dir)])
+        with self.subTest('output'):
+            self.assertEqual(stdout.getvalue().splitlines(),
+                             ['Exported 4 entries.', 'Imported 4 entries.'])
+        with self.subTest('imported'):
+            self.assertEqual(len(_sqlite.get_store(self.target_dir).keys()), 4)
+
+    def _populate(self, file_type):
+        """Cache 3 texts' embeddings, and a batch of them, in the source."""
+        for text in _TEXTS:
+            cached.embed_one(text, data_dir=self.source_dir,
+                             file_type=file_type)
+        cached.embed_many(_TEXTS, data_dir=self.source_dir,
+                          file_type=file_type)
+
+    def _export(self, file_type=None):
+        """Export the source directory's entries to the archive file."""
+        return maintenance.export_archive(self.archive_path,
+                                          data_dir=self.source_dir,
+                                          file_type=file_type)
+
+    def _import(self, file_type=None):
+        """Import the archive file's entries to the target directory."""
+        return maintenance.import_archive(self.archive_path,
+                                          data_dir=self.target_dir,
+                                          file_type=file_type)
+
+
+if __name__ == '__main__':
+    unittest.main()
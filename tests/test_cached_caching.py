@@ -128,10 +128,10 @@ class _TestDiskCachedCachingBase(_bases.TestDiskCachedBase):
         listener.assert_any_call(str(self._path), 'r', ANY)
 
     def test_save_confirmed_by_audit_event(self):
-        with subaudit.listening('open', Mock()) as listener:
+        with subaudit.listening('os.rename', Mock()) as listener:
             self._call_caching_embedder()
 
-        listener.assert_any_call(str(self._path), 'w', ANY)
+        listener.assert_any_call(ANY, str(self._path), ANY, ANY)
 
     def test_saved_embedding_exists(self):
         self._call_caching_embedder()
@@ -272,10 +272,6 @@ class _TestDiskCachedSafetensorsBase(_TestDiskCachedCachingBase):
     def test_load_confirmed_by_audit_event(self):
         super().test_load_confirmed_by_audit_event()
 
-    @unittest.expectedFailure  # TODO: Look into observing native file access.
-    def test_save_confirmed_by_audit_event(self):
-        super().test_save_confirmed_by_audit_event()
-
 
 class TestDiskCachedEmbedOneJson(
     _TestDiskCachedEmbedOneBase,
@@ -0,0 +1,172 @@
+#!/usr/bin/env python
+
+"""
+Tests of crash-safe saving and corrupt-file handling in ``embed.cached``.
+
+These tests use a fake embedding function in place of ``embed.embed_one``, and
+inject failures while files are being written, without calling the API.
+"""
+
+import os
+import subprocess
+import sys
+import unittest
+from unittest.mock import patch
+
+import numpy as np
+from parameterized import parameterized
+
+from embed import _locking, cached
+from tests import _bases, _helpers
+
+_FILE_TYPES = [('json',), ('safetensors',)]
+"""Parameters for tests that run once for each file type."""
+
+_CHILD_SCRIPT = '''
+import os
+import sys
+from unittest.mock import patch
+
+import embed
+from embed import cached
+from tests import _helpers
+
+def crash(*_args, **_kwargs):
+    os._exit(3)
+
+with patch.object(embed, 'embed_one', _helpers.fake_embed_one):
+    with patch.object(os, 'replace', crash):
+        cached.embed_one('hola', data_dir=sys.argv[1], file_type=sys.argv[2])
+'''
+"""Script for a child process that is killed just before a file is renamed."""
+
+
+class TestCrashSafety(_bases.TestDiskCachedBase):
+    """Tests for atomic saves and quarantining corrupt files."""
+
+    def setUp(self):
+        """Patch ``embed_one`` with a fake."""
+        super().setUp()
+        self.mock_one = self._patch_embedder('embed_one',
+                                             _helpers.fake_embed_one)
+
+    @property
+    def func(self):
+        return cached.embed_one
+
+    @property
+    def file_type(self):
+        return cached.DEFAULT_FILE_TYPE
+
+    # pylint: disable=missing-function-docstring  # Tests' names describe them.
+
+    @parameterized.expand(_FILE_TYPES)
+    def test_killed_process_leaves_no_entry(self, file_type):
+        child = subprocess.run(
+            [sys.executable, '-c', _CHILD_SCRIPT, str(self.dir_path),
+             file_type],
+            check=False,
+        )
+        with self.subTest('crashed'):
+            self.assertEqual(child.returncode, 3)
+        with self.subTest('entry'):
+            self.assertFalse(self._path('hola', file_type).exists())
+
+    @parameterized.expand(_FILE_TYPES)
+    def test_computes_again_after_killed_process(self, file_type):
+        subprocess.run(
+            [sys.executable, '-c', _CHILD_SCRIPT, str(self.dir_path),
+             file_type],
+            check=False,
+        )
+        result = self._call('hola', file_type)
+        with self.subTest('call'):
+            self.mock_one.assert_called_once_with('hola')
+        with self.subTest('value'):
+            np.testing.assert_array_equal(
+                result, _helpers.fake_embed_one('hola'))
+
+    @parameterized.expand(_FILE_TYPES)
+    def test_failed_write_leaves_no_files(self, file_type):
+        with patch('os.replace', side_effect=OSError('disk full')):
+            with self.assertRaises(OSError):
+                self._call('hola', file_type)
+        self.assertEqual(
+            [path.name for path in self.dir_path.iterdir()],
+            [_locking.LOCKS_DIR_NAME],
+        )
+
+    @parameterized.expand(_FILE_TYPES)
+    @unittest.skipIf(os.name == 'nt', 'Windows has no Unix file modes.')
+    def test_saved_file_has_umask_mode(self, file_type):
+        old_umask = os.umask(0o027)
+        try:
+            self._call('hola', file_type)
+        finally:
+            os.umask(old_umask)
+        # pylint: disable-next=protected-access  # Just to get the path.
+        path = cached._build_path('hola', self.dir_path, file_type)
+        self.assertEqual(path.stat().st_mode & 0o777, 0o640)
+
+    @parameterized.expand(_FILE_TYPES)
+    def test_fsync_saves_loadable_file(self, file_type):
+        with patch.object(cached, 'FSYNC', True):
+            self._call('hola', file_type)
+        self.mock_one.reset_mock()
+        result = self._call('hola', file_type)
+        with self.subTest('call'):
+            self.mock_one.assert_not_called()
+        with self.subTest('value'):
+            np.testing.assert_array_equal(
+                result, _helpers.fake_embed_one('hola'))
+
+    @parameterized.expand(_FILE_TYPES)
+    def test_truncated_file_is_a_miss(self, file_type):
+        self._write_truncated('hola', file_type)
+        result = self._call('hola', file_type)
+        with self.subTest('call'):
+            self.mock_one.assert_called_once_with('hola')
+        with self.subTest('value'):
+            np.testing.assert_array_equal(
+                result, _helpers.fake_embed_one('hola'))
+
+    @parameterized.expand(_FILE_TYPES)
+    def test_truncated_file_is_quarantined(self, file_type):
+        truncated = self._write_truncated('hola', file_type)
+        path = self._path('hola', file_type)
+        with self.assertLogs(cached.__name__, 'WARNING'):
+            self._call('hola', file_type)
+        corrupt_path = path.with_name(path.name + cached.CORRUPT_SUFFIX)
+        self.assertEqual(corrupt_path.read_bytes(), truncated)
+
+    @parameterized.expand(_FILE_TYPES)
+    def test_truncated_file_is_replaced(self, file_type):
+        self._write_truncated('hola', file_type)
+        self._call('hola', file_type)
+        self.mock_one.reset_mock()
+        self._call('hola', file_type)
+        self.mock_one.assert_not_called()
+
+    def _call(self, text, file_type):
+        """Call cached ``embed_one`` with the temporary directory."""
+        return cached.embed_one(text, data_dir=self.dir_path,
+                                file_type=file_type)
+
+    def _path(self, text, file_type):
+        """Path of the cache file for a text."""
+        # pylint: disable-next=protected-access  # Just to get the path.
+        return cached._build_path(text, self.dir_path, file_type)
+
+    def _write_truncated(self, text, file_type):
+        """Write half of a valid cache file. Return what was written."""
+        self._call(text, file_type)
+        path = self._path(text, file_type)
+        data = path.read_bytes()
+        truncated = data[:len(data) // 2]
+        path.write_bytes(truncated)
+        self.mock_one.reset_mock()
+        return truncated
+
+
+if __name__ == '__main__':
+    unittest.main()
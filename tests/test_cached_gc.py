@@ -0,0 +1,243 @@
+#!/usr/bin/env python
+
+"""
+Tests for garbage collection and eviction in cache directories.
+
+These tests use a fake embedding function in place of ``embed.embed_one``, so
+they check which cache files ``collect_garbage`` removes, without calling the
+API.
+"""
+
+import argparse
+import contextlib
+import io
+import os
+import time
+import unittest
+from unittest.mock import patch
+
+from parameterized import parameterized
+
+from embed import __main__, _segment, cached, maintenance
+from tests import _bases, _helpers
+
+_TEXTS = ['hola', 'hello', 'bonjour']
+"""Texts whose embeddings are cached by some of these tests."""
+
+
+class TestCollectGarbage(_bases.TestDiskCachedBase):
+    """Tests for ``collect_garbage`` and the ``gc`` command."""
+
+    def setUp(self):
+        """Patch ``embed_one`` with a fake."""
+        super().setUp()
+        self.addCleanup(_segment.close_stores)
+        self.mock_one = self._patch_embedder('embed_one',
+                                             _helpers.fake_embed_one)
+
+    @property
+    def func(self):
+        return cached.embed_one
+
+    @property
+    def file_type(self):
+        return 'safetensors'
+
+    # pylint: disable=missing-function-docstring  # Tests' names describe them.
+
+    def test_empty_directory_has_nothing_to_collect(self):
+        self.assertEqual(self._collect(), maintenance.GarbageCollection(
+            removed_files=0, reclaimed_bytes=0, kept_files=0, kept_bytes=0))
+
+    def test_keeps_everything_when_within_limits(self):
+        paths = self._populate(_TEXTS)
+        result = self._collect(max_files=len(_TEXTS))
+        with self.subTest('removed'):
+            self.assertEqual(result.removed_files, 0)
+        with self.subTest('kept'):
+            self.assertEqual(result.kept_files, len(_TEXTS))
+        with self.subTest('files'):
+            self.assertTrue(all(path.exists() for path in paths))
+
+    def test_removes_quarantined_files(self):
+        path = self._populate(['hola'])[0]
+        corrupt_path = path.with_name(path.name + cached.CORRUPT_SUFFIX)
+        os.replace(path, corrupt_path)
+        result = self._collect()
+        with self.subTest('count'):
+            self.assertEqual(result.removed_files, 1)
+        with self.subTest('file'):
+            self.assertFalse(corrupt_path.exists())
+
+    def test_removes_only_stale_temporary_files(self):
+        path = self._path('hola')
+        stale = path.with_name(f'.{path.name}.abc123.tmp')
+        fresh = path.with_name(f'.{path.name}.def456.tmp')
+        for temp_path in stale, fresh:
+            temp_path.write_bytes(b'partial')
+        long_ago = time.time() - 2 * 24 * 60 * 60
+        os.utime(stale, (long_ago, long_ago))
+
+        self._collect()
+
+        with self.subTest('stale'):
+            self.assertFalse(stale.exists())
+        with self.subTest('fresh'):
+            self.assertTrue(fresh.exists())
+
+    def test_removes_json_copy_when_safetensors_copy_exists(self):
+        json_path = self._populate(['hola'], file_type='json')[0]
+        safetensors_path = self._populate(['hola'])[0]
+        result = self._collect()
+        with self.subTest('removed'):
+            self.assertFalse(json_path.exists())
+        with self.subTest('kept'):
+            self.assertTrue(safetensors_path.exists())
+        with self.subTest('reclaimed'):
+            self.assertEqual(result.removed_files, 1)
+
+    def test_keeps_json_file_without_safetensors_copy(self):
+        json_path = self._populate(['hola'], file_type='json')[0]
+        self._collect()
+        self.assertTrue(json_path.exists())
+
+    def test_keeps_copy_in_current_layout(self):
+        flat_path = self._populate(['hola'])[0]
+        with patch.object(cached, 'LAYOUT', 'sharded'):
+            # pylint: disable-next=protected-access  # To save a 2nd copy.
+            cached._save('embed_one', 'hola', _helpers.fake_embed_one('hola'),
+                         self.dir_path, self.file_type)
+            self._collect()
+        # pylint: disable-next=protected-access  # Just to get the path.
+        sharded_path = cached._shard(flat_path)
+        with self.subTest('flat'):
+            self.assertFalse(flat_path.exists())
+        with self.subTest('sharded'):
+            self.assertTrue(sharded_path.exists())
+
+    def test_evicts_least_recently_used_to_max_files(self):
+        paths = self._populate(_TEXTS)
+        self._set_last_used(paths, [3, 1, 2])
+        result = self._collect(max_files=2)
+        with self.subTest('evicted'):
+            self.assertFalse(paths[1].exists())
+        with self.subTest('kept'):
+            self.assertTrue(paths[0].exists() and paths[2].exists())
+        with self.subTest('counts'):
+            self.assertEqual((result.removed_files, result.kept_files), (1, 2))
+
+    def test_evicts_least_recently_used_to_max_bytes(self):
+        paths = self._populate(_TEXTS)
+        self._set_last_used(paths, [1, 3, 2])
+        size = paths[0].stat().st_size
+        result = self._collect(max_bytes=size + size // 2)
+        with self.subTest('evicted'):
+            self.assertFalse(paths[0].exists() or paths[2].exists())
+        with self.subTest('kept'):
+            self.assertTrue(paths[1].exists())
+        with self.subTest('bytes'):
+            self.assertEqual((result.reclaimed_bytes, result.kept_bytes),
+                             (2 * size, size))
+
+    def test_later_modification_time_counts_as_use(self):
+        paths = self._populate(_TEXTS[:2])
+        now = time.time()
+        os.utime(paths[0], (now - 300, now - 100))
+        os.utime(paths[1], (now - 200, now - 200))
+        self._collect(max_files=1)
+        self.assertEqual([path.exists() for path in paths], [True, False])
+
+    def test_dry_run_removes_nothing(self):
+        paths = self._populate(_TEXTS)
+        expected = self._collect(max_files=1, dry_run=True)
+        with self.subTest('files'):
+            self.assertTrue(all(path.exists() for path in paths))
+        with self.subTest('result'):
+            self.assertEqual(self._collect(max_files=1), expected)
+
+    def test_does_not_remove_file_saved_again_meanwhile(self):
+        path = self._populate(['hola'])[0]
+        # pylint: disable-next=protected-access  # To wrap it.
+        plan_eviction = maintenance._plan_eviction
+
+        def plan_then_save_again(*args, **kwargs):
+            evicted = plan_eviction(*args, **kwargs)
+            replacement = path.with_name('replacement')
+            replacement.write_bytes(path.read_bytes())
+            os.replace(replacement, path)
+            return evicted
+
+        with patch.object(maintenance, '_plan_eviction', plan_then_save_again):
+            result = self._collect(max_files=0)
+        with self.subTest('file'):
+            self.assertTrue(path.exists())
+        with self.subTest('count'):
+            self.assertEqual(result.removed_files, 0)
+
+    def test_leaves_other_files_alone(self):
+        cached.embed_one('hola', data_dir=self.dir_path, file_type='segment')
+        (self.dir_path / 'notes.txt').write_text('hi', encoding='utf-8')
+        before = sorted(self.dir_path.iterdir())
+        result = self._collect(max_bytes=0, max_files=0)
+        with self.subTest('files'):
+            self.assertEqual(sorted(self.dir_path.iterdir()), before)
+        with self.subTest('count'):
+            self.assertEqual(result.removed_files, 0)
+
+    @parameterized.expand([('max_bytes',), ('max_files',)])
+    def test_negative_limit_is_rejected(self, limit_name):
+        with self.assertRaises(ValueError):
+            self._collect(**{limit_name: -1})
+
+    def test_command_collects_and_reports(self):
+        self._populate(_TEXTS)
+        with contextlib.redirect_stdout(io.StringIO()) as stdout:
+            __main__.main(['gc', '--max-files', '1', str(self.dir_path)])
+        with self.subTest('output'):
+            self.assertIn('Removed 2 files', stdout.getvalue())
+        with self.subTest('files'):
+            self.assertEqual(len(list(self.dir_path.glob('*.safetensors'))), 1)
+
+    @parameterized.expand([
+        ('1000', 1000),
+        ('4K', 4096),
+        ('512M', 512 * 2**20),
+        ('10GiB', 10 * 2**30),
+        ('2gb', 2 * 2**30),
+    ])
+    def test_command_parses_sizes(self, text, expected):
+        # pylint: disable-next=protected-access  # Testing the parser.
+        self.assertEqual(__main__._size(text), expected)
+
+    def test_command_rejects_bad_size(self):
+        with self.assertRaises(argparse.ArgumentTypeError):
+            # pylint: disable-next=protected-access  # Testing the parser.
+            __main__._size('lots')
+
+    def _collect(self, **kwargs):
+        """Collect garbage in the temporary directory."""
+        return maintenance.collect_garbage(data_dir=self.dir_path, **kwargs)
+
+    def _populate(self, texts, file_type=None):
+        """Cache texts' embeddings. Return the paths of their files."""
+        file_type = self.file_type if file_type is None else file_type
+        for text in texts:
+            cached.embed_one(text, data_dir=self.dir_path, file_type=file_type)
+        return [self._path(text, file_type) for text in texts]
+
+    def _path(self, text, file_type=None):
+        """Get the path of a text's cache file."""
+        file_type = self.file_type if file_type is None else file_type
+        # pylint: disable-next=protected-access  # Just to build the path.
+        return cached._build_path(text, self.dir_path, file_type)
+
+    @staticmethod
+    def _set_last_used(paths, order):
+        """Set files' access and modification times in the given order."""
+        now = time.time()
+        for path, rank in zip(paths, order):
+            os.utime(path, (now - 1000 + rank, now - 1000))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,192 @@
+#!/usr/bin/env python
+
+"""
+Tests for loading ``'json'`` entries from ``.safetensors`` copies.
+
+These tests use a fake embedding function in place of ``embed.embed_one``, so
+they check which files are loaded and saved, without calling the API.
+"""
+
+import contextlib
+import io
+import unittest
+from unittest.mock import patch
+
+import numpy as np
+from parameterized import parameterized
+
+import embed
+from embed import __main__, cached, maintenance
+from tests import _bases, _helpers
+
+_TEXTS = ['hola', 'hello', 'bonjour']
+"""Texts whose embeddings are cached by some of these tests."""
+
+
+class TestJsonConversion(_bases.TestDiskCachedBase):
+    """Tests for ``.safetensors`` copies of JSON entries, and making them."""
+
+    def setUp(self):
+        """Patch ``embed_one`` with a fake."""
+        super().setUp()
+        self.mock_one = self._patch_embedder('embed_one',
+                                             _helpers.fake_embed_one)
+
+    @property
+    def func(self):
+        return cached.embed_one
+
+    @property
+    def file_type(self):
+        return 'json'
+
+    # pylint: disable=missing-function-docstring  # Tests' names describe them.
+    # pylint: disable=protected-access  # To make and find files directly.
+
+    def test_json_lookup_loads_safetensors_copy(self):
+        self._call('hola')
+        zeros = np.zeros(embed.DIMENSION, dtype=np.float32)
+        cached._save_safetensors(self._copy_path('hola'), zeros)
+        self.mock_one.reset_mock()
+
+        with self.assertLogs(cached.__name__, 'INFO') as logs:
+            result = self._call('hola')
+
+        with self.subTest('call'):
+            self.mock_one.assert_not_called()
+        with self.subTest('values'):
+            np.testing.assert_array_equal(result, zeros)
+        with self.subTest('loaded'):
+            self.assertIn(str(self._copy_path('hola')), logs.output[0])
+
+    def test_json_lookup_finds_copy_in_other_layout(self):
+        self._call('hola')
+        zeros = np.zeros(embed.DIMENSION, dtype=np.float32)
+        with patch.object(cached, 'LAYOUT', 'sharded'):
+            cached._save('embed_one', 'hola', zeros, self.dir_path,
+                         'safetensors')
+        np.testing.assert_array_equal(self._call('hola'), zeros)
+
+    def test_json_lookup_without_copy_loads_json(self):
+        self._call('hola')
+        self.mock_one.reset_mock()
+        result = self._call('hola')
+        with self.subTest('call'):
+            self.mock_one.assert_not_called()
+        with self.subTest('values'):
+            np.testing.assert_array_equal(
+                result, _helpers.fake_embed_one('hola'))
+
+    def test_corrupt_copy_falls_back_to_json(self):
+        self._call('hola')
+        self._copy_path('hola').write_bytes(b'not safetensors')
+        self.mock_one.reset_mock()
+        result = self._call('hola')
+        with self.subTest('call'):
+            self.mock_one.assert_not_called()
+        with self.subTest('values'):
+            np.testing.assert_array_equal(
+                result, _helpers.fake_embed_one('hola'))
+
+    def test_copy_is_not_memory_mapped(self):
+        self._call('hola')
+        cached._save_safetensors(self._copy_path('hola'),
+                                 _helpers.fake_embed_one('hola'))
+        result = self._call('hola', mmap_mode='r')
+        self.assertNotIsInstance(result, np.memmap)
+
+    def test_no_copy_is_saved_by_default(self):
+        self._call('hola')
+        self._call('hola')
+        self._wait_for_conversions()
+        self.assertFalse(self._copy_path('hola').exists())
+
+    def test_convert_json_saves_copy_when_loaded(self):
+        self._call('hola')
+        with patch.object(cached, 'CONVERT_JSON', True):
+            self._call('hola')
+            self._wait_for_conversions()
+        with self.subTest('copy'):
+            np.testing.assert_array_equal(
+                cached._load_safetensors(self._copy_path('hola'), None),
+                _helpers.fake_embed_one('hola'))
+        with self.subTest('json'):
+            self.assertTrue(self._path('hola').exists())
+
+    def test_convert_json_copy_is_unaffected_by_changing_result(self):
+        self._call('hola')
+        with patch.object(cached, 'CONVERT_JSON', True):
+            self._call('hola')[:] = 0.0
+            self._wait_for_conversions()
+        np.testing.assert_array_equal(
+            cached._load_safetensors(self._copy_path('hola'), None),
+            _helpers.fake_embed_one('hola'))
+
+    def test_convert_json_converts_files(self):
+        for text in _TEXTS:
+            self._call(text)
+        count = maintenance.convert_json(data_dir=self.dir_path)
+        with self.subTest('count'):
+            self.assertEqual(count, len(_TEXTS))
+        for text in _TEXTS:
+            with self.subTest(text=text):
+                np.testing.assert_array_equal(
+                    cached._load_safetensors(self._copy_path(text), None),
+                    _helpers.fake_embed_one(text))
+        with self.subTest('json'):
+            self.assertTrue(all(self._path(text).exists() for text in _TEXTS))
+
+    def test_convert_json_twice_converts_nothing_more(self):
+        self._call('hola')
+        maintenance.convert_json(data_dir=self.dir_path)
+        self.assertEqual(maintenance.convert_json(data_dir=self.dir_path), 0)
+
+    @parameterized.expand([('flat',), ('sharded',)])
+    def test_convert_json_saves_copy_beside_json_file(self, layout):
+        with patch.object(cached, 'LAYOUT', layout):
+            self._call('hola')
+            maintenance.convert_json(data_dir=self.dir_path)
+            json_location = cached._locations(self._path('hola'), 'json')[0]
+        self.assertTrue(json_location.with_suffix('.safetensors').exists())
+
+    def test_convert_json_skips_corrupt_file(self):
+        self._call('hola')
+        self._call('hello')
+        self._path('hola').write_bytes(b'[0.1, ')
+        with self.assertLogs(maintenance.__name__, 'WARNING'):
+            count = maintenance.convert_json(data_dir=self.dir_path)
+        with self.subTest('count'):
+            self.assertEqual(count, 1)
+        with self.subTest('corrupt'):
+            self.assertFalse(self._copy_path('hola').exists())
+
+    def test_command_converts(self):
+        self._call('hola')
+        with contextlib.redirect_stdout(io.StringIO()) as stdout:
+            __main__.main(['convert', str(self.dir_path)])
+        with self.subTest('output'):
+            self.assertIn('Converted 1 JSON files', stdout.getvalue())
+        with self.subTest('copy'):
+            self.assertTrue(self._copy_path('hola').exists())
+
+    def _call(self, text, **kwargs):
+        """Call cached ``embed_one`` with the JSON file type."""
+        return cached.embed_one(text, data_dir=self.dir_path,
+                                file_type=self.file_type, **kwargs)
+
+    def _path(self, text):
+        """Get the path of a text's JSON cache file."""
+        return cached._build_path(text, self.dir_path, self.file_type)
+
+    def _copy_path(self, text):
+        """Get the path of a text's ``.safetensors`` cache file."""
+        return cached._build_path(text, self.dir_path, 'safetensors')
+
+    @staticmethod
+    def _wait_for_conversions():
+        """Wait for copies being saved in the background to be saved."""
+        cached._converter.submit(lambda: None).result()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,89 @@
+#!/usr/bin/env python
+
+"""
+Tests for how ``embed.cached`` derives cache keys and paths from texts.
+
+Keys must not change, or existing caches would stop being found, so these
+tests check them against hashes of the input serialized all at once.
+"""
+
+from pathlib import Path
+import unittest
+from unittest.mock import patch
+
+import blake3
+import orjson
+from parameterized import parameterized
+
+from embed import cached
+from tests import _bases
+
+_BATCHES = [
+    ('empty', []),
+    ('one', ['hola']),
+    ('several', ['hola', 'hello', 'bonjour']),
+    ('repeated', ['hello', 'hello', 'hola', 'hello']),
+    ('escapes', ['"quoted"', 'back\\slash', 'line\nbreak', '']),
+    ('unicode', ['héllo', 'こんにちは', '😀', ' ']),
+]
+"""Names and batches of texts whose keys are checked."""
+
+
+def _expected_hash(text_or_texts):
+    """Hash input the original way: serialized whole, then hashed."""
+    return blake3.blake3(orjson.dumps(text_or_texts)).hexdigest()
+
+
+class TestKeys(_bases.TestBase):
+    """Tests for the non-public hashing and path-building functions."""
+
+    # pylint: disable=missing-function-docstring  # Tests' names describe them.
+    # pylint: disable=protected-access  # These test non-public functions.
+
+    @parameterized.expand(['hola', '', 'こんにちは'])
+    def test_text_hash_is_unchanged(self, text):
+        self.assertEqual(cached._compute_input_hash(text),
+                         _expected_hash(text))
+
+    @parameterized.expand(_BATCHES)
+    def test_batch_hash_is_unchanged(self, _name, texts):
+        self.assertEqual(cached._compute_input_hash(texts),
+                         _expected_hash(texts))
+
+    @parameterized.expand(_BATCHES)
+    def test_batch_hash_is_unchanged_across_slices(self, _name, texts):
+        with patch.object(cached, '_HASH_SLICE_LENGTH', 2):
+            actual = cached._compute_input_hash(texts)
+        self.assertEqual(actual, _expected_hash(texts))
+
+    def test_tuple_hashes_like_list(self):
+        texts = ['hola', 'hello']
+        self.assertEqual(cached._compute_input_hash(tuple(texts)),
+                         _expected_hash(texts))
+
+    def test_large_text_hash_is_unchanged(self):
+        text = 'hola ' * 100_000
+        with patch.object(cached, '_PARALLEL_HASH_SIZE', 1000):
+            actual = cached._compute_input_hash(text)
+        self.assertEqual(actual, _expected_hash(text))
+
+    @parameterized.expand(_BATCHES)
+    def test_per_text_hashes_match_single_hashes(self, _name, texts):
+        self.assertEqual(cached._compute_input_hashes(texts),
+                         [_expected_hash(text) for text in texts])
+
+    @parameterized.expand([
+        ('default', None),
+        ('str', 'some/dir'),
+        ('path', Path('some/dir')),
+    ])
+    def test_per_text_paths_match_single_paths(self, _name, data_dir):
+        texts = ['hola', 'hello', 'bonjour']
+        expected = [cached._build_path(text, data_dir, 'json')
+                    for text in texts]
+        self.assertEqual(cached._build_paths(texts, data_dir, 'json'),
+                         expected)
+
+
+if __name__ == '__main__':
+    unittest.main()
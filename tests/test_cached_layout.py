@@ -0,0 +1,178 @@
+#!/usr/bin/env python
+
+"""
+Tests for the flat and sharded layouts of cache directories, and migration.
+
+These tests use a fake embedding function in place of ``embed.embed_one``, so
+they check where cache files are saved and found, without calling the API.
+"""
+
+import contextlib
+import io
+import unittest
+from unittest.mock import patch
+
+import numpy as np
+from parameterized import parameterized
+
+from embed import __main__, _locking, _segment, cached, maintenance
+from tests import _bases, _helpers
+
+_TEXTS = ['hola', 'hello', 'bonjour']
+"""Texts whose embeddings are cached by some of these tests."""
+
+
+class TestLayout(_bases.TestDiskCachedBase):
+    """Tests for the cache directory layouts and ``migrate``."""
+
+    def setUp(self):
+        """Patch ``embed_one`` with a fake."""
+        super().setUp()
+        self.addCleanup(_segment.close_stores)
+        self.mock_one = self._patch_embedder('embed_one',
+                                             _helpers.fake_embed_one)
+
+    @property
+    def func(self):
+        return cached.embed_one
+
+    @property
+    def file_type(self):
+        return cached.DEFAULT_FILE_TYPE
+
+    # pylint: disable=missing-function-docstring  # Tests' names describe them.
+
+    def test_layout_is_flat_by_default(self):
+        self.assertEqual(cached.LAYOUT, 'flat')
+
+    def test_flat_layout_saves_in_directory(self):
+        self._call('hola')
+        self.assertEqual(self._file_paths(), [self._flat_path('hola')])
+
+    def test_sharded_layout_saves_in_subdirectories(self):
+        with patch.object(cached, 'LAYOUT', 'sharded'):
+            self._call('hola')
+        self.assertEqual(self._file_paths(), [self._sharded_path('hola')])
+
+    @parameterized.expand([
+        ('flat_finds_sharded', 'sharded', 'flat'),
+        ('sharded_finds_flat', 'flat', 'sharded'),
+    ])
+    def test_file_in_other_layout_is_found(self, _name, saved, used):
+        with patch.object(cached, 'LAYOUT', saved):
+            self._call('hola')
+        self.mock_one.reset_mock()
+        with patch.object(cached, 'LAYOUT', used):
+            result = self._call('hola')
+        with self.subTest('call'):
+            self.mock_one.assert_not_called()
+        with self.subTest('values'):
+            np.testing.assert_array_equal(
+                result, _helpers.fake_embed_one('hola'))
+
+    def test_sharded_layout_does_not_affect_store_file_types(self):
+        with patch.object(cached, 'LAYOUT', 'sharded'):
+            cached.embed_one('hola', data_dir=self.dir_path,
+                             file_type='segment')
+        self.assertFalse(any(path.is_dir() and len(path.name) == 2
+                             for path in self.dir_path.iterdir()))
+
+    def test_migrate_to_sharded_moves_files(self):
+        for text in _TEXTS:
+            self._call(text)
+        count = maintenance.migrate('sharded', data_dir=self.dir_path)
+        with self.subTest('count'):
+            self.assertEqual(count, len(_TEXTS))
+        with self.subTest('paths'):
+            self.assertEqual(
+                self._file_paths(),
+                sorted(self._sharded_path(text) for text in _TEXTS))
+
+    def test_migrate_to_flat_moves_files_and_removes_subdirectories(self):
+        with patch.object(cached, 'LAYOUT', 'sharded'):
+            for text in _TEXTS:
+                self._call(text)
+        count = maintenance.migrate('flat', data_dir=self.dir_path)
+        with self.subTest('count'):
+            self.assertEqual(count, len(_TEXTS))
+        with self.subTest('entries'):
+            self.assertEqual(
+                sorted(self.dir_path.iterdir()),
+                sorted([self.dir_path / _locking.LOCKS_DIR_NAME,
+                        *(self._flat_path(text) for text in _TEXTS)]))
+
+    def test_migrated_files_are_used(self):
+        for text in _TEXTS:
+            self._call(text)
+        maintenance.migrate('sharded', data_dir=self.dir_path)
+        self.mock_one.reset_mock()
+        with patch.object(cached, 'LAYOUT', 'sharded'):
+            for text in _TEXTS:
+                self._call(text)
+        self.mock_one.assert_not_called()
+
+    def test_migrate_keeps_file_already_in_layout(self):
+        self._call('hola')
+        sharded_path = self._sharded_path('hola')
+        sharded_path.parent.mkdir(parents=True)
+        sharded_path.write_bytes(b'already here')
+        maintenance.migrate('sharded', data_dir=self.dir_path)
+        with self.subTest('kept'):
+            self.assertEqual(sharded_path.read_bytes(), b'already here')
+        with self.subTest('removed'):
+            self.assertFalse(self._flat_path('hola').exists())
+
+    def test_migrate_leaves_other_files_alone(self):
+        self._call('hola')
+        cached.embed_one('hello', data_dir=self.dir_path, file_type='segment')
+        other = self.dir_path / 'notes.txt'
+        other.write_text('not an embedding', encoding='utf-8')
+        before = sorted(path for path in self.dir_path.iterdir()
+                        if path != self._flat_path('hola'))
+        maintenance.migrate('sharded', data_dir=self.dir_path)
+        after = sorted(path for path in self.dir_path.iterdir()
+                       if not path.name.startswith(
+                           self._flat_path('hola').name[:2]))
+        self.assertEqual(after, before)
+
+    def test_migrate_twice_moves_nothing_more(self):
+        self._call('hola')
+        maintenance.migrate('sharded', data_dir=self.dir_path)
+        count = maintenance.migrate('sharded', data_dir=self.dir_path)
+        self.assertEqual(count, 0)
+
+    def test_migrate_rejects_unknown_layout(self):
+        with self.assertRaises(ValueError):
+            maintenance.migrate('deep', data_dir=self.dir_path)
+
+    def test_command_migrates(self):
+        self._call('hola')
+        with contextlib.redirect_stdout(io.StringIO()) as stdout:
+            __main__.main(['migrate', '--layout', 'sharded',
+                           str(self.dir_path)])
+        with self.subTest('output'):
+            self.assertIn('Moved 1 files', stdout.getvalue())
+        with self.subTest('paths'):
+            self.assertEqual(self._file_paths(), [self._sharded_path('hola')])
+
+    def _call(self, text):
+        """Call cached ``embed_one`` with the temporary directory."""
+        return cached.embed_one(text, data_dir=self.dir_path)
+
+    def _flat_path(self, text):
+        """Get where a text's file is in the flat layout."""
+        # pylint: disable-next=protected-access  # Just to build the path.
+        return cached._build_path(text, self.dir_path, self.file_type)
+
+    def _sharded_path(self, text):
+        """Get where a text's file is in the sharded layout."""
+        name = self._flat_path(text).name
+        return self.dir_path / name[:2] / name[2:4] / name
+
+    def _file_paths(self):
+        """Get the sorted paths of all cache files, at any depth."""
+        return sorted(self.dir_path.rglob(f'*.{self.file_type}'))
+
+
+if __name__ == '__main__':
+    unittest.main()
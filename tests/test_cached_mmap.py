@@ -0,0 +1,151 @@
+#!/usr/bin/env python
+
+"""
+Tests of memory-mapped loading in ``embed.cached`` functions.
+
+These tests use fake embedding functions in place of the ones in ``embed``, so
+they check how cached files are loaded, without calling the API.
+"""
+
+import unittest
+
+import numpy as np
+from parameterized import parameterized
+import safetensors.numpy
+
+import embed
+from embed import cached
+from tests import _bases, _helpers
+
+_TEXTS = ['hola', 'hello', 'bonjour']
+"""Texts embedded together in a batch by most of these tests."""
+
+
+class TestMmap(_bases.TestDiskCachedBase):
+    """Tests for the ``mmap_mode`` argument."""
+
+    def setUp(self):
+        """Patch ``embed_one`` and ``embed_many`` with fakes."""
+        super().setUp()
+        self.mock_one = self._patch_embedder('embed_one',
+                                             _helpers.fake_embed_one)
+        self.mock_many = self._patch_embedder('embed_many',
+                                              _helpers.fake_embed_many)
+
+    @property
+    def func(self):
+        return cached.embed_many
+
+    @property
+    def file_type(self):
+        return 'safetensors'
+
+    # pylint: disable=missing-function-docstring  # Tests' names describe them.
+
+    @parameterized.expand([('r',), ('c',)])
+    def test_mapped_matrix_has_cached_values(self, mmap_mode):
+        self._call(_TEXTS)
+        result = self._call(_TEXTS, mmap_mode=mmap_mode)
+        with self.subTest('dtype'):
+            self.assertEqual(result.dtype, np.float32)
+        with self.subTest('values'):
+            np.testing.assert_array_equal(
+                result, _helpers.fake_embed_many(_TEXTS))
+
+    def test_mapped_matrix_is_a_memmap(self):
+        self._call(_TEXTS)
+        result = self._call(_TEXTS, mmap_mode='r')
+        self.assertIsInstance(result, np.memmap)
+
+    def test_read_only_mapping_cannot_be_modified(self):
+        self._call(_TEXTS)
+        result = self._call(_TEXTS, mmap_mode='r')
+        with self.assertRaises(ValueError):
+            result[0, 0] = 1.0
+
+    def test_copy_on_write_changes_are_not_saved(self):
+        self._call(_TEXTS)
+        result = self._call(_TEXTS, mmap_mode='c')
+        result[0] = 0.0
+        np.testing.assert_array_equal(
+            self._call(_TEXTS), _helpers.fake_embed_many(_TEXTS))
+
+    def test_default_loads_into_memory(self):
+        self._call(_TEXTS)
+        result = self._call(_TEXTS)
+        self.assertNotIsInstance(result, np.memmap)
+
+    def test_embed_one_can_map(self):
+        cached.embed_one('hola', data_dir=self.dir_path)
+        result = cached.embed_one('hola', data_dir=self.dir_path,
+                                  mmap_mode='r')
+        with self.subTest('type'):
+            self.assertIsInstance(result, np.memmap)
+        with self.subTest('values'):
+            np.testing.assert_array_equal(
+                result, _helpers.fake_embed_one('hola'))
+
+    def test_miss_returns_computed_matrix(self):
+        result = self._call(_TEXTS, mmap_mode='r')
+        np.testing.assert_array_equal(
+            result, _helpers.fake_embed_many(_TEXTS))
+
+    def test_empty_batch_can_be_mapped(self):
+        self._call([])
+        result = self._call([], mmap_mode='r')
+        self.assertEqual(result.shape, (0, embed.DIMENSION))
+
+    def test_json_ignores_mmap_mode(self):
+        self._call(_TEXTS, file_type='json')
+        result = self._call(_TEXTS, file_type='json', mmap_mode='r')
+        with self.subTest('calls'):
+            self.mock_many.assert_called_once()
+        with self.subTest('values'):
+            np.testing.assert_array_equal(
+                result, _helpers.fake_embed_many(_TEXTS))
+
+    def test_truncated_file_is_a_miss(self):
+        self._call(_TEXTS)
+        # pylint: disable-next=protected-access  # Just to get the path.
+        path = cached._build_path(_TEXTS, self.dir_path, self.file_type)
+        path.write_bytes(path.read_bytes()[:-100])
+        self.mock_many.reset_mock()
+
+        with self.assertLogs(cached.__name__, 'WARNING'):
+            result = self._call(_TEXTS, mmap_mode='r')
+
+        with self.subTest('call'):
+            self.mock_many.assert_called_once_with(_TEXTS)
+        with self.subTest('values'):
+            np.testing.assert_array_equal(
+                result, _helpers.fake_embed_many(_TEXTS))
+
+    @parameterized.expand([('float64',), ('float16',)])
+    def test_unmappable_dtype_is_loaded(self, dtype):
+        # pylint: disable-next=protected-access  # Just to get the path.
+        path = cached._build_path(_TEXTS, self.dir_path, self.file_type)
+        expected = _helpers.fake_embed_many(_TEXTS).astype(dtype)
+        safetensors.numpy.save_file({'embeddings': expected}, path)
+
+        result = self._call(_TEXTS, mmap_mode='r')
+
+        with self.subTest('calls'):
+            self.mock_many.assert_not_called()
+        with self.subTest('values'):
+            np.testing.assert_array_equal(result, expected)
+        with self.subTest('kept'):
+            self.assertTrue(path.exists())
+
+    @parameterized.expand([('w+',), ('r+',), ('rw',)])
+    def test_other_modes_are_rejected(self, mmap_mode):
+        with self.assertRaises(ValueError):
+            self._call(_TEXTS, mmap_mode=mmap_mode)
+
+    def _call(self, texts, **kwargs):
+        """Call cached ``embed_many`` with the temporary directory."""
+        kwargs.setdefault('file_type', self.file_type)
+        return cached.embed_many(texts, data_dir=self.dir_path, **kwargs)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,187 @@
+#!/usr/bin/env python
+
+"""
+Tests of per-text caching in ``embed.cached.embed_many*`` functions.
+
+These tests use fake embedding functions in place of the ones in ``embed``, so
+they check how results are looked up, computed, and combined, without calling
+the API.
+"""
+
+from abc import abstractmethod
+import unittest
+
+import numpy as np
+
+import embed
+from embed import cached
+from tests import _bases, _helpers
+
+
+class _TestPerTextBase(_bases.TestDiskCachedBase):
+    """Tests of ``per_text=True`` in the ``embed.cached.embed_many*`` group."""
+
+    def setUp(self):
+        """Patch the non-caching embedders with fake ones."""
+        super().setUp()
+        self.mock_many = self._patch_embedder(
+            self.many_name, _helpers.fake_embed_many)
+        self.mock_one = self._patch_embedder(
+            self.one_name, _helpers.fake_embed_one)
+
+    @property
+    @abstractmethod
+    def many_name(self):
+        """Name of the ``embed_many*`` function being tested."""
+
+    @property
+    def one_name(self):
+        """Name of the corresponding ``embed_one*`` function."""
+        return self.many_name.replace('many', 'one')
+
+    @property
+    def func(self):
+        return getattr(cached, self.many_name)
+
+    # pylint: disable=missing-function-docstring  # Tests' names describe them.
+
+    def test_returns_float32_rows_in_input_order(self):
+        texts = ['hola', 'hello', 'bonjour']
+        result = self._call(texts)
+        with self.subTest('dtype'):
+            self.assertEqual(result.dtype, np.float32)
+        with self.subTest('values'):
+            np.testing.assert_array_equal(
+                result, _helpers.fake_embed_many(texts))
+
+    def test_embeds_all_texts_in_one_call_if_none_cached(self):
+        self._call(['hola', 'hello'])
+        self.mock_many.assert_called_once_with(['hola', 'hello'])
+
+    def test_embeds_only_uncached_texts(self):
+        self._call(['hola', 'hello'])
+        self.mock_many.reset_mock()
+        self._call(['hello', 'bonjour', 'hola', 'ciao'])
+        self.mock_many.assert_called_once_with(['bonjour', 'ciao'])
+
+    def test_stitches_cached_and_new_rows_in_input_order(self):
+        self._call(['hello'])
+        texts = ['hola', 'hello', 'bonjour']
+        result = self._call(texts)
+        np.testing.assert_array_equal(result, _helpers.fake_embed_many(texts))
+
+    def test_does_not_call_api_if_all_cached(self):
+        self._call(['hola', 'hello'])
+        self.mock_many.reset_mock()
+        self._call(['hello', 'hola'])
+        self.mock_many.assert_not_called()
+
+    def test_embeds_repeated_text_once(self):
+        result = self._call(['hola', 'hello', 'hola'])
+        with self.subTest('call'):
+            self.mock_many.assert_called_once_with(['hola', 'hello'])
+        with self.subTest('rows'):
+            np.testing.assert_array_equal(result[0], result[2])
+
+    def test_empty_input_gives_empty_matrix(self):
+        result = self._call([])
+        self.assertEqual(result.shape, (0, embed.DIMENSION))
+
+    def test_entries_are_shared_with_embed_one(self):
+        self._call(['hola', 'hello'])
+        embed_one = getattr(cached, self.one_name)
+        result = embed_one(
+            'hello', data_dir=self.dir_path, file_type=self.file_type)
+        with self.subTest('call'):
+            self.mock_one.assert_not_called()
+        with self.subTest('value'):
+            np.testing.assert_array_equal(
+                result, _helpers.fake_embed_one('hello'))
+
+    def test_uses_entries_saved_by_embed_one(self):
+        embed_one = getattr(cached, self.one_name)
+        embed_one('hola', data_dir=self.dir_path, file_type=self.file_type)
+        self._call(['hola', 'hello'])
+        self.mock_many.assert_called_once_with(['hello'])
+
+    def _call(self, texts):
+        """Call the function under test in per-text mode."""
+        return self.func(
+            texts,
+            data_dir=self.dir_path,
+            file_type=self.file_type,
+            per_text=True,
+        )
+
+
+class _TestPerTextJsonBase(_TestPerTextBase):
+    """Abstract base for per-text tests using JSON serialization."""
+
+    @property
+    def file_type(self):
+        return 'json'
+
+
+class _TestPerTextSafetensorsBase(_TestPerTextBase):
+    """Abstract base for per-text tests using safetensors serialization."""
+
+    @property
+    def file_type(self):
+        return 'safetensors'
+
+
+class TestPerTextEmbedManyJson(_TestPerTextJsonBase):
+    """Tests for per-text cached ``embed_many`` with JSON."""
+
+    @property
+    def many_name(self):
+        return 'embed_many'
+
+
+class TestPerTextEmbedManySafetensors(_TestPerTextSafetensorsBase):
+    """Tests for per-text cached ``embed_many`` with safetensors."""
+
+    @property
+    def many_name(self):
+        return 'embed_many'
+
+
+class TestPerTextEmbedManyEuJson(_TestPerTextJsonBase):
+    """Tests for per-text cached ``embed_many_eu`` with JSON."""
+
+    @property
+    def many_name(self):
+        return 'embed_many_eu'
+
+
+class TestPerTextEmbedManyEuSafetensors(_TestPerTextSafetensorsBase):
+    """Tests for per-text cached ``embed_many_eu`` with safetensors."""
+
+    @property
+    def many_name(self):
+        return 'embed_many_eu'
+
+
+class TestPerTextEmbedManyReqJson(_TestPerTextJsonBase):
+    """Tests for per-text cached ``embed_many_req`` with JSON."""
+
+    @property
+    def many_name(self):
+        return 'embed_many_req'
+
+
+class TestPerTextEmbedManyReqSafetensors(_TestPerTextSafetensorsBase):
+    """Tests for per-text cached ``embed_many_req`` with safetensors."""
+
+    @property
+    def many_name(self):
+        return 'embed_many_req'
+
+
+del _TestPerTextBase
+del _TestPerTextJsonBase
+del _TestPerTextSafetensorsBase
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,192 @@
+#!/usr/bin/env python
+
+"""
+Tests of the ``'float16'`` and ``'int8'`` file types of ``embed.cached``.
+
+These tests use fake embedding functions in place of the ones in ``embed``, so
+they check how entries are saved with less precision and loaded back, without
+calling the API.
+"""
+
+import unittest
+
+import numpy as np
+from parameterized import parameterized
+import safetensors.numpy
+
+import embed
+from embed import cached, maintenance
+from tests import _bases, _helpers
+
+_TEXTS = ['hola', 'hello', 'bonjour']
+"""Texts embedded together in a batch by some of these tests."""
+
+_FILE_TYPES = [('float16',), ('int8',)]
+"""Parameters for tests that run once for each quantized file type."""
+
+_TOLERANCES = {'float16': 1e-3, 'int8': 5e-3}
+"""Largest difference from each original element allowed after loading."""
+
+_COSINE_TOLERANCES = {'float16': 1e-4, 'int8': 5e-3}
+"""Largest difference from each original cosine similarity allowed."""
+
+
+def _cosines(embeddings):
+    """Get the cosine similarities of the rows of a matrix to each other."""
+    unit = embeddings / np.linalg.norm(embeddings, axis=1, keepdims=True)
+    return unit @ unit.T
+
+
+class TestQuantized(_bases.TestDiskCachedBase):
+    """Tests for caching embeddings with reduced precision."""
+
+    def setUp(self):
+        """Patch ``embed_one`` and ``embed_many`` with fakes."""
+        super().setUp()
+        self.mock_one = self._patch_embedder('embed_one',
+                                             _helpers.fake_embed_one)
+        self.mock_many = self._patch_embedder('embed_many',
+                                              _helpers.fake_embed_many)
+
+    @property
+    def func(self):
+        return cached.embed_one
+
+    @property
+    def file_type(self):
+        return 'int8'
+
+    # pylint: disable=missing-function-docstring  # Tests' names describe them.
+
+    @parameterized.expand(_FILE_TYPES)
+    def test_embed_one_loads_close_float32_values(self, file_type):
+        self._call_one('hola', file_type)
+        self.mock_one.reset_mock()
+        result = self._call_one('hola', file_type)
+        with self.subTest('call'):
+            self.mock_one.assert_not_called()
+        with self.subTest('dtype'):
+            self.assertEqual(result.dtype, np.float32)
+        with self.subTest('values'):
+            np.testing.assert_allclose(result, _helpers.fake_embed_one('hola'),
+                                       rtol=0, atol=_TOLERANCES[file_type])
+
+    @parameterized.expand(_FILE_TYPES)
+    def test_embed_many_loads_close_float32_values(self, file_type):
+        self._call_many(_TEXTS, file_type)
+        self.mock_many.reset_mock()
+        result = self._call_many(_TEXTS, file_type)
+        with self.subTest('call'):
+            self.mock_many.assert_not_called()
+        with self.subTest('shape'):
+            self.assertEqual(result.shape, (len(_TEXTS), embed.DIMENSION))
+        with self.subTest('values'):
+            np.testing.assert_allclose(
+                result, _helpers.fake_embed_many(_TEXTS),
+                rtol=0, atol=_TOLERANCES[file_type])
+
+    @parameterized.expand(_FILE_TYPES)
+    def test_cosine_similarities_are_close(self, file_type):
+        texts = [f'text {index}' for index in range(20)]
+        self._call_many(texts, file_type, per_text=True)
+        result = self._call_many(texts, file_type, per_text=True)
+        np.testing.assert_allclose(
+            _cosines(result), _cosines(_helpers.fake_embed_many(texts)),
+            rtol=0, atol=_COSINE_TOLERANCES[file_type])
+
+    @parameterized.expand(_FILE_TYPES)
+    def test_computed_embeddings_are_returned_exactly(self, file_type):
+        result = self._call_one('hola', file_type)
+        np.testing.assert_array_equal(result, _helpers.fake_embed_one('hola'))
+
+    @parameterized.expand(_FILE_TYPES)
+    def test_loaded_entry_is_writable(self, file_type):
+        self._call_one('hola', file_type)
+        self._call_one('hola', file_type)[:] = 0.0
+        self.assertTrue(self._call_one('hola', file_type).any())
+
+    @parameterized.expand(_FILE_TYPES)
+    def test_empty_batch_round_trips(self, file_type):
+        self._call_many([], file_type)
+        result = self._call_many([], file_type)
+        self.assertEqual(result.shape, (0, embed.DIMENSION))
+
+    @parameterized.expand([
+        ('float16', 'float16', 2),
+        ('int8', 'int8', 4),
+    ])
+    def test_file_is_smaller(self, _name, file_type, ratio):
+        self._call_many(_TEXTS, file_type)
+        float32_size = len(_TEXTS) * embed.DIMENSION * 4
+        self.assertLess(self._entry_files()[0].stat().st_size,
+                        float32_size / ratio + 200)  # Allow for the header.
+
+    def test_int8_zero_vector_round_trips(self):
+        zeros = np.zeros(embed.DIMENSION, dtype=np.float32)
+        self.mock_one.side_effect = lambda _: zeros
+        self._call_one('hola', 'int8')
+        result = self._call_one('hola', 'int8')
+        np.testing.assert_array_equal(result, zeros)
+
+    def test_int8_scales_largest_magnitude_to_limit(self):
+        self._call_one('hola', 'int8')
+        # pylint: disable-next=protected-access  # Just to get the path.
+        path = cached._build_path('hola', self.dir_path, 'int8')
+        tensors = safetensors.numpy.load_file(path)
+        self.assertEqual(np.abs(tensors['embeddings']).max(), 127)
+
+    @parameterized.expand(_FILE_TYPES)
+    def test_float32_file_is_corrupt(self, file_type):
+        # pylint: disable-next=protected-access  # Just to get the path.
+        path = cached._build_path('hola', self.dir_path, file_type)
+        path.write_bytes(safetensors.numpy.save(
+            {'embeddings': _helpers.fake_embed_one('hola')}))
+        with self.assertLogs(cached.__name__, 'WARNING'):
+            result = self._call_one('hola', file_type)
+        with self.subTest('call'):
+            self.mock_one.assert_called_once_with('hola')
+        with self.subTest('value'):
+            np.testing.assert_array_equal(
+                result, _helpers.fake_embed_one('hola'))
+
+    def test_int8_file_with_wrong_scales_is_corrupt(self):
+        # pylint: disable-next=protected-access  # Just to get the path.
+        path = cached._build_path('hola', self.dir_path, 'int8')
+        path.write_bytes(safetensors.numpy.save({
+            'embeddings': np.ones(embed.DIMENSION, dtype=np.int8),
+            'scales': np.ones(2, dtype=np.float32),
+        }))
+        with self.assertLogs(cached.__name__, 'WARNING'):
+            self._call_one('hola', 'int8')
+        self.mock_one.assert_called_once_with('hola')
+
+    @parameterized.expand(_FILE_TYPES)
+    def test_garbage_collection_keeps_both_copies(self, file_type):
+        self._call_one('hola', file_type)
+        self._call_one('hola', 'safetensors')
+        maintenance.collect_garbage(data_dir=self.dir_path)
+        with self.subTest('files'):
+            self.assertEqual([path.suffix for path in self._entry_files()],
+                             sorted([f'.{file_type}', '.safetensors']))
+        with self.subTest('lookup'):
+            self._call_one('hola', file_type)
+            self.assertEqual(self.mock_one.call_count, 2)
+
+    def _entry_files(self):
+        """Get the paths of the cache files in the temporary directory."""
+        return sorted(path for path in self.dir_path.iterdir()
+                      if path.is_file())
+
+    def _call_one(self, text, file_type, **kwargs):
+        """Call cached ``embed_one`` with a file type."""
+        return cached.embed_one(text, data_dir=self.dir_path,
+                                file_type=file_type, **kwargs)
+
+    def _call_many(self, texts, file_type, **kwargs):
+        """Call cached ``embed_many`` with a file type."""
+        return cached.embed_many(texts, data_dir=self.dir_path,
+                                 file_type=file_type, **kwargs)
+
+
+if __name__ == '__main__':
+    unittest.main()
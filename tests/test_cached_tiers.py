@@ -0,0 +1,208 @@
+#!/usr/bin/env python
+
+"""
+Tests for using a list of cache directories (tiers) in ``embed.cached``.
+
+These tests use fake embedding functions in place of the ones in ``embed``, and
+two temporary directories, standing for a local directory and a shared one, so
+they check where entries are looked up and saved, without calling the API.
+"""
+
+from pathlib import Path
+from tempfile import TemporaryDirectory
+import unittest
+from unittest.mock import patch
+
+import numpy as np
+from parameterized import parameterized
+
+import embed
+from embed import _segment, _sqlite, cached
+from tests import _bases, _helpers
+
+_TEXTS = ['hola', 'hello', 'bonjour']
+"""Texts embedded together in a batch by some of these tests."""
+
+_FILE_TYPES = [('json',), ('safetensors',), ('segment',), ('sqlite',)]
+"""Parameters for tests that run once for each file type."""
+
+
+class TestTiers(_bases.TestDiskCachedBase):
+    """Tests for looking up, promoting, and saving entries across tiers."""
+
+    def setUp(self):
+        """Make a second directory. Patch embedders with fakes."""
+        super().setUp()
+        self.addCleanup(_segment.close_stores)
+        self.addCleanup(_sqlite.close_stores)
+        # pylint: disable-next=consider-using-with
+        self.shared_path = Path(self.enterContext(TemporaryDirectory()))
+        self.mock_one = self._patch_embedder('embed_one',
+                                             _helpers.fake_embed_one)
+        self.mock_many = self._patch_embedder('embed_many',
+                                              _helpers.fake_embed_many)
+
+    @property
+    def func(self):
+        return cached.embed_one
+
+    @property
+    def file_type(self):
+        return 'safetensors'
+
+    # pylint: disable=missing-function-docstring  # Tests' names describe them.
+
+    @parameterized.expand(_FILE_TYPES)
+    def test_hit_in_shared_tier_is_promoted(self, file_type):
+        cached.embed_one('hola', data_dir=self.shared_path,
+                         file_type=file_type)
+        self.mock_one.reset_mock()
+
+        result = self._call_one('hola', file_type)
+
+        with self.subTest('call'):
+            self.mock_one.assert_not_called()
+        with self.subTest('values'):
+            np.testing.assert_array_equal(
+                result, _helpers.fake_embed_one('hola'))
+        with self.subTest('promoted'):
+            self.assertTrue(self._is_cached(self.dir_path, 'hola', file_type))
+
+    def test_hit_in_local_tier_does_not_touch_shared_tier(self):
+        cached.embed_one('hola', data_dir=self.dir_path)
+        self._call_one('hola')
+        self.assertEqual(list(self.shared_path.iterdir()), [])
+
+    @parameterized.expand(_FILE_TYPES)
+    def test_miss_is_saved_in_all_tiers(self, file_type):
+        self._call_one('hola', file_type)
+        with self.subTest('call'):
+            self.mock_one.assert_called_once_with('hola')
+        for tier in self.dir_path, self.shared_path:
+            with self.subTest(tier=tier.name):
+                self.assertTrue(self._is_cached(tier, 'hola', file_type))
+
+    def test_miss_is_saved_in_first_tier_only_if_so_configured(self):
+        with patch.object(cached, 'WRITE_BACK', 'first'):
+            self._call_one('hola')
+        with self.subTest('local'):
+            self.assertTrue(self._is_cached(self.dir_path, 'hola'))
+        with self.subTest('shared'):
+            self.assertFalse(self._is_cached(self.shared_path, 'hola'))
+
+    def test_hit_is_promoted_even_if_writing_back_first_only(self):
+        cached.embed_one('hola', data_dir=self.shared_path)
+        with patch.object(cached, 'WRITE_BACK', 'first'):
+            self._call_one('hola')
+        self.assertTrue(self._is_cached(self.dir_path, 'hola'))
+
+    def test_unknown_write_back_policy_is_rejected(self):
+        with patch.object(cached, 'WRITE_BACK', 'some'):
+            with self.assertRaises(ValueError):
+                self._call_one('hola')
+        self.mock_one.assert_not_called()
+
+    def test_empty_list_is_rejected(self):
+        with self.assertRaises(ValueError):
+            cached.embed_one('hola', data_dir=[])
+
+    def test_failure_to_save_in_shared_tier_is_logged(self):
+        missing_dir = self.shared_path / 'missing'
+        with self.assertLogs(cached.__name__, 'WARNING'):
+            result = cached.embed_one('hola',
+                                      data_dir=[self.dir_path, missing_dir])
+        with self.subTest('values'):
+            np.testing.assert_array_equal(
+                result, _helpers.fake_embed_one('hola'))
+        with self.subTest('local'):
+            self.assertTrue(self._is_cached(self.dir_path, 'hola'))
+
+    def test_failure_to_save_in_local_tier_is_raised(self):
+        missing_dir = self.dir_path / 'missing'
+        with self.assertRaises(OSError):
+            cached.embed_one('hola', data_dir=[missing_dir, self.shared_path])
+
+    def test_corrupt_file_in_local_tier_falls_through_to_shared_tier(self):
+        cached.embed_one('hola', data_dir=self.shared_path)
+        self._path(self.dir_path, 'hola').write_bytes(b'corrupt')
+        self.mock_one.reset_mock()
+
+        result = self._call_one('hola')
+
+        with self.subTest('call'):
+            self.mock_one.assert_not_called()
+        with self.subTest('values'):
+            np.testing.assert_array_equal(
+                result, _helpers.fake_embed_one('hola'))
+        with self.subTest('replaced'):
+            np.testing.assert_array_equal(
+                cached.embed_one('hola', data_dir=self.dir_path),
+                _helpers.fake_embed_one('hola'))
+
+    def test_batch_is_promoted(self):
+        cached.embed_many(_TEXTS, data_dir=self.shared_path)
+        self.mock_many.reset_mock()
+        result = cached.embed_many(_TEXTS,
+                                   data_dir=[self.dir_path, self.shared_path])
+        with self.subTest('call'):
+            self.mock_many.assert_not_called()
+        with self.subTest('values'):
+            np.testing.assert_array_equal(
+                result, _helpers.fake_embed_many(_TEXTS))
+        with self.subTest('promoted'):
+            self.assertTrue(self._is_cached(self.dir_path, _TEXTS))
+
+    @parameterized.expand(_FILE_TYPES)
+    def test_per_text_checks_each_tier_then_api(self, file_type):
+        cached.embed_one('hola', data_dir=self.dir_path, file_type=file_type)
+        cached.embed_one('hello', data_dir=self.shared_path,
+                         file_type=file_type)
+        self.mock_one.reset_mock()
+
+        result = cached.embed_many(_TEXTS, per_text=True, file_type=file_type,
+                                   data_dir=[self.dir_path, self.shared_path])
+
+        with self.subTest('call'):
+            self.mock_many.assert_called_once_with(['bonjour'])
+        with self.subTest('values'):
+            np.testing.assert_array_equal(
+                result, _helpers.fake_embed_many(_TEXTS))
+        with self.subTest('promoted'):
+            self.assertTrue(
+                self._is_cached(self.dir_path, 'hello', file_type))
+        with self.subTest('written back'):
+            self.assertTrue(
+                self._is_cached(self.shared_path, 'bonjour', file_type))
+
+    def test_memory_cache_holds_promoted_entry(self):
+        cached.embed_one('hola', data_dir=self.shared_path)
+        memory_cache = embed.memory.MemoryCache(max_bytes=2**20)
+        with patch.object(cached, 'MEMORY_CACHE', memory_cache):
+            self._call_one('hola')
+            # pylint: disable-next=protected-access  # Just to get the path.
+            path = cached._build_path('hola', self.dir_path, self.file_type)
+            self.assertIsNotNone(memory_cache.get(path))
+
+    def _call_one(self, text, file_type=None):
+        """Call cached ``embed_one`` with both tiers."""
+        return cached.embed_one(text, file_type=file_type,
+                                data_dir=[self.dir_path, self.shared_path])
+
+    def _path(self, data_dir, text_or_texts, file_type=None):
+        """Get the path built for an entry in a cache directory."""
+        file_type = self.file_type if file_type is None else file_type
+        # pylint: disable-next=protected-access  # Just to get the path.
+        return cached._build_path(text_or_texts, data_dir, file_type)
+
+    def _is_cached(self, data_dir, text_or_texts, file_type=None):
+        """Check if an entry is saved in a cache directory."""
+        file_type = self.file_type if file_type is None else file_type
+        # pylint: disable-next=protected-access  # To look up without saving.
+        found = cached._load_paths(
+            'test', [self._path(data_dir, text_or_texts, file_type)],
+            file_type)
+        return bool(found)
+
+
+if __name__ == '__main__':
+    unittest.main()
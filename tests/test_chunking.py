@@ -0,0 +1,162 @@
+#!/usr/bin/env python
+
+"""
+Tests of splitting input into chunks in the ``embed.embed_many*`` functions.
+
+The function that embeds each chunk is replaced by a fake, so these tests
+check how texts are divided into requests without calling the API.
+"""
+
+from abc import abstractmethod
+import unittest
+from unittest.mock import Mock, patch
+
+import numpy as np
+
+import embed
+from tests import _bases, _helpers
+
+
+class _TestChunkingBase(_bases.TestBase):
+    """Tests of chunking and concurrency options of ``embed_many*``."""
+
+    def setUp(self):
+        """Patch the function that embeds each chunk."""
+        super().setUp()
+        self.mock_chunk = Mock(
+            side_effect=lambda texts, **_: _helpers.fake_embed_many(texts))
+        target = f'{embed.__name__}.{self.chunk_name}'
+        self.enterContext(patch(target, self.mock_chunk))
+
+    @property
+    @abstractmethod
+    def func(self):
+        """Embedding function being tested."""
+
+    @property
+    @abstractmethod
+    def chunk_name(self):
+        """Name of the function in ``embed`` that embeds a single chunk."""
+
+    @property
+    def _chunks(self):
+        """Chunks of texts the chunk embedding function was called on."""
+        calls = self.mock_chunk.call_args_list
+        return [chunk_call.args[0] for chunk_call in calls]
+
+    # pylint: disable=missing-function-docstring  # Tests' names describe them.
+
+    def test_sends_one_request_without_limits(self):
+        texts = ['a', 'b', 'c']
+        self.func(texts)
+        self.assertEqual(self._chunks, [texts])
+
+    def test_splits_by_max_items(self):
+        self.func(['a', 'b', 'c', 'd', 'e'], max_items=2)
+        self.assertEqual(self._chunks, [
+            ['a', 'b'],
+            ['c', 'd'],
+            ['e'],
+        ])
+
+    def test_splits_by_max_tokens(self):
+        texts = ['x' * 30, 'y' * 30, 'z' * 30]  # Each estimated as 11 tokens.
+        self.func(texts, max_tokens=25)
+        self.assertEqual(self._chunks, [
+            texts[:2],
+            texts[2:],
+        ])
+
+    def test_text_over_token_budget_is_sent_alone(self):
+        texts = ['a', 'x' * 300, 'b']
+        self.func(texts, max_tokens=10)
+        self.assertEqual(self._chunks, [
+            ['a'],
+            ['x' * 300],
+            ['b'],
+        ])
+
+    def test_rows_are_in_input_order(self):
+        texts = ['hola', 'hello', 'bonjour', 'ciao', 'hallo']
+        result = self.func(texts, max_items=2)
+        with self.subTest('dtype'):
+            self.assertEqual(result.dtype, np.float32)
+        with self.subTest('values'):
+            np.testing.assert_array_equal(
+                result, _helpers.fake_embed_many(texts))
+
+    def test_concurrent_chunks_cover_all_texts(self):
+        self.func(['a', 'b', 'c', 'd', 'e'], max_items=2, max_workers=3)
+        self.assertCountEqual(self._chunks, [
+            ['a', 'b'],
+            ['c', 'd'],
+            ['e'],
+        ])
+
+    def test_concurrent_rows_are_in_input_order(self):
+        texts = [f'text {index}' for index in range(50)]
+        result = self.func(texts, max_items=3, max_workers=4)
+        np.testing.assert_array_equal(result, _helpers.fake_embed_many(texts))
+
+    def test_concurrent_chunk_error_propagates(self):
+        self.mock_chunk.side_effect = RuntimeError('chunk failed')
+        with self.assertRaisesRegex(RuntimeError, r'\Achunk failed\Z'):
+            self.func(['a', 'b', 'c'], max_items=1, max_workers=2)
+
+    def test_empty_input_sends_no_requests(self):
+        result = self.func([], max_items=2)
+        with self.subTest('calls'):
+            self.mock_chunk.assert_not_called()
+        with self.subTest('shape'):
+            self.assertEqual(result.shape, (0, embed.DIMENSION))
+
+    def test_nonpositive_max_items_is_rejected(self):
+        with self.assertRaises(ValueError):
+            self.func(['a'], max_items=0)
+
+    def test_nonpositive_max_tokens_is_rejected(self):
+        with self.assertRaises(ValueError):
+            self.func(['a'], max_tokens=0)
+
+
+class TestChunkingEmbedMany(_TestChunkingBase):
+    """Tests for chunking in ``embed_many``."""
+
+    @property
+    def func(self):
+        return embed.embed_many
+
+    @property
+    def chunk_name(self):
+        return '_embed_chunk'
+
+
+class TestChunkingEmbedManyEu(_TestChunkingBase):
+    """Tests for chunking in ``embed_many_eu``."""
+
+    @property
+    def func(self):
+        return embed.embed_many_eu
+
+    @property
+    def chunk_name(self):
+        return '_embed_chunk_eu'
+
+
+class TestChunkingEmbedManyReq(_TestChunkingBase):
+    """Tests for chunking in ``embed_many_req``."""
+
+    @property
+    def func(self):
+        return embed.embed_many_req
+
+    @property
+    def chunk_name(self):
+        return '_embed_chunk_req'
+
+
+del _TestChunkingBase
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,80 @@
+#!/usr/bin/env python
+
+"""
+Tests of response decoding in ``embed_one_req`` and ``embed_many_req``.
+
+The shared session is replaced by a fake one whose responses hold fake
+embeddings, so these tests don't call the API.
+"""
+
+import unittest
+from unittest.mock import Mock, patch
+
+import numpy as np
+import orjson
+from parameterized import parameterized
+import requests
+
+import embed
+from embed import _session
+from tests import _bases, _helpers
+
+
+class TestDecoding(_bases.TestBase):
+    """Tests for decoding float and base64 embeddings from responses."""
+
+    def setUp(self):
+        """Make the ``requests``-based functions use a fake session."""
+        super().setUp()
+        self.session = Mock(requests.Session)
+        self.session.post.side_effect = self._fake_post
+        self.enterContext(patch.object(_session, '_session', self.session))
+
+    # pylint: disable=missing-function-docstring  # Tests' names describe them.
+
+    @parameterized.expand([('float',), ('base64',)])
+    def test_embed_one_req_decodes(self, encoding_format):
+        result = embed.embed_one_req('hola', encoding_format=encoding_format)
+        with self.subTest('dtype'):
+            self.assertEqual(result.dtype, np.float32)
+        with self.subTest('values'):
+            np.testing.assert_array_equal(
+                result, _helpers.fake_embed_one('hola'))
+
+    @parameterized.expand([('float',), ('base64',)])
+    def test_embed_many_req_decodes(self, encoding_format):
+        texts = ['hola', 'hello', 'bonjour']
+        result = embed.embed_many_req(texts, encoding_format=encoding_format)
+        with self.subTest('dtype'):
+            self.assertEqual(result.dtype, np.float32)
+        with self.subTest('values'):
+            np.testing.assert_array_equal(
+                result, _helpers.fake_embed_many(texts))
+
+    @parameterized.expand([('float',), ('base64',)])
+    def test_requests_encoding_format(self, encoding_format):
+        embed.embed_one_req('hola', encoding_format=encoding_format)
+        request = orjson.loads(self.session.post.call_args.kwargs['data'])
+        self.assertEqual(request['encoding_format'], encoding_format)
+
+    def test_rows_are_placed_by_index(self):
+        texts = ['hola', 'hello', 'bonjour']
+        body = orjson.loads(_helpers.fake_response_body(
+            orjson.dumps({'input': texts})))
+        body['data'].reverse()
+        self.session.post.side_effect = None
+        self.session.post.return_value = Mock(
+            status_code=200, content=orjson.dumps(body))
+
+        result = embed.embed_many_req(texts)
+
+        np.testing.assert_array_equal(result, _helpers.fake_embed_many(texts))
+
+    @staticmethod
+    def _fake_post(*, data, **_):
+        """Make a fake successful response to a request to embed texts."""
+        return Mock(status_code=200, content=_helpers.fake_response_body(data))
+
+
+if __name__ == '__main__':
+    unittest.main()
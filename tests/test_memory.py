@@ -0,0 +1,230 @@
+#!/usr/bin/env python
+
+"""
+Tests for the in-memory cache tier, ``embed.memory``.
+
+Some of these tests use it with ``embed.cached``, with a fake embedding
+function in place of ``embed.embed_one``, so they don't call the API.
+"""
+
+import concurrent.futures
+import unittest
+from unittest.mock import Mock, patch
+
+import numpy as np
+
+import embed
+from embed import cached
+from embed.memory import CacheInfo, MemoryCache
+from tests import _bases, _helpers
+
+_ROW_BYTES = embed.DIMENSION * 4
+"""Size in bytes of a single float32 embedding."""
+
+
+class TestMemoryCache(_bases.TestBase):
+    """Tests for ``MemoryCache`` itself."""
+
+    # pylint: disable=missing-function-docstring  # Tests' names describe them.
+
+    def test_get_returns_stored_values(self):
+        cache = MemoryCache()
+        cache.put('hola', _helpers.fake_embed_one('hola'))
+        np.testing.assert_array_equal(
+            cache.get('hola'), _helpers.fake_embed_one('hola'))
+
+    def test_get_returns_none_if_absent(self):
+        self.assertIsNone(MemoryCache().get('hola'))
+
+    def test_stored_array_is_a_copy(self):
+        cache = MemoryCache()
+        embedding = _helpers.fake_embed_one('hola')
+        cache.put('hola', embedding)
+        embedding[:] = 0.0
+        np.testing.assert_array_equal(
+            cache.get('hola'), _helpers.fake_embed_one('hola'))
+
+    def test_retrieved_array_is_a_writable_copy(self):
+        cache = MemoryCache()
+        cache.put('hola', _helpers.fake_embed_one('hola'))
+        cache.get('hola')[:] = 0.0
+        np.testing.assert_array_equal(
+            cache.get('hola'), _helpers.fake_embed_one('hola'))
+
+    def test_evicts_least_recently_used_first(self):
+        cache = MemoryCache(max_bytes=2 * _ROW_BYTES)
+        cache.put('a', _helpers.fake_embed_one('a'))
+        cache.put('b', _helpers.fake_embed_one('b'))
+        cache.get('a')
+        cache.put('c', _helpers.fake_embed_one('c'))
+        with self.subTest('evicted'):
+            self.assertIsNone(cache.get('b'))
+        with self.subTest('kept'):
+            self.assertIsNotNone(cache.get('a'))
+            self.assertIsNotNone(cache.get('c'))
+
+    def test_stays_within_budget(self):
+        cache = MemoryCache(max_bytes=3 * _ROW_BYTES)
+        for index in range(10):
+            cache.put(index, _helpers.fake_embed_one(str(index)))
+        with self.subTest('entries'):
+            self.assertEqual(len(cache), 3)
+        with self.subTest('bytes'):
+            self.assertEqual(cache.cache_info().current_bytes, 3 * _ROW_BYTES)
+
+    def test_does_not_store_array_bigger_than_budget(self):
+        cache = MemoryCache(max_bytes=_ROW_BYTES)
+        cache.put('a', _helpers.fake_embed_one('a'))
+        cache.put('ab', _helpers.fake_embed_many(['a', 'b']))
+        with self.subTest('big'):
+            self.assertIsNone(cache.get('ab'))
+        with self.subTest('small'):
+            self.assertIsNotNone(cache.get('a'))
+
+    def test_replacing_entry_does_not_double_count(self):
+        cache = MemoryCache()
+        cache.put('hola', _helpers.fake_embed_one('hola'))
+        cache.put('hola', _helpers.fake_embed_one('hola'))
+        self.assertEqual(cache.cache_info().current_bytes, _ROW_BYTES)
+
+    def test_counts_hits_misses_and_evictions(self):
+        cache = MemoryCache(max_bytes=_ROW_BYTES)
+        cache.get('a')
+        cache.put('a', _helpers.fake_embed_one('a'))
+        cache.get('a')
+        cache.get('a')
+        cache.put('b', _helpers.fake_embed_one('b'))
+        expected = CacheInfo(hits=2, misses=1, evictions=1,
+                             max_bytes=_ROW_BYTES, current_bytes=_ROW_BYTES)
+        self.assertEqual(cache.cache_info(), expected)
+
+    def test_clear_empties_and_resets_statistics(self):
+        cache = MemoryCache()
+        cache.put('a', _helpers.fake_embed_one('a'))
+        cache.get('a')
+        cache.clear()
+        with self.subTest('entries'):
+            self.assertEqual(len(cache), 0)
+        with self.subTest('info'):
+            self.assertEqual(cache.cache_info(), CacheInfo(
+                hits=0, misses=0, evictions=0,
+                max_bytes=cache.cache_info().max_bytes, current_bytes=0))
+
+    def test_concurrent_use_keeps_accounting_consistent(self):
+        cache = MemoryCache(max_bytes=8 * _ROW_BYTES)
+        embedding = _helpers.fake_embed_one('hola')
+
+        def work(index):
+            for step in range(200):
+                key = (index + step) % 16
+                if cache.get(key) is None:
+                    cache.put(key, embedding)
+
+        with concurrent.futures.ThreadPoolExecutor(8) as executor:
+            list(executor.map(work, range(8)))
+
+        info = cache.cache_info()
+        with self.subTest('lookups'):
+            self.assertEqual(info.hits + info.misses, 8 * 200)
+        with self.subTest('bytes'):
+            self.assertEqual(info.current_bytes, len(cache) * _ROW_BYTES)
+        with self.subTest('budget'):
+            self.assertLessEqual(info.current_bytes, info.max_bytes)
+
+    def test_negative_budget_is_rejected(self):
+        with self.assertRaises(ValueError):
+            MemoryCache(max_bytes=-1)
+
+    def test_embed_cached_has_no_memory_cache_by_default(self):
+        self.assertIsNone(cached.MEMORY_CACHE)
+
+
+class TestMemoryTier(_bases.TestDiskCachedBase):
+    """Tests for using ``MemoryCache`` in front of ``embed.cached``."""
+
+    def setUp(self):
+        """Patch ``embed_one`` with a fake, and enable a memory cache."""
+        super().setUp()
+        self.mock_one = self._patch_embedder('embed_one',
+                                             _helpers.fake_embed_one)
+        self.memory = MemoryCache()
+        self.enterContext(patch.object(cached, 'MEMORY_CACHE', self.memory))
+
+    @property
+    def func(self):
+        return cached.embed_one
+
+    @property
+    def file_type(self):
+        return cached.DEFAULT_FILE_TYPE
+
+    # pylint: disable=missing-function-docstring  # Tests' names describe them.
+
+    def test_saved_embedding_is_served_from_memory(self):
+        self._call('hola')
+        self._remove_files()
+        result = self._call('hola')
+        with self.subTest('call'):
+            self.mock_one.assert_called_once_with('hola')
+        with self.subTest('value'):
+            np.testing.assert_array_equal(
+                result, _helpers.fake_embed_one('hola'))
+
+    def test_loaded_embedding_is_served_from_memory(self):
+        self._call('hola')
+        self.memory.clear()
+        self._call('hola')  # Loads from disk.
+        self._remove_files()
+        self._call('hola')
+        self.mock_one.assert_called_once_with('hola')
+
+    def test_memory_hit_is_logged_only_at_debug_level(self):
+        self._call('hola')
+        with self.assertLogs(cached.__name__, 'DEBUG') as log_context:
+            self._call('hola')
+        self.assertEqual([record.levelname for record in log_context.records],
+                         ['DEBUG'])
+
+    def test_per_text_uses_memory(self):
+        self._call('hola')
+        self._remove_files()
+        with patch.object(embed, 'embed_many',
+                          Mock(wraps=_helpers.fake_embed_many,
+                               __name__='embed_many')) as mock_many:
+            cached.embed_many(['hola', 'hello'], data_dir=self.dir_path,
+                              per_text=True)
+        mock_many.assert_called_once_with(['hello'])
+
+    def test_not_used_if_none(self):
+        with patch.object(cached, 'MEMORY_CACHE', None):
+            self._call('hola')
+            self._remove_files()
+            self._call('hola')
+        self.assertEqual(self.mock_one.call_count, 2)
+
+    def test_mmap_mode_skips_memory(self):
+        self._call('hola')
+        result = self._call('hola', mmap_mode='r')
+        with self.subTest('mapped'):
+            self.assertIsInstance(result, np.memmap)
+        with self.subTest('hits'):
+            self.assertEqual(self.memory.cache_info().hits, 0)
+
+    def test_mapped_embedding_is_not_stored_in_memory(self):
+        self._call('hola')
+        self.memory.clear()
+        self._call('hola', mmap_mode='r')
+        self.assertEqual(self.memory.cache_info().current_bytes, 0)
+
+    def _call(self, text, **kwargs):
+        """Call cached ``embed_one`` with the temporary directory."""
+        return cached.embed_one(text, data_dir=self.dir_path, **kwargs)
+
+    def _remove_files(self):
+        """Remove all cache files from the temporary directory."""
+        for path in self.dir_path.glob(f'*.{self.file_type}'):
+            path.unlink()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,186 @@
+#!/usr/bin/env python
+
+"""
+Tests for ``embed.search``.
+
+These tests use random vectors in place of embeddings, and check results
+against those found by sorting every similarity, so they do not call the API.
+"""
+
+import unittest
+
+import numpy as np
+from parameterized import parameterized
+
+from embed import search
+from tests import _bases, _helpers
+
+_DIMENSION = 16
+"""Dimension of the random vectors these tests search among."""
+
+
+def _brute_force(embeddings, queries, k):
+    """Find the most similar rows by sorting every cosine similarity."""
+    unit = embeddings / np.linalg.norm(embeddings, axis=1, keepdims=True)
+    unit_queries = queries / np.linalg.norm(queries, axis=1, keepdims=True)
+    scores = unit_queries @ unit.T
+    indices = np.argsort(-scores, axis=1, kind='stable')[:, :k]
+    return np.take_along_axis(scores, indices, axis=1), indices
+
+
+class TestExactIndex(_bases.TestBase):
+    """Tests for ``ExactIndex``."""
+
+    def setUp(self):
+        """Make random rows to search and queries to search for."""
+        super().setUp()
+        self.embeddings = _helpers.random_matrix(100, _DIMENSION)
+        self.queries = _helpers.random_matrix(7, _DIMENSION, seed=1)
+
+    # pylint: disable=missing-function-docstring  # Tests' names describe them.
+
+    @parameterized.expand([
+        ('one block', None),
+        ('many blocks', 8),
+        ('uneven blocks', 13),
+        ('tiny blocks', 1),
+    ])
+    def test_search_matches_brute_force(self, _name, block_rows):
+        index = search.ExactIndex(self.embeddings, block_rows=block_rows)
+        scores, indices = index.search(self.queries, k=10)
+        expected_scores, expected_indices = _brute_force(
+            self.embeddings, self.queries, 10)
+        with self.subTest('indices'):
+            np.testing.assert_array_equal(indices, expected_indices)
+        with self.subTest('scores'):
+            np.testing.assert_allclose(scores, expected_scores, atol=1e-6)
+
+    @parameterized.expand([
+        ('one worker', 1, None),
+        ('two workers', 2, None),
+        ('uneven shards', 3, 8),
+        ('more workers than rows', 200, None),
+    ])
+    def test_sharded_search_matches_brute_force(self, _name, max_workers,
+                                                block_rows):
+        index = search.ExactIndex(self.embeddings, block_rows=block_rows)
+        scores, indices = index.search(self.queries, k=10,
+                                       max_workers=max_workers)
+        expected_scores, expected_indices = _brute_force(
+            self.embeddings, self.queries, 10)
+        with self.subTest('indices'):
+            np.testing.assert_array_equal(indices, expected_indices)
+        with self.subTest('scores'):
+            np.testing.assert_allclose(scores, expected_scores, atol=1e-6)
+
+    def test_nonpositive_max_workers_is_rejected(self):
+        index = search.ExactIndex(self.embeddings)
+        with self.assertRaises(ValueError):
+            index.search(self.queries, k=1, max_workers=0)
+
+    def test_scores_are_sorted(self):
+        index = search.ExactIndex(self.embeddings, block_rows=8)
+        scores, _ = index.search(self.queries, k=20)
+        self.assertTrue((np.diff(scores, axis=1) <= 0).all())
+
+    def test_ties_are_ordered_by_index(self):
+        embeddings = np.tile(_helpers.random_matrix(1, _DIMENSION), (10, 1))
+        index = search.ExactIndex(embeddings, block_rows=3)
+        query = _helpers.random_matrix(1, _DIMENSION, seed=1)
+        _, indices = index.search(query, k=10)
+        np.testing.assert_array_equal(indices, [np.arange(10)])
+
+    def test_row_finds_itself(self):
+        index = search.ExactIndex(self.embeddings, block_rows=8)
+        _, indices = index.search(self.embeddings[42] * 3.0, k=1)
+        np.testing.assert_array_equal(indices, [42])
+
+    def test_single_query_gives_vectors(self):
+        index = search.ExactIndex(self.embeddings)
+        results = index.search(self.queries[0], k=5)
+        with self.subTest('type'):
+            self.assertIsInstance(results, search.SearchResults)
+        with self.subTest('scores'):
+            self.assertEqual(results.scores.shape, (5,))
+        with self.subTest('indices'):
+            self.assertEqual(results.indices.shape, (5,))
+
+    def test_batch_gives_matrices(self):
+        index = search.ExactIndex(self.embeddings)
+        results = index.search(self.queries, k=5)
+        with self.subTest('scores'):
+            self.assertEqual(results.scores.shape, (7, 5))
+        with self.subTest('indices'):
+            self.assertEqual(results.indices.shape, (7, 5))
+
+    def test_k_above_size_gives_all_rows(self):
+        index = search.ExactIndex(self.embeddings[:5], block_rows=2)
+        _, indices = index.search(self.queries, k=10)
+        with self.subTest('shape'):
+            self.assertEqual(indices.shape, (7, 5))
+        with self.subTest('rows'):
+            np.testing.assert_array_equal(np.sort(indices, axis=1),
+                                          np.tile(np.arange(5), (7, 1)))
+
+    def test_zero_k_gives_empty_results(self):
+        index = search.ExactIndex(self.embeddings)
+        scores, indices = index.search(self.queries, k=0)
+        self.assertEqual((scores.shape, indices.shape), ((7, 0), (7, 0)))
+
+    def test_negative_k_is_rejected(self):
+        index = search.ExactIndex(self.embeddings)
+        with self.assertRaises(ValueError):
+            index.search(self.queries, k=-1)
+
+    def test_nonpositive_block_rows_is_rejected(self):
+        with self.assertRaises(ValueError):
+            search.ExactIndex(self.embeddings, block_rows=0)
+
+    def test_wrong_query_dimension_is_rejected(self):
+        index = search.ExactIndex(self.embeddings)
+        with self.assertRaises(ValueError):
+            index.search(np.ones(_DIMENSION + 1), k=1)
+
+    def test_vector_is_rejected_as_embeddings(self):
+        with self.assertRaises(ValueError):
+            search.ExactIndex(self.embeddings[0])
+
+    @parameterized.expand([
+        ('unsharded', None),
+        ('sharded', 2),
+    ])
+    def test_empty_index_gives_empty_results(self, _name, max_workers):
+        index = search.ExactIndex(np.empty((0, _DIMENSION)))
+        scores, indices = index.search(self.queries, k=3,
+                                       max_workers=max_workers)
+        self.assertEqual((scores.shape, indices.shape), ((7, 0), (7, 0)))
+
+    def test_zero_vector_scores_zero(self):
+        embeddings = np.zeros((3, _DIMENSION))
+        index = search.ExactIndex(embeddings)
+        scores, _ = index.search(self.queries[0], k=3)
+        np.testing.assert_array_equal(scores, np.zeros(3))
+
+    def test_embeddings_are_normalized_copy(self):
+        index = search.ExactIndex(self.embeddings)
+        with self.subTest('norms'):
+            np.testing.assert_allclose(
+                np.linalg.norm(index.embeddings, axis=1), 1.0, rtol=1e-6)
+        with self.subTest('dtype'):
+            self.assertEqual(index.embeddings.dtype, np.float32)
+        with self.subTest('original'):
+            self.assertFalse(np.shares_memory(index.embeddings,
+                                              self.embeddings))
+
+    def test_embeddings_are_read_only(self):
+        index = search.ExactIndex(self.embeddings)
+        with self.assertRaises(ValueError):
+            index.embeddings[0, 0] = 1.0
+
+    def test_len_and_dimension(self):
+        index = search.ExactIndex(self.embeddings)
+        self.assertEqual((len(index), index.dimension), (100, _DIMENSION))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,156 @@
+#!/usr/bin/env python
+
+"""
+Tests for ``IVFIndex`` in ``embed.search``.
+
+These tests use random clustered vectors in place of embeddings, and check
+results against those of ``ExactIndex``, so they do not call the API.
+"""
+
+from pathlib import Path
+from tempfile import TemporaryDirectory
+import unittest
+
+import numpy as np
+import safetensors.numpy
+
+from embed import search
+from tests import _bases
+
+_DIMENSION = 16
+"""Dimension of the random vectors these tests search among."""
+
+
+def _clustered_matrix(rows, seed=0):
+    """Make a matrix of random vectors near a few random centers."""
+    rng = np.random.default_rng(seed)
+    centers = rng.standard_normal((8, _DIMENSION))
+    noise = rng.standard_normal((rows, _DIMENSION))
+    return (centers[rng.integers(len(centers), size=rows)]
+            + 0.3 * noise).astype(np.float32)
+
+
+class TestIVFIndex(_bases.TestBase):
+    """Tests for ``IVFIndex``."""
+
+    def setUp(self):
+        """Make rows to search, queries, and a trained index of the rows."""
+        super().setUp()
+        self.embeddings = _clustered_matrix(400)
+        self.queries = _clustered_matrix(10, seed=1)
+        self.index = search.IVFIndex.train(self.embeddings, n_lists=8,
+                                           n_probe=2)
+        self.index.add(self.embeddings)
+
+    # pylint: disable=missing-function-docstring  # Tests' names describe them.
+
+    def test_probing_all_lists_matches_exact_search(self):
+        expected = search.ExactIndex(self.embeddings).search(self.queries, 10)
+        actual = self.index.search(self.queries, 10, n_probe=8)
+        with self.subTest('indices'):
+            np.testing.assert_array_equal(actual.indices, expected.indices)
+        with self.subTest('scores'):
+            np.testing.assert_allclose(actual.scores, expected.scores,
+                                       atol=1e-6)
+
+    def test_probing_some_lists_has_high_recall(self):
+        expected = search.ExactIndex(self.embeddings).search(self.queries, 10)
+        actual = self.index.search(self.queries, 10)
+        found = sum(len(set(row) & set(expected_row))
+                    for row, expected_row in zip(actual.indices,
+                                                 expected.indices))
+        self.assertGreaterEqual(found / expected.indices.size, 0.9)
+
+    def test_row_finds_itself(self):
+        _, indices = self.index.search(self.embeddings[42], k=1)
+        np.testing.assert_array_equal(indices, [42])
+
+    def test_n_probe_attribute_is_used_by_default(self):
+        self.index.n_probe = 8
+        expected = self.index.search(self.queries, 10, n_probe=8)
+        actual = self.index.search(self.queries, 10)
+        np.testing.assert_array_equal(actual.indices, expected.indices)
+
+    def test_add_in_parts_matches_add_at_once(self):
+        index = search.IVFIndex(self.index.centroids, n_probe=2)
+        for start in range(0, len(self.embeddings), 150):
+            index.add(self.embeddings[start:start + 150])
+            index.search(self.queries, 5)  # Merge each part as it is added.
+        with self.subTest('len'):
+            self.assertEqual(len(index), len(self.embeddings))
+        with self.subTest('results'):
+            np.testing.assert_array_equal(
+                index.search(self.queries, 10).indices,
+                self.index.search(self.queries, 10).indices)
+
+    def test_add_returns_consecutive_ids(self):
+        ids = self.index.add(self.embeddings[:3])
+        np.testing.assert_array_equal(ids, [400, 401, 402])
+
+    def test_given_ids_are_reported(self):
+        index = search.IVFIndex(self.index.centroids)
+        index.add(self.embeddings[:2], ids=[1000, 2000])
+        _, indices = index.search(self.embeddings[1], k=1)
+        np.testing.assert_array_equal(indices, [2000])
+
+    def test_wrong_number_of_ids_is_rejected(self):
+        with self.assertRaises(ValueError):
+            self.index.add(self.embeddings[:2], ids=[1])
+
+    def test_wrong_dimension_is_rejected(self):
+        with self.assertRaises(ValueError):
+            self.index.add(np.ones((1, _DIMENSION + 1)))
+
+    def test_missing_results_are_padded(self):
+        index = search.IVFIndex(np.eye(2, _DIMENSION), n_probe=1)
+        index.add(np.eye(3, _DIMENSION)[[0, 0, 1]])
+        scores, indices = index.search(np.eye(1, _DIMENSION)[0], k=3)
+        with self.subTest('indices'):
+            np.testing.assert_array_equal(indices, [0, 1, -1])
+        with self.subTest('scores'):
+            np.testing.assert_array_equal(scores, [1.0, 1.0, -np.inf])
+
+    def test_empty_index_gives_empty_results(self):
+        index = search.IVFIndex(self.index.centroids)
+        scores, indices = index.search(self.queries, 3)
+        self.assertEqual((scores.shape, indices.shape), ((10, 0), (10, 0)))
+
+    def test_nonpositive_n_probe_is_rejected(self):
+        with self.assertRaises(ValueError):
+            self.index.search(self.queries, 1, n_probe=0)
+
+    def test_too_many_lists_are_rejected(self):
+        with self.assertRaises(ValueError):
+            search.IVFIndex.train(self.embeddings[:4], n_lists=5)
+
+    def test_training_is_reproducible(self):
+        index = search.IVFIndex.train(self.embeddings, n_lists=8)
+        np.testing.assert_array_equal(index.centroids, self.index.centroids)
+
+    def test_saved_index_loads_equal(self):
+        with TemporaryDirectory() as dir_name:
+            path = Path(dir_name, 'index.safetensors')
+            self.index.save(path)
+            loaded = search.IVFIndex.load(path)
+        with self.subTest('len'):
+            self.assertEqual(len(loaded), len(self.index))
+        with self.subTest('n_probe'):
+            self.assertEqual(loaded.n_probe, self.index.n_probe)
+        with self.subTest('results'):
+            np.testing.assert_array_equal(
+                loaded.search(self.queries, 10).indices,
+                self.index.search(self.queries, 10).indices)
+
+    def test_inconsistent_file_is_rejected(self):
+        with TemporaryDirectory() as dir_name:
+            path = Path(dir_name, 'index.safetensors')
+            self.index.save(path)
+            tensors = safetensors.numpy.load_file(path)
+            tensors['ids'] = tensors['ids'][1:]
+            safetensors.numpy.save_file(tensors, path)
+            with self.assertRaises(ValueError):
+                search.IVFIndex.load(path)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,215 @@
+#!/usr/bin/env python
+
+"""
+Tests for ``MappedIndex`` in ``embed.search``.
+
+These tests use random vectors, or fake embeddings, in place of embeddings, and
+check results against those of ``ExactIndex``, so they do not call the API.
+"""
+
+import contextlib
+import io
+import unittest
+from unittest.mock import patch
+
+import numpy as np
+from parameterized import parameterized
+
+import embed
+from embed import __main__, cached, search
+from tests import _bases, _helpers
+
+_DIMENSION = 16
+"""Dimension of the random vectors these tests search among."""
+
+_TEXTS = [f'text {index}' for index in range(10)]
+"""Texts whose embeddings are indexed, or cached, by these tests."""
+
+
+class TestMappedIndex(_bases.TestDiskCachedBase):
+    """Tests for ``MappedIndex``."""
+
+    def setUp(self):
+        """Patch embedders with fakes. Make rows and queries."""
+        super().setUp()
+        self.index_path = self.dir_path / 'index'
+        self.embeddings = _helpers.random_matrix(100, _DIMENSION)
+        self.texts = [f'row {index}' for index in range(100)]
+        self.queries = _helpers.random_matrix(7, _DIMENSION, seed=1)
+        self.mock_one = self._patch_embedder('embed_one',
+                                             _helpers.fake_embed_one)
+        self.enterContext(patch.object(embed, 'embed_many',
+                                       _helpers.fake_embed_many))
+
+    @property
+    def func(self):
+        return cached.embed_one
+
+    @property
+    def file_type(self):
+        return 'safetensors'
+
+    # pylint: disable=missing-function-docstring  # Tests' names describe them.
+
+    @parameterized.expand([
+        ('one block', None),
+        ('many blocks', 8),
+        ('tiny blocks', 1),
+    ])
+    def test_search_matches_exact_index(self, _name, block_rows):
+        index = self._make_index(block_rows=block_rows)
+        index.add(self.texts, self.embeddings)
+        expected = search.ExactIndex(self.embeddings).search(self.queries, 10)
+        actual = index.search(self.queries, 10)
+        with self.subTest('indices'):
+            np.testing.assert_array_equal(actual.indices, expected.indices)
+        with self.subTest('scores'):
+            np.testing.assert_allclose(actual.scores, expected.scores,
+                                       atol=1e-6)
+
+    def test_sharded_search_matches_exact_index(self):
+        index = self._make_index(dtype='float16', block_rows=8)
+        index.add(self.texts, self.embeddings)
+        expected = index.search(self.queries, 10)
+        actual = index.search(self.queries, 10, max_workers=3)
+        np.testing.assert_array_equal(actual.indices, expected.indices)
+
+    def test_float16_scores_are_close(self):
+        index = self._make_index(dtype='float16')
+        index.add(self.texts, self.embeddings)
+        expected = search.ExactIndex(self.embeddings).search(self.queries, 10)
+        actual = index.search(self.queries, 10)
+        with self.subTest('dtype'):
+            self.assertEqual(index.embeddings.dtype, np.float16)
+        with self.subTest('scores'):
+            np.testing.assert_allclose(actual.scores, expected.scores,
+                                       atol=1e-3)
+
+    def test_adds_in_parts_are_appended(self):
+        index = self._make_index()
+        first = index.add(self.texts[:60], self.embeddings[:60])
+        second = index.add(self.texts[60:], self.embeddings[60:])
+        with self.subTest('indices'):
+            np.testing.assert_array_equal(np.concatenate([first, second]),
+                                          np.arange(100))
+        with self.subTest('rows'):
+            np.testing.assert_allclose(
+                index.embeddings,
+                search.ExactIndex(self.embeddings).embeddings)
+
+    def test_reopened_index_has_rows(self):
+        self._make_index().add(self.texts, self.embeddings)
+        index = search.MappedIndex(self.index_path)
+        with self.subTest('len'):
+            self.assertEqual(len(index), 100)
+        with self.subTest('dimension'):
+            self.assertEqual(index.dimension, _DIMENSION)
+
+    def test_reopening_with_other_dtype_is_rejected(self):
+        self._make_index()
+        with self.assertRaises(ValueError):
+            search.MappedIndex(self.index_path, dtype='float16')
+
+    def test_unknown_dtype_is_rejected(self):
+        with self.assertRaises(ValueError):
+            self._make_index(dtype='int8')
+
+    def test_mismatched_texts_are_rejected(self):
+        with self.assertRaises(ValueError):
+            self._make_index().add(self.texts[:3], self.embeddings[:2])
+
+    def test_keys_are_cache_keys_of_texts(self):
+        index = self._make_index()
+        index.add(self.texts[:2], self.embeddings[:2])
+        # pylint: disable-next=protected-access  # Just to get the keys.
+        paths = cached._build_paths(self.texts[:2], self.dir_path, 'json')
+        with self.subTest('key'):
+            self.assertEqual([bytes(key) for key in index.keys['key']],
+                             [bytes.fromhex(path.stem) for path in paths])
+        with self.subTest('row'):
+            np.testing.assert_array_equal(index.keys['row'], [0, 0])
+
+    def test_empty_index_gives_empty_results(self):
+        scores, indices = self._make_index().search(self.queries, 3)
+        self.assertEqual((scores.shape, indices.shape), ((7, 0), (7, 0)))
+
+    def test_fetch_gets_float32_rows(self):
+        index = self._make_index(dtype='float16')
+        index.add(self.texts, self.embeddings)
+        rows = index.fetch([3, 1])
+        with self.subTest('dtype'):
+            self.assertEqual(rows.dtype, np.float32)
+        with self.subTest('values'):
+            np.testing.assert_allclose(
+                rows, search.ExactIndex(self.embeddings[[3, 1]]).embeddings,
+                atol=1e-3)
+
+    def test_partial_append_is_ignored_and_truncated(self):
+        index = self._make_index()
+        index.add(self.texts[:2], self.embeddings[:2])
+        with open(self.index_path / 'embeddings.float32', 'ab') as file:
+            file.write(b'\0' * 10)
+        with open(self.index_path / 'keys', 'ab') as file:
+            file.write(b'\0' * 10)
+        with self.subTest('ignored'):
+            self.assertEqual(len(index), 2)
+        index.add(self.texts[2:3], self.embeddings[2:3])
+        with self.subTest('truncated'):
+            np.testing.assert_allclose(
+                index.embeddings,
+                search.ExactIndex(self.embeddings[:3]).embeddings)
+
+    def test_update_adds_cached_entries(self):
+        cached.embed_many(_TEXTS, data_dir=self.dir_path, per_text=True)
+        index = search.MappedIndex(self.index_path)
+        count = index.update(data_dir=self.dir_path)
+        with self.subTest('count'):
+            self.assertEqual(count, len(_TEXTS))
+        with self.subTest('found'):
+            _, indices = index.search(_helpers.fake_embed_one('text 3'), 1)
+            key = bytes(index.keys['key'][indices[0]])
+            # pylint: disable-next=protected-access  # Just to get the key.
+            path = cached._build_path('text 3', self.dir_path, 'json')
+            self.assertEqual(key, bytes.fromhex(path.stem))
+
+    def test_update_twice_adds_only_new_entries(self):
+        cached.embed_many(_TEXTS[:4], data_dir=self.dir_path, per_text=True)
+        index = search.MappedIndex(self.index_path)
+        index.update(data_dir=self.dir_path)
+        cached.embed_many(_TEXTS, data_dir=self.dir_path, per_text=True)
+        with self.subTest('count'):
+            self.assertEqual(index.update(data_dir=self.dir_path), 6)
+        with self.subTest('len'):
+            self.assertEqual(len(index), len(_TEXTS))
+
+    def test_update_adds_row_per_text_of_batch(self):
+        cached.embed_many(_TEXTS[:3], data_dir=self.dir_path)
+        index = search.MappedIndex(self.index_path)
+        index.update(data_dir=self.dir_path)
+        with self.subTest('row'):
+            np.testing.assert_array_equal(index.keys['row'], [0, 1, 2])
+        with self.subTest('key'):
+            self.assertEqual(len({bytes(key) for key in index.keys['key']}),
+                             1)
+
+    def test_command_adds_cached_entries(self):
+        cached.embed_many(_TEXTS, data_dir=self.dir_path, per_text=True)
+        with contextlib.redirect_stdout(io.StringIO()) as stdout:
+            __main__.main(['index', '--dtype', 'float16',
+                           str(self.index_path), str(self.dir_path)])
+        index = search.MappedIndex(self.index_path)
+        with self.subTest('output'):
+            self.assertIn('Added 10 embeddings', stdout.getvalue())
+        with self.subTest('len'):
+            self.assertEqual(len(index), len(_TEXTS))
+        with self.subTest('dtype'):
+            self.assertEqual(index.embeddings.dtype, np.float16)
+
+    def _make_index(self, **kwargs):
+        """Create an index of the random vectors' dimension."""
+        return search.MappedIndex(self.index_path, dimension=_DIMENSION,
+                                  **kwargs)
+
+
+if __name__ == '__main__':
+    unittest.main()
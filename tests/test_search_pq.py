@@ -0,0 +1,216 @@
+#!/usr/bin/env python
+
+"""
+Tests for ``PQIndex`` in ``embed.search``, and sampling entries to train it.
+
+These tests use random vectors, or fake embeddings, in place of embeddings,
+and check results against those of ``ExactIndex``, so they do not call the
+API.
+"""
+
+from pathlib import Path
+from tempfile import TemporaryDirectory
+import unittest
+from unittest.mock import patch
+
+import numpy as np
+
+import embed
+from embed import cached, maintenance, search
+from tests import _bases, _helpers
+
+_DIMENSION = 16
+"""Dimension of the random vectors these tests search among."""
+
+_N_SUBVECTORS = 4
+"""Number of subvectors the indexes in these tests split vectors into."""
+
+_TEXTS = [f'text {index}' for index in range(10)]
+"""Texts whose embeddings are cached by the sampling tests."""
+
+
+def _recall(indices, expected_indices):
+    """Get the fraction of expected results that were found."""
+    found = sum(len(set(row) & set(expected_row))
+                for row, expected_row in zip(indices, expected_indices))
+    return found / expected_indices.size
+
+
+class TestPQIndex(_bases.TestBase):
+    """Tests for ``PQIndex``."""
+
+    @classmethod
+    def setUpClass(cls):
+        """Train an index once, since training takes a while."""
+        super().setUpClass()
+        cls.embeddings = _helpers.random_matrix(2000, _DIMENSION)
+        cls.codebooks = search.PQIndex.train(
+            cls.embeddings, n_subvectors=_N_SUBVECTORS).codebooks
+
+    def setUp(self):
+        """Make queries, and an index of the rows."""
+        super().setUp()
+        self.queries = _helpers.random_matrix(10, _DIMENSION, seed=1)
+        self.index = search.PQIndex(self.codebooks)
+        self.index.add(self.embeddings)
+        # pylint: disable-next=consider-using-with
+        dir_name = self.enterContext(TemporaryDirectory())
+        self.path = Path(dir_name, 'index.safetensors')
+
+    # pylint: disable=missing-function-docstring  # Tests' names describe them.
+
+    def test_row_finds_itself(self):
+        _, indices = self.index.search(self.embeddings[42], k=3)
+        self.assertIn(42, indices)
+
+    def test_scores_approximate_exact_scores(self):
+        scores, indices = self.index.search(self.queries, k=5)
+        queries = search.ExactIndex(self.queries).embeddings
+        rows = search.ExactIndex(self.embeddings).embeddings[indices]
+        exact_scores = np.einsum('ij,ikj->ik', queries, rows)
+        self.assertLess(np.abs(scores - exact_scores).mean(), 0.05)
+
+    def test_reranking_improves_recall(self):
+        expected = search.ExactIndex(self.embeddings).search(self.queries, 10)
+        approximate = self.index.search(self.queries, 10)
+        reranked = self.index.search(self.queries, 10, rerank=200,
+                                     fetch=self._fetch)
+        self.assertGreater(_recall(reranked.indices, expected.indices),
+                           _recall(approximate.indices, expected.indices))
+
+    def test_reranked_scores_are_exact(self):
+        expected = search.ExactIndex(self.embeddings).search(self.queries, 10)
+        reranked = self.index.search(self.queries, 10,
+                                     rerank=len(self.embeddings),
+                                     fetch=self._fetch)
+        with self.subTest('indices'):
+            np.testing.assert_array_equal(reranked.indices, expected.indices)
+        with self.subTest('scores'):
+            np.testing.assert_allclose(reranked.scores, expected.scores,
+                                       atol=1e-6)
+
+    def test_rerank_without_fetch_is_rejected(self):
+        with self.assertRaises(ValueError):
+            self.index.search(self.queries, 10, rerank=100)
+
+    def test_fetch_of_wrong_shape_is_rejected(self):
+        with self.assertRaises(ValueError):
+            self.index.search(self.queries, 10, rerank=100,
+                              fetch=lambda ids: self.embeddings[:1])
+
+    def test_scores_are_sorted(self):
+        scores, _ = self.index.search(self.queries, k=20)
+        self.assertTrue((np.diff(scores, axis=1) <= 0).all())
+
+    def test_codes_take_a_byte_per_subvector(self):
+        self.index.save(self.path)
+        self.assertLess(self.path.stat().st_size,
+                        len(self.embeddings) * (_N_SUBVECTORS + 8)
+                        + self.codebooks.nbytes + 1000)  # Allow for header.
+
+    def test_add_in_parts_matches_add_at_once(self):
+        index = search.PQIndex(self.codebooks)
+        for start in range(0, len(self.embeddings), 700):
+            index.add(self.embeddings[start:start + 700])
+            index.search(self.queries, 5)  # Merge each part as it is added.
+        with self.subTest('len'):
+            self.assertEqual(len(index), len(self.embeddings))
+        with self.subTest('results'):
+            np.testing.assert_array_equal(
+                index.search(self.queries, 10).indices,
+                self.index.search(self.queries, 10).indices)
+
+    def test_given_ids_are_reported(self):
+        index = search.PQIndex(self.codebooks)
+        index.add(self.embeddings[:2], ids=[1000, 2000])
+        _, indices = index.search(self.embeddings[1], k=2)
+        self.assertEqual(set(indices), {1000, 2000})
+
+    def test_k_above_size_gives_all_rows(self):
+        index = search.PQIndex(self.codebooks)
+        index.add(self.embeddings[:5])
+        _, indices = index.search(self.queries, k=10)
+        self.assertEqual(indices.shape, (10, 5))
+
+    def test_empty_index_gives_empty_results(self):
+        index = search.PQIndex(self.codebooks)
+        scores, indices = index.search(self.queries, 3, rerank=10,
+                                       fetch=self._fetch)
+        self.assertEqual((scores.shape, indices.shape), ((10, 0), (10, 0)))
+
+    def test_wrong_dimension_is_rejected(self):
+        with self.assertRaises(ValueError):
+            self.index.add(np.ones((1, _DIMENSION + 1)))
+
+    def test_indivisible_dimension_is_rejected(self):
+        with self.assertRaises(ValueError):
+            search.PQIndex.train(self.embeddings, n_subvectors=5)
+
+    def test_small_sample_is_rejected(self):
+        with self.assertRaises(ValueError):
+            search.PQIndex.train(self.embeddings[:255],
+                                 n_subvectors=_N_SUBVECTORS)
+
+    def test_saved_index_loads_equal(self):
+        self.index.save(self.path)
+        loaded = search.PQIndex.load(self.path)
+        with self.subTest('len'):
+            self.assertEqual(len(loaded), len(self.index))
+        with self.subTest('results'):
+            np.testing.assert_array_equal(
+                loaded.search(self.queries, 10).indices,
+                self.index.search(self.queries, 10).indices)
+
+    def _fetch(self, ids):
+        """Get the full-precision rows with the given IDs."""
+        return self.embeddings[ids]
+
+
+class TestSampleEntries(_bases.TestDiskCachedBase):
+    """Tests for ``sample_entries``."""
+
+    def setUp(self):
+        """Patch ``embed_one`` with a fake, and cache some embeddings."""
+        super().setUp()
+        self._patch_embedder('embed_one', _helpers.fake_embed_one)
+        for text in _TEXTS:
+            cached.embed_one(text, data_dir=self.dir_path)
+
+    @property
+    def func(self):
+        return cached.embed_one
+
+    @property
+    def file_type(self):
+        return 'safetensors'
+
+    # pylint: disable=missing-function-docstring  # Tests' names describe them.
+
+    def test_sample_has_count_rows_of_cached_embeddings(self):
+        sample = maintenance.sample_entries(4, data_dir=self.dir_path)
+        expected = {tuple(_helpers.fake_embed_one(text)) for text in _TEXTS}
+        with self.subTest('shape'):
+            self.assertEqual(sample.shape, (4, embed.DIMENSION))
+        with self.subTest('rows'):
+            self.assertTrue({tuple(row) for row in sample} <= expected)
+
+    def test_sample_is_reproducible(self):
+        first = maintenance.sample_entries(4, data_dir=self.dir_path)
+        second = maintenance.sample_entries(4, data_dir=self.dir_path)
+        np.testing.assert_array_equal(first, second)
+
+    def test_sample_is_limited_by_entries(self):
+        sample = maintenance.sample_entries(100, data_dir=self.dir_path)
+        self.assertEqual(sample.shape, (len(_TEXTS), embed.DIMENSION))
+
+    def test_batch_entry_gives_a_row_per_text(self):
+        with patch.object(embed, 'embed_many', _helpers.fake_embed_many):
+            cached.embed_many(['a', 'b', 'c'], data_dir=self.dir_path,
+                              file_type='json')
+        sample = maintenance.sample_entries(100, data_dir=self.dir_path,
+                                            file_type='json')
+        self.assertEqual(sample.shape, (3, embed.DIMENSION))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,134 @@
+#!/usr/bin/env python
+
+"""
+Tests of the ``'segment'`` file type of ``embed.cached``.
+
+These tests use fake embedding functions in place of the ones in ``embed``, so
+they check how entries are appended and looked up, without calling the API.
+"""
+
+import concurrent.futures
+import unittest
+
+import numpy as np
+from parameterized import parameterized
+
+import embed
+from embed import _locking, _segment, cached
+from tests import _bases, _helpers
+
+_TEXTS = ['hola', 'hello', 'bonjour']
+"""Texts embedded together in a batch by some of these tests."""
+
+
+class TestSegment(_bases.TestStoreBase):
+    """Tests for storing cached embeddings in a segment store."""
+
+    @property
+    def store_module(self):
+        return _segment
+
+    @property
+    def file_type(self):
+        return 'segment'
+
+    # pylint: disable=missing-function-docstring  # Tests' names describe them.
+
+    def test_many_entries_share_two_files(self):
+        for index in range(20):
+            self._call_one(f'text {index}')
+        self.assertEqual(
+            sorted(path.name for path in self.dir_path.iterdir()),
+            sorted([_locking.LOCKS_DIR_NAME, _segment.DATA_FILENAME,
+                    _segment.INDEX_FILENAME]),
+        )
+
+    @parameterized.expand([('r',), ('c',)])
+    def test_entry_can_be_mapped(self, mmap_mode):
+        self._call_many(_TEXTS)
+        result = self._call_many(_TEXTS, mmap_mode=mmap_mode)
+        with self.subTest('type'):
+            self.assertIsInstance(result, np.memmap)
+        with self.subTest('values'):
+            np.testing.assert_array_equal(
+                result, _helpers.fake_embed_many(_TEXTS))
+
+    def test_sees_entries_appended_by_other_stores(self):
+        other = _segment.SegmentStore(self.dir_path)
+        self.addCleanup(other.close)
+        self._call_one('hola')  # Read the index before the other appends.
+        # pylint: disable-next=protected-access  # Just to get the key.
+        key = bytes.fromhex(cached._compute_input_hash('hello'))
+        other.put(key, _helpers.fake_embed_one('hello'))
+
+        result = self._call_one('hello')
+
+        with self.subTest('call'):
+            self.mock_one.assert_called_once_with('hola')
+        with self.subTest('values'):
+            np.testing.assert_array_equal(
+                result, _helpers.fake_embed_one('hello'))
+
+    def test_last_record_for_key_is_used(self):
+        self._call_one('hola')
+        store = _segment.get_store(self.dir_path)
+        # pylint: disable-next=protected-access  # Just to get the key.
+        key = bytes.fromhex(cached._compute_input_hash('hola'))
+        store.put(key, np.zeros(embed.DIMENSION, dtype=np.float32))
+        np.testing.assert_array_equal(
+            self._call_one('hola'), np.zeros(embed.DIMENSION))
+
+    def test_partial_index_entry_is_ignored_and_truncated(self):
+        self._call_one('hola')
+        index_path = self.dir_path / _segment.INDEX_FILENAME
+        with open(index_path, mode='ab') as index_file:
+            index_file.write(b'partial')  # As if killed while appending.
+        _segment.close_stores()
+
+        self._call_one('hello')
+        _segment.close_stores()
+        self.mock_one.reset_mock()
+
+        for text in ['hola', 'hello']:
+            with self.subTest(text=text):
+                np.testing.assert_array_equal(
+                    self._call_one(text), _helpers.fake_embed_one(text))
+        with self.subTest('calls'):
+            self.mock_one.assert_not_called()
+
+    def test_unindexed_record_is_harmless(self):
+        data_path = self.dir_path / _segment.DATA_FILENAME
+        data_path.write_bytes(b'orphaned record data')
+        self._call_one('hola')
+        self.mock_one.reset_mock()
+        np.testing.assert_array_equal(
+            self._call_one('hola'), _helpers.fake_embed_one('hola'))
+        self.mock_one.assert_not_called()
+
+    def test_concurrent_appends_from_separate_stores(self):
+        stores = [_segment.SegmentStore(self.dir_path) for _ in range(4)]
+        for store in stores:
+            self.addCleanup(store.close)
+        texts = [f'text {index}' for index in range(40)]
+
+        def append(index):
+            text = texts[index]
+            # pylint: disable-next=protected-access  # Just to get the key.
+            key = bytes.fromhex(cached._compute_input_hash(text))
+            stores[index % len(stores)].put(key, _helpers.fake_embed_one(text))
+
+        with concurrent.futures.ThreadPoolExecutor(len(stores)) as executor:
+            list(executor.map(append, range(len(texts))))
+
+        self._check_all_cached(texts)
+
+    def _corrupt(self):
+        """Overwrite the start of the first record in the data file."""
+        data_path = self.dir_path / _segment.DATA_FILENAME
+        data = bytearray(data_path.read_bytes())
+        data[:4] = b'XXXX'
+        data_path.write_bytes(data)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,95 @@
+#!/usr/bin/env python
+
+"""Tests for the shared ``requests`` session used by ``embed_*_req``."""
+
+import concurrent.futures
+import unittest
+from unittest.mock import Mock, patch
+
+import requests
+
+import embed
+from embed import _session
+from tests import _bases, _helpers
+
+
+def _fake_post(*, data, **_):
+    """Make a fake successful response for a request to embed some text."""
+    return Mock(status_code=200, content=_helpers.fake_response_body(data))
+
+
+class TestSession(_bases.TestBase):
+    """Tests for ``create_session``, ``set_session``, and related functions."""
+
+    def setUp(self):
+        """Save the shared session and start with none. Restore on cleanup."""
+        super().setUp()
+        self.enterContext(patch.object(_session, '_session', None))
+
+    # pylint: disable=missing-function-docstring  # Tests' names describe them.
+
+    def test_get_session_creates_session_once(self):
+        first = embed.get_session()
+        self.addCleanup(first.close)
+        second = embed.get_session()
+        self.assertIs(first, second)
+
+    def test_get_session_is_shared_across_threads(self):
+        with concurrent.futures.ThreadPoolExecutor(max_workers=8) as executor:
+            sessions = list(executor.map(
+                lambda _: embed.get_session(), range(32)))
+        self.addCleanup(sessions[0].close)
+        self.assertEqual(len(set(map(id, sessions))), 1)
+
+    def test_requests_use_set_session(self):
+        session = Mock(requests.Session)
+        session.post.side_effect = _fake_post
+        embed.set_session(session)
+        embed.embed_one_req('hola')
+        embed.embed_many_req(['hello'])
+        self.assertEqual(session.post.call_count, 2)
+
+    def test_close_session_closes_and_forgets_session(self):
+        session = Mock(requests.Session)
+        embed.set_session(session)
+        embed.close_session()
+        with self.subTest('closed'):
+            session.close.assert_called_once_with()
+        with self.subTest('forgotten'):
+            new_session = embed.get_session()
+            self.addCleanup(new_session.close)
+            self.assertIsNot(new_session, session)
+
+    def test_close_session_without_session_does_nothing(self):
+        embed.close_session()
+        self.assertIsNone(_session._session)  # pylint: disable=W0212
+
+    def test_created_session_pool_size(self):
+        session = embed.create_session(pool_size=7)
+        self.addCleanup(session.close)
+        # pylint: disable-next=protected-access
+        pool_maxsize = session.get_adapter('https://x')._pool_maxsize
+        self.assertEqual(pool_maxsize, 7)
+
+    def test_created_session_retries(self):
+        session = embed.create_session(max_retries=5)
+        self.addCleanup(session.close)
+        retry = session.get_adapter('https://x').max_retries
+        with self.subTest('total'):
+            self.assertEqual(retry.total, 5)
+        with self.subTest('not 429'):
+            self.assertNotIn(429, retry.status_forcelist)
+
+    def test_created_session_keeps_alive_by_default(self):
+        session = embed.create_session()
+        self.addCleanup(session.close)
+        self.assertNotEqual(session.headers.get('Connection'), 'close')
+
+    def test_created_session_can_close_after_each_request(self):
+        session = embed.create_session(keep_alive=False)
+        self.addCleanup(session.close)
+        self.assertEqual(session.headers['Connection'], 'close')
+
+
+if __name__ == '__main__':
+    unittest.main()
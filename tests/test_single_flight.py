@@ -0,0 +1,150 @@
+#!/usr/bin/env python
+
+"""
+Tests of single-flight computation of uncached embeddings in ``embed.cached``.
+
+The embedding functions in ``embed`` are replaced by slow fakes, so these tests
+check that concurrent callers wanting the same uncached embedding wait for one
+computation, without calling the API.
+"""
+
+import concurrent.futures
+import subprocess
+import sys
+import time
+import unittest
+
+import numpy as np
+
+from embed import _locking, cached
+from tests import _bases, _helpers
+
+_DELAY = 0.2
+"""Seconds each fake embedding call takes, so concurrent calls overlap."""
+
+_HOLA_BASENAME = (
+    'b58e4a60c963f8b3c43d83cc9245020ce71d8311fa2f48cfd36deed6f472a71b'
+)
+"""Filename stem that would be generated from the input ``'hola'``."""
+
+_CHILD_SCRIPT = '''
+import sys
+from embed import _locking
+print('waiting', flush=True)
+with _locking.single_flight([sys.argv[1]]):
+    pass
+'''
+"""Script for a child process that acquires, then releases, a path's locks."""
+
+
+class TestSingleFlight(_bases.TestDiskCachedBase):
+    """Tests for single-flight computation in ``embed.cached``."""
+
+    def setUp(self):
+        """Patch ``embed_one`` and ``embed_many`` with slow fakes."""
+        super().setUp()
+        self.mock_one = self._patch_embedder('embed_one',
+                                             _helpers.fake_embed_one)
+        self.mock_many = self._patch_embedder('embed_many',
+                                              _helpers.fake_embed_many)
+
+    @property
+    def func(self):
+        return cached.embed_one
+
+    @property
+    def file_type(self):
+        return 'safetensors'
+
+    # pylint: disable=missing-function-docstring  # Tests' names describe them.
+
+    def test_concurrent_misses_compute_once(self):
+        results = self._run_concurrently(self._call_one, ['hola'] * 8)
+        with self.subTest('call'):
+            self.mock_one.assert_called_once_with('hola')
+        with self.subTest('values'):
+            for result in results:
+                np.testing.assert_array_equal(
+                    result, _helpers.fake_embed_one('hola'))
+
+    def test_concurrent_misses_for_different_texts_are_not_serialized(self):
+        texts = [f'text {index}' for index in range(4)]
+        start = time.perf_counter()
+        self._run_concurrently(self._call_one, texts)
+        elapsed = time.perf_counter() - start
+        self.assertLess(elapsed, _DELAY * len(texts))
+
+    def test_concurrent_per_text_misses_compute_each_text_once(self):
+        batches = [
+            ['hola', 'hello'],
+            ['hello', 'bonjour'],
+            ['bonjour', 'hola'],
+        ]
+        results = self._run_concurrently(self._call_many_per_text, batches)
+        computed = [text for args, _ in self.mock_many.call_args_list
+                    for text in args[0]]
+        with self.subTest('computed'):
+            self.assertCountEqual(computed, ['hola', 'hello', 'bonjour'])
+        with self.subTest('values'):
+            for texts, result in zip(batches, results):
+                np.testing.assert_array_equal(
+                    result, _helpers.fake_embed_many(texts))
+
+    def test_lock_files_are_kept_apart_from_entries(self):
+        self._call_one('hola')
+        locks_dir = self.dir_path / _locking.LOCKS_DIR_NAME
+        with self.subTest('lock files'):
+            self.assertTrue(any(locks_dir.glob('*.lock')))
+        with self.subTest('entries'):
+            self.assertEqual(
+                sorted(path.name for path in self.dir_path.iterdir()),
+                [_locking.LOCKS_DIR_NAME, f'{_HOLA_BASENAME}.safetensors'],
+            )
+
+    def test_another_process_waits_for_lock(self):
+        path = self.dir_path / f'{_HOLA_BASENAME}.safetensors'
+        with _locking.single_flight([path]):
+            # pylint: disable-next=consider-using-with  # Closed below.
+            child = subprocess.Popen(
+                [sys.executable, '-c', _CHILD_SCRIPT, str(path)],
+                stdout=subprocess.PIPE,
+                text=True,
+            )
+            self.addCleanup(child.stdout.close)
+            self.assertEqual(child.stdout.readline().strip(), 'waiting')
+            with self.assertRaises(subprocess.TimeoutExpired):
+                child.wait(timeout=_DELAY * 2)
+
+        self.assertEqual(child.wait(timeout=60), 0)
+
+    def _call_one(self, text):
+        """Call cached ``embed_one`` with the temporary directory."""
+        return cached.embed_one(
+            text, data_dir=self.dir_path, file_type=self.file_type)
+
+    def _call_many_per_text(self, texts):
+        """Call cached ``embed_many`` in per-text mode."""
+        return cached.embed_many(
+            texts,
+            data_dir=self.dir_path,
+            file_type=self.file_type,
+            per_text=True,
+        )
+
+    @staticmethod
+    def _run_concurrently(func, args):
+        """Call ``func`` on each argument, each in its own thread."""
+        with concurrent.futures.ThreadPoolExecutor(len(args)) as executor:
+            return list(executor.map(func, args))
+
+    def _patch_embedder(self, name, fake):
+        """Patch a function in ``embed`` with a slow fake."""
+        def slow_fake(text_or_texts):
+            time.sleep(_DELAY)
+            return fake(text_or_texts)
+
+        return super()._patch_embedder(name, slow_fake)
+
+
+if __name__ == '__main__':
+    unittest.main()
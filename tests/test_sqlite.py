@@ -0,0 +1,132 @@
+#!/usr/bin/env python
+
+"""
+Tests of the ``'sqlite'`` file type of ``embed.cached``.
+
+These tests use fake embedding functions in place of the ones in ``embed``, so
+they check how entries are stored and looked up, without calling the API.
+"""
+
+import concurrent.futures
+import contextlib
+import sqlite3
+import unittest
+from unittest.mock import patch
+
+import numpy as np
+
+from embed import _locking, _sqlite, cached
+from tests import _bases, _helpers
+
+_TEXTS = ['hola', 'hello', 'bonjour']
+"""Texts embedded together in a batch by some of these tests."""
+
+
+class TestSqlite(_bases.TestStoreBase):
+    """Tests for storing cached embeddings in a SQLite database."""
+
+    @property
+    def store_module(self):
+        return _sqlite
+
+    @property
+    def file_type(self):
+        return 'sqlite'
+
+    # pylint: disable=missing-function-docstring  # Tests' names describe them.
+
+    def test_mmap_mode_has_no_effect(self):
+        self._call_many(_TEXTS)
+        result = self._call_many(_TEXTS, mmap_mode='r')
+        with self.subTest('type'):
+            self.assertNotIsInstance(result, np.memmap)
+        with self.subTest('values'):
+            np.testing.assert_array_equal(
+                result, _helpers.fake_embed_many(_TEXTS))
+
+    def test_entries_share_one_database(self):
+        for index in range(20):
+            self._call_one(f'text {index}')
+        names = {path.name for path in self.dir_path.iterdir()}
+        names -= {_locking.LOCKS_DIR_NAME}
+        self.assertEqual(
+            {name for name in names if not name.endswith(('-wal', '-shm'))},
+            {_sqlite.DATABASE_FILENAME},
+        )
+
+    def test_database_uses_write_ahead_logging(self):
+        self._call_one('hola')
+        mode, = self._query('PRAGMA journal_mode')
+        self.assertEqual(mode, ('wal',))
+
+    def test_per_text_looks_up_batch_in_one_query(self):
+        self._call_many(_TEXTS, per_text=True)
+        _sqlite.close_stores()
+        with patch.object(_sqlite.SqliteStore, 'get_many',
+                          autospec=True,
+                          side_effect=_sqlite.SqliteStore.get_many) as mock:
+            self._call_many(_TEXTS, per_text=True)
+        with self.subTest('lookups'):
+            mock.assert_called_once()
+        with self.subTest('keys'):
+            self.assertEqual(len(list(mock.call_args.args[1])), len(_TEXTS))
+
+    def test_per_text_looks_up_large_batch(self):
+        texts = [f'text {index}' for index in range(1234)]
+        self._call_many(texts, per_text=True)
+        self.mock_many.reset_mock()
+        result = self._call_many(texts, per_text=True)
+        with self.subTest('call'):
+            self.mock_many.assert_not_called()
+        with self.subTest('values'):
+            np.testing.assert_array_equal(
+                result, _helpers.fake_embed_many(texts))
+
+    def test_per_text_logs_each_entry(self):
+        self._call_many(_TEXTS, per_text=True)
+        with self.assertLogs(cached.__name__, 'INFO') as log_context:
+            self._call_many(_TEXTS, per_text=True)
+        self.assertEqual(len(log_context.records), len(_TEXTS))
+
+    def test_malformed_row_is_a_miss_per_text(self):
+        self._call_many(_TEXTS, per_text=True)
+        self._corrupt()
+
+        result = self._call_many(_TEXTS, per_text=True)
+
+        with self.subTest('call'):
+            self.assertEqual(self.mock_many.call_count, 2)
+        with self.subTest('values'):
+            np.testing.assert_array_equal(
+                result, _helpers.fake_embed_many(_TEXTS))
+
+    def test_concurrent_use_from_threads(self):
+        texts = [f'text {index}' for index in range(40)]
+
+        def work(index):
+            return self._call_many(texts[index::4], per_text=True)
+
+        with concurrent.futures.ThreadPoolExecutor(4) as executor:
+            list(executor.map(work, range(4)))
+
+        self._check_all_cached(texts)
+
+    def test_missing_directory_is_an_error(self):
+        with self.assertRaises(FileNotFoundError):
+            cached.embed_one('hola', data_dir=self.dir_path / 'missing',
+                             file_type=self.file_type)
+
+    def _corrupt(self):
+        """Replace every row's data with bytes of the wrong size."""
+        self._query('UPDATE embeddings SET data = ?', b'bad')
+
+    def _query(self, sql, *parameters):
+        """Run a statement on the database with its own connection."""
+        path = self.dir_path / _sqlite.DATABASE_FILENAME
+        with contextlib.closing(sqlite3.connect(path)) as connection:
+            with connection:
+                return connection.execute(sql, parameters).fetchall()
+
+
+if __name__ == '__main__':
+    unittest.main()